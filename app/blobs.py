@@ -0,0 +1,346 @@
+# Content-addressed blob storage for transcript bodies and word-level results
+# Blobs are zstd-compressed and named by the sha256 of their uncompressed content, so writing the
+# same transcript twice stores it once and a blob never changes after it was written. Rows keep a
+# pointer like "local:<sha256>" or "s3:<sha256>" together with the size and the hash, which tells
+# which store to read from even after the default store changed. Content is checked against its
+# hash as it is read, and a blob is deleted once no conversion points at it any more.
+import io
+import os
+import shutil
+import hashlib
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import zstandard
+
+from app.core.config import settings
+
+CHUNK_SIZE = 64 * 1024
+
+
+class BlobNotFound(Exception):
+    pass
+
+
+class BlobCorrupted(Exception):
+    pass
+
+
+class BlobRef:
+    def __init__(self, pointer, size, sha256):
+        self.pointer = pointer
+        self.size = size
+        self.sha256 = sha256
+
+
+class BlobStore:
+    """Keeps compressed blobs under their sha256; subclasses only move bytes."""
+
+    scheme = None
+
+    def __init__(self, level=10):
+        self.level = level
+
+    def key(self, sha256):
+        # two levels of fan-out keep directories and S3 listings small
+        return f"{sha256[:2]}/{sha256[2:4]}/{sha256}.zst"
+
+    def ref(self, data):
+        """The BlobRef bytes will have in this store, without writing them."""
+        sha256 = hashlib.sha256(data).hexdigest()
+        return BlobRef(f"{self.scheme}:{sha256}", len(data), sha256)
+
+    def put(self, data):
+        """Store bytes and return their BlobRef; content that is already stored is not written again."""
+        ref = self.ref(data)
+        if not self.exists(ref.sha256):
+            self.write(ref.sha256, io.BytesIO(zstandard.ZstdCompressor(level=self.level).compress(data)))
+        return ref
+
+    def put_file(self, source, level=None, chunk_size=CHUNK_SIZE, lock=None):
+        """Store the content of a binary file object without holding it in memory.
+
+        The content is hashed and compressed in one pass into a spooled file, which is then
+        written to the store, e.g. as an S3 multipart upload. `level` overrides the store's level.
+        `lock(pointer)` is called once the pointer is known and before the blob is looked up,
+        e.g. to take the lock_blob of the transaction that will store a row using it.
+        """
+        digest = hashlib.sha256()
+        size = 0
+        compressor = zstandard.ZstdCompressor(level=self.level if level is None else level)
+        with tempfile.SpooledTemporaryFile(max_size=16 * CHUNK_SIZE) as compressed:
+            with compressor.stream_writer(compressed, closefd=False) as writer:
+                for block in iter(lambda: source.read(chunk_size), b""):
+                    digest.update(block)
+                    size += len(block)
+                    writer.write(block)
+            sha256 = digest.hexdigest()
+            if lock is not None:
+                lock(f"{self.scheme}:{sha256}")
+            if not self.exists(sha256):
+                compressed.seek(0)
+                self.write(sha256, compressed)
+        return BlobRef(f"{self.scheme}:{sha256}", size, sha256)
+
+    def stream(self, sha256, chunk_size=CHUNK_SIZE):
+        """Yield the uncompressed content in chunks, decompressing as it is read.
+
+        Raises BlobCorrupted after the last chunk when the content does not hash to its name.
+        """
+        digest = hashlib.sha256()
+        with self.open(sha256) as compressed:
+            with zstandard.ZstdDecompressor().stream_reader(compressed) as reader:
+                while True:
+                    chunk = reader.read(chunk_size)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    yield chunk
+        if digest.hexdigest() != sha256:
+            raise BlobCorrupted(f"Blob {sha256} has the content of {digest.hexdigest()}")
+
+    def read(self, sha256):
+        return b"".join(self.stream(sha256))
+
+    def exists(self, sha256):
+        raise NotImplementedError
+
+    def write(self, sha256, compressed):
+        """Write a binary file object of the compressed blob."""
+        raise NotImplementedError
+
+    def open(self, sha256):
+        """A binary file object of the compressed blob."""
+        raise NotImplementedError
+
+    def delete(self, sha256):
+        """Remove a blob; callers make sure nothing else points at it."""
+        raise NotImplementedError
+
+
+class LocalBlobStore(BlobStore):
+    scheme = "local"
+
+    def __init__(self, root, level=10):
+        super().__init__(level)
+        self.root = root
+
+    def path(self, sha256):
+        return os.path.join(self.root, self.key(sha256))
+
+    def exists(self, sha256):
+        return os.path.exists(self.path(sha256))
+
+    def write(self, sha256, compressed):
+        path = self.path(sha256)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # written next to the target and renamed, so a reader never sees half a blob
+        fd, staging = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                shutil.copyfileobj(compressed, f, CHUNK_SIZE)
+            os.replace(staging, path)
+        except BaseException:
+            os.unlink(staging)
+            raise
+
+    def open(self, sha256):
+        try:
+            return open(self.path(sha256), "rb")
+        except FileNotFoundError:
+            raise BlobNotFound(f"Blob {sha256} is not in {self.root}")
+
+    def delete(self, sha256):
+        try:
+            os.remove(self.path(sha256))
+        except FileNotFoundError:
+            pass
+
+
+class S3BlobStore(BlobStore):
+    """Blobs in an S3-compatible bucket; boto3 is only needed when this store is configured."""
+
+    scheme = "s3"
+
+    def __init__(self, bucket, prefix="", endpoint_url=None, level=10):
+        super().__init__(level)
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.endpoint_url = endpoint_url
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                import boto3
+                self._client = boto3.client("s3", endpoint_url=self.endpoint_url)
+            return self._client
+
+    def object_key(self, sha256):
+        return f"{self.prefix}/{self.key(sha256)}" if self.prefix else self.key(sha256)
+
+    def exists(self, sha256):
+        from botocore.exceptions import ClientError
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.object_key(sha256))
+            return True
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+    def write(self, sha256, compressed):
+        # upload_fileobj switches to a multipart upload for large blobs
+        self.client.upload_fileobj(compressed, self.bucket, self.object_key(sha256),
+                                   ExtraArgs={"ContentType": "application/zstd"})
+
+    def open(self, sha256):
+        from botocore.exceptions import ClientError
+        try:
+            # the body is a stream, so large blobs are decompressed while they download
+            return self.client.get_object(Bucket=self.bucket, Key=self.object_key(sha256))["Body"]
+        except ClientError as e:
+            raise BlobNotFound(f"Blob {sha256} is not in s3://{self.bucket}/{self.prefix}") from e
+
+    def delete(self, sha256):
+        self.client.delete_object(Bucket=self.bucket, Key=self.object_key(sha256))
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(scheme=None):
+    """The configured store of a scheme, by default the one new blobs are written to."""
+    scheme = scheme or settings.BLOB_STORE
+    with _stores_lock:
+        if scheme not in _stores:
+            if scheme == LocalBlobStore.scheme:
+                _stores[scheme] = LocalBlobStore(settings.BLOB_DIR, level=settings.BLOB_ZSTD_LEVEL)
+            elif scheme == S3BlobStore.scheme:
+                if not settings.BLOB_S3_BUCKET:
+                    raise ValueError("BLOB_S3_BUCKET must be set to use the s3 blob store")
+                _stores[scheme] = S3BlobStore(settings.BLOB_S3_BUCKET, prefix=settings.BLOB_S3_PREFIX,
+                                              endpoint_url=settings.BLOB_S3_ENDPOINT_URL, level=settings.BLOB_ZSTD_LEVEL)
+            else:
+                raise ValueError(f"Unknown blob store '{scheme}'. Choose from local, s3.")
+        return _stores[scheme]
+
+
+def blob_ref(data):
+    return get_store().ref(data)
+
+
+def put_blob(data):
+    return get_store().put(data)
+
+
+def put_blob_file(source, level=None, lock=None):
+    return get_store().put_file(source, level=level, lock=lock)
+
+
+def stream_blob(pointer, chunk_size=CHUNK_SIZE):
+    scheme, sha256 = pointer.split(":", 1)
+    return get_store(scheme).stream(sha256, chunk_size)
+
+
+def read_blob(pointer):
+    scheme, sha256 = pointer.split(":", 1)
+    return get_store(scheme).read(sha256)
+
+
+def delete_blob(pointer):
+    scheme, sha256 = pointer.split(":", 1)
+    get_store(scheme).delete(sha256)
+
+
+def lock_blob(db, pointer):
+    """Hold a transaction lock on a blob, so it is not deleted between a check and the commit of a new row using it.
+
+    Only PostgreSQL has the advisory locks; with other databases, e.g. in tests, this does nothing.
+    """
+    from sqlalchemy import select, func
+
+    connection = db.connection()
+    if connection.dialect.name == "postgresql":
+        connection.execute(select(func.pg_advisory_xact_lock(func.hashtext(pointer))))
+
+
+def blob_used(pointer):
+    """Statement for whether any conversion points at a blob."""
+    from sqlalchemy import select, exists, or_
+    from app.db.models import AudioConversion
+
+    return select(exists().where(or_(AudioConversion.text_blob == pointer, AudioConversion.words_blob == pointer)))
+
+
+def release_blobs(db, pointers):
+    """Delete the blobs of `pointers` that no conversion points at any more.
+
+    Called after the deletion or update of the rows that used them was committed. Each blob is
+    checked under its lock, which rows being written take too, and the locks end with the commit.
+    """
+    pointers = sorted({pointer for pointer in pointers if pointer})
+    if not pointers:
+        return []
+    deleted = []
+    for pointer in pointers:
+        lock_blob(db, pointer)
+        if not db.execute(blob_used(pointer)).scalar():
+            delete_blob(pointer)
+            deleted.append(pointer)
+    db.commit()
+    return deleted
+
+
+def backfill(session_factory, batch_size=500, workers=8, on_batch=None):
+    """Move the inline text and words of stored conversions into the blob store; returns the rows moved.
+
+    Rows are read in id order, one batch per transaction. The blobs of a batch are compressed
+    and written in parallel, then the rows are pointed at them in a single commit, so an
+    interrupted backfill resumes where it stopped and never leaves a row without its content.
+    """
+    from sqlalchemy import or_, and_
+    from sqlalchemy.orm import undefer
+    from app.db.models import AudioConversion
+
+    def put_payloads(payloads):
+        text, words = payloads
+        return (put_blob(text.encode("utf-8")) if text is not None else None,
+                put_blob(words) if words is not None else None)
+
+    moved = 0
+    last_id = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            with session_factory() as db:
+                rows = (
+                    db.query(AudioConversion)
+                    .options(undefer(AudioConversion._words))
+                    .filter(AudioConversion.id > last_id)
+                    .filter(or_(and_(AudioConversion.text_blob.is_(None), AudioConversion._text_content.isnot(None)),
+                                and_(AudioConversion.words_blob.is_(None), AudioConversion._words.isnot(None))))
+                    .order_by(AudioConversion.id)
+                    .limit(batch_size)
+                    .all()
+                )
+                if not rows:
+                    break
+                refs = list(pool.map(put_payloads, [
+                    (row._text_content if row.text_blob is None else None, row._words if row.words_blob is None else None)
+                    for row in rows
+                ]))
+                for row, (text_ref, words_ref) in zip(rows, refs):
+                    if text_ref is not None:
+                        row.attach_blob("text", text_ref)
+                    if words_ref is not None:
+                        row.attach_blob("words", words_ref)
+                db.commit()
+                last_id = rows[-1].id
+                moved += len(rows)
+            if on_batch is not None:
+                on_batch(moved)
+    return moved
@@ -64,6 +64,111 @@ class Settings(BaseSettings):
             "JWT_AUDIENCE": values.get("JWT_AUDIENCE"),
             "JWT_ISSUER": values.get("JWT_ISSUER"),
         }
+
+    # model warm-up on startup
+    WARMUP_ON_STARTUP: bool = False
+    WARMUP_MODELS: List[str] = ["whisper", "language_id", "vad", "titanet", "msdd", "htdemucs", "punctuation"]
+    WARMUP_PROFILES: List[str] = ["accurate"]
+
+    # local model store, see model_manifest.json
+    MODEL_STORE_DIR: str = "model_store"
+    MODELS_OFFLINE: bool = False
+
+    # batched NeMo diarization
+    DIARIZATION_BATCH_SIZE: int = 8  # files per NeMo pass
+    DIARIZATION_BATCH_WAIT: float = 0.5  # seconds the first queued file waits for others
+    DIARIZATION_NUM_WORKERS: int = 2  # DataLoader workers for VAD and embedding extraction
+
+    # shared ASR scheduler
+    ASR_BATCH_SIZE: int = 8  # speech chunks of up to 30 s per batched Whisper forward pass
+    ASR_BATCH_WAIT: float = 0.1  # seconds the first queued chunk waits for other jobs
+    ASR_MAX_MODELS: int = 2  # Whisper pipelines kept loaded between jobs
+
+    # batched punctuation restoration
+    PUNCTUATION_BATCH_SIZE: int = 16  # word windows of up to 230 words per forward pass
+    PUNCTUATION_BATCH_WAIT: float = 0.05  # seconds the first queued window waits for others
+
+    # per-job scratch workspaces
+    WORKSPACE_DIR: str = "workspaces"
+    WORKSPACE_TMPFS_DIR: Optional[str] = None  # e.g. /dev/shm
+    WORKSPACE_USE_TMPFS: bool = False
+    WORKSPACE_QUOTA_MB: int = 2048
+    WORKSPACE_MAX_AGE: int = 6 * 60 * 60  # seconds before the janitor treats a workspace as orphaned
+    WORKSPACE_JANITOR_INTERVAL: int = 10 * 60
+    UPLOAD_EXPIRY: int = 24 * 60 * 60  # seconds an unfinished resumable upload is kept after its last chunk
+
+    # stage checkpoints, see diarization/checkpoints.py
+    CHECKPOINTS_ENABLED: bool = True
+    CHECKPOINT_DIR: str = "checkpoints"
+    CHECKPOINT_MAX_AGE: int = 7 * 24 * 60 * 60  # seconds a checkpoint is kept after it was last used
+    CHECKPOINT_MAX_MB: int = 20 * 1024  # the least recently used checkpoints are removed beyond this size
+    JOB_RETRIES: int = 1  # attempts after the first one when a stage fails
+
+    # silence trimming before every stage, see diarization/trimming.py
+    SILENCE_TRIM_ENABLED: bool = True
+    SILENCE_TRIM_MIN_SILENCE: float = 2.0  # seconds; shorter pauses are kept
+    SILENCE_TRIM_PADDING: float = 0.4  # seconds of silence kept around speech
+    SILENCE_TRIM_MIN_RATIO: float = 0.1  # files with less silence than this are not trimmed
+
+    # language identification before transcription, see diarization/language_id.py
+    LANGUAGE_ID_ENABLED: bool = True
+    LANGUAGE_ID_MODEL: str = "tiny"  # a small multilingual Whisper model, kept loaded
+    LANGUAGE_ID_WINDOWS: int = 3  # speech windows looked at, spread over the file
+    LANGUAGE_ID_WINDOW_SECONDS: float = 10.0
+    LANGUAGE_ID_MIN_PROBABILITY: float = 0.5  # below this the transcription model detects the language
+    ENGLISH_MODEL_ROUTES: Dict[str, str] = {"tiny": "tiny.en", "base": "base.en", "small": "small.en", "medium": "medium.en"}
+    PRELOAD_ALIGN_MODEL: bool = True  # load the alignment model of a known language while ASR runs
+
+    # wav2vec2 alignment models kept loaded between jobs, see diarization/align_cache.py
+    ALIGN_CACHE_MB: int = 4096
+    ALIGN_CACHE_PINNED: List[str] = ["en"]  # languages that are never evicted
+
+    # per-user speaker-embedding index, see diarization/speaker_index.py
+    SPEAKER_INDEX_ENABLED: bool = True
+    SPEAKER_INDEX_DIR: str = "speaker_index"
+    SPEAKER_INDEX_IVF_LISTS: int = 0  # k-means lists for large indexes; 0 searches every row
+    SPEAKER_INDEX_IVF_PROBE: int = 4  # lists searched per query
+    SPEAKER_EMBEDDING_SECONDS: float = 30.0  # speech per speaker that is embedded, longest turns first
+    SPEAKER_MATCH_THRESHOLD: float = 0.7  # cosine similarity an enrolled embedding needs to name a speaker
+    SPEAKER_MATCH_TOP_K: int = 5
+
+    # zstd blob store for transcript bodies and word-level results, see app/blobs.py
+    BLOB_STORE_ENABLED: bool = True
+    BLOB_STORE: str = "local"  # local or s3
+    BLOB_DIR: str = "blobs"
+    BLOB_ZSTD_LEVEL: int = 10
+    BLOB_S3_BUCKET: Optional[str] = None
+    BLOB_S3_PREFIX: str = "blobs"
+    BLOB_S3_ENDPOINT_URL: Optional[str] = None  # for S3-compatible stores such as MinIO
+
+    # fair-share scheduling of transcription jobs, see transcibe/scheduler.py
+    SCHEDULER_SLOTS: Optional[int] = None  # pipelines running at the same time in one process, DIARIZATION_BATCH_SIZE by default
+    SCHEDULER_AGING_RATE: float = 1.0  # seconds of expected duration forgiven per second waited
+    SCHEDULER_TIER_WEIGHTS: Dict[str, float] = {"free": 1.0, "standard": 2.0, "premium": 4.0}
+    SCHEDULER_ADMIN_WEIGHT: float = 4.0
+    DEFAULT_TIER: str = "free"
+
+    @validator("SCHEDULER_SLOTS", pre=True, always=True)
+    def assemble_scheduler_slots(cls, v: Optional[int], values: Dict[str, Any]) -> int:
+        # every job sends one file to the NeMo pass, so fewer slots than files per pass never fill it
+        if v is not None:
+            return v
+        return values.get("DIARIZATION_BATCH_SIZE") or 1
+
+    # durable job queue in PostgreSQL, worked off by `manage.py worker`, see transcibe/job_queue.py
+    JOB_QUEUE_ENABLED: bool = False  # queue /jobs and finalized uploads for workers instead of running them here
+    JOB_VISIBILITY_TIMEOUT: float = 120.0  # seconds without a heartbeat after which another worker takes the job
+    JOB_HEARTBEAT_INTERVAL: float = 15.0
+    JOB_MAX_ATTEMPTS: int = 3  # then the job is dead-lettered
+    JOB_RETRY_BACKOFF: float = 30.0  # seconds before the first retry, doubled for every further one
+    JOB_POLL_INTERVAL: float = 1.0  # seconds between polls of an idle worker
+
+    # live transcription over WebSocket
+    STREAMING_PROFILE: str = "fast"  # its Whisper model and beam size are used for the sliding window
+    STREAMING_STEP: float = 1.0  # seconds of new audio between two decodes
+    STREAMING_MAX_WINDOW: float = 15.0  # seconds of audio after which the oldest segment is finalized
+    STREAMING_FINAL_DIARIZATION: bool = True  # diarize the whole recording when the session ends
+
     class Config:
         case_sensitive = True
         env_file = ".env"
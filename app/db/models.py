@@ -1,6 +1,10 @@
-from sqlalchemy import Column, String, Integer, ForeignKey, TIMESTAMP, Boolean
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, String, Integer, Float, ForeignKey, TIMESTAMP, Boolean, LargeBinary, Computed, Index, JSON
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy import event
+from sqlalchemy.orm import relationship, deferred, Session
 from sqlalchemy.sql import text
+from app.core.config import settings
+from app.blobs import blob_ref, put_blob, read_blob, stream_blob, lock_blob
 from .database import Base
 
 class User(Base):
@@ -13,6 +17,9 @@ class User(Base):
     current_credit = Column(Integer, default=0)
     is_admin = Column(Boolean, default=False)
     is_superuser = Column(Boolean, default=False)
+    default_profile = Column(String, nullable=True)
+    # account tier; its weight in SCHEDULER_TIER_WEIGHTS is the user's share of the pipeline slots
+    tier = Column(String, nullable=True)
     created_at = Column(TIMESTAMP(timezone=True),
                         nullable=False, server_default=text('now()'))
     updated_at = Column(TIMESTAMP(timezone=True),
@@ -23,11 +30,178 @@ class AudioConversion(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     # audio_file_path = Column(String, index=True, unique=True)
-    text_content = Column(String, nullable=False)
+    # the transcript body and the word-level results are zstd blobs in app.blobs; the row keeps the
+    # pointer, the uncompressed size and the sha256. The inline columns only hold rows written with
+    # BLOB_STORE_ENABLED off or before `manage.py backfill-blobs` moved them. New blobs are only
+    # written once the row was flushed, see write_blobs, and deleted by app.blobs.release_blobs.
+    _text_content = Column("text_content", String, nullable=True)
+    text_blob = Column(String, nullable=True, index=True)
+    text_size = Column(Integer, nullable=True)
+    text_sha256 = Column(String(64), nullable=True)
+    # transcription profile used and the measured cost of the run
+    profile = Column(String, nullable=True, index=True)
+    audio_duration = Column(Float, nullable=True)  # seconds
+    processing_time = Column(Float, nullable=True)  # seconds
+    real_time_factor = Column(Float, nullable=True)  # processing_time / audio_duration
+    credits_charged = Column(Integer, nullable=True)
+    # compressed diarization.transcript.WordTranscript, to render the transcript again with other settings
+    # deferred, so listing conversions does not load it
+    _words = deferred(Column("words", LargeBinary, nullable=True))
+    words_blob = Column(String, nullable=True, index=True)
+    words_size = Column(Integer, nullable=True)
+    words_sha256 = Column(String(64), nullable=True)
+    # keys of the pipeline checkpoints in diarization.checkpoints the conversion was computed from,
+    # removed when it is deleted
+    checkpoint_keys = Column(JSON, nullable=True)
     created_at = Column(TIMESTAMP(timezone=True),
                         nullable=False, server_default=text('now()'))
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     user = relationship("User", back_populates="audio_conversions")
+
+    @property
+    def text_content(self):
+        if self.text_blob is not None:
+            return self._blob_data("text", self.text_blob).decode("utf-8")
+        return self._text_content
+
+    @text_content.setter
+    def text_content(self, value):
+        self._store("text", "_text_content", value, None if value is None else value.encode("utf-8"))
+
+    @property
+    def words(self):
+        if self.words_blob is not None:
+            return self._blob_data("words", self.words_blob)
+        return self._words
+
+    @words.setter
+    def words(self, value):
+        self._store("words", "_words", value, value)
+
+    def stream_text(self):
+        """The transcript body as UTF-8 chunks, decompressed while it is read from the store."""
+        if self.text_blob is not None:
+            if "text" in self.unwritten_blobs:
+                return iter([self.unwritten_blobs["text"]])
+            return stream_blob(self.text_blob)
+        return iter([self._text_content.encode("utf-8")] if self._text_content else [])
+
+    @property
+    def unwritten_blobs(self):
+        """{name: bytes} of the blobs set on the row that are not written yet."""
+        return self.__dict__.setdefault("_unwritten_blobs", {})
+
+    def _blob_data(self, name, pointer):
+        if name in self.unwritten_blobs:
+            return self.unwritten_blobs[name]
+        return read_blob(pointer)
+
+    def _store(self, name, column, value, data):
+        self.unwritten_blobs.pop(name, None)
+        if data is None or not settings.BLOB_STORE_ENABLED:
+            setattr(self, column, value)
+            self.attach_blob(name, None)
+        else:
+            # only the pointer is set here; the bytes are written once the row is flushed
+            self.attach_blob(name, blob_ref(data))
+            self.unwritten_blobs[name] = data
+
+    def attach_blob(self, name, ref):
+        """Point the text or words of the row at a stored blob and clear the inline column."""
+        if ref is not None:
+            setattr(self, "_text_content" if name == "text" else "_words", None)
+        setattr(self, f"{name}_blob", ref.pointer if ref else None)
+        setattr(self, f"{name}_size", ref.size if ref else None)
+        setattr(self, f"{name}_sha256", ref.sha256 if ref else None)
     
+class TranscriptSegment(Base):
+    __tablename__ = "transcript_segments"
+
+    # one speaker block of a conversion's transcript, for full-text search
+    id = Column(Integer, primary_key=True, index=True)
+    conversion_id = Column(Integer, ForeignKey("audio_conversions.id", ondelete="CASCADE"), nullable=False, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    position = Column(Integer, nullable=False)
+    speaker = Column(String, nullable=True)
+    start_time = Column(Integer, nullable=True)  # ms; unknown for conversions stored before segments
+    end_time = Column(Integer, nullable=True)  # ms
+    text = Column(String, nullable=False)
+    # maintained by PostgreSQL on insert and update; 'simple' does not stem, so any language matches
+    search_vector = Column(TSVECTOR, Computed("to_tsvector('simple', text)", persisted=True))
+    conversion = relationship("AudioConversion", back_populates="segments")
+
+    __table_args__ = (
+        Index("ix_transcript_segments_search_vector", "search_vector", postgresql_using="gin"),
+    )
+
+class TranscriptionJob(Base):
+    __tablename__ = "transcription_jobs"
+
+    # a job of the durable queue, see transcibe/job_queue.py; the id is also the public job id
+    id = Column(String(32), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    status = Column(String, nullable=False, server_default="queued")  # queued, running, done, failed or dead
+    profile = Column(String, nullable=False)
+    filename = Column(String, nullable=True)
+    options = Column(JSON, nullable=False)  # the diarization options of the request
+    audio_blob = Column(String, nullable=False)  # pointer of the uploaded audio in app.blobs
+    audio_duration = Column(Float, nullable=True)  # seconds, probed when the job was queued
+    weight = Column(Float, nullable=False, server_default="1")  # the user's share, see transcibe/scheduler.py
+    attempts = Column(Integer, nullable=False, server_default="0")
+    max_attempts = Column(Integer, nullable=False)
+    # the lease of the worker running the job; it is extended by every heartbeat
+    worker_id = Column(String, nullable=True)
+    lease_expires_at = Column(TIMESTAMP(timezone=True), nullable=True)
+    heartbeat_at = Column(TIMESTAMP(timezone=True), nullable=True)
+    # a retried job waits until available_at before it can be claimed again
+    available_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text('now()'))
+    stage = Column(String, nullable=True)
+    percent = Column(Float, nullable=True)
+    eta = Column(Float, nullable=True)
+    version = Column(Integer, nullable=False, server_default="0")  # counts the updates, for the event stream
+    conversion_id = Column(Integer, ForeignKey("audio_conversions.id", ondelete="SET NULL"), nullable=True)
+    error = Column(String, nullable=True)
+    created_at = Column(TIMESTAMP(timezone=True),
+                        nullable=False, server_default=text('now()'))
+    started_at = Column(TIMESTAMP(timezone=True), nullable=True)
+    finished_at = Column(TIMESTAMP(timezone=True), nullable=True)
+
+    __table_args__ = (
+        # partial indexes, so claiming and reaping never scan the finished jobs
+        Index("ix_transcription_jobs_claim", "available_at", postgresql_where=text("status = 'queued'")),
+        Index("ix_transcription_jobs_lease", "lease_expires_at", postgresql_where=text("status = 'running'")),
+    )
+
+    def snapshot(self):
+        return {
+            "id": self.id,
+            "status": self.status,
+            "profile": self.profile,
+            "filename": self.filename,
+            "stage": self.stage,
+            "percent": self.percent,
+            "eta": self.eta,
+            "conversion_id": self.conversion_id,
+            "error": self.error,
+        }
+
+@event.listens_for(Session, "after_flush")
+def write_blobs(session, flush_context):
+    """Write the blobs of the conversions the flush inserted or updated.
+
+    A row that fails to insert or update leaves no blob behind. The lock on each blob is held
+    until the commit, so release_blobs in another transaction does not delete it meanwhile.
+    """
+    rows = [row for row in list(session.new) + list(session.dirty)
+            if isinstance(row, AudioConversion) and row.unwritten_blobs]
+    for pointer, data in sorted((getattr(row, f"{name}_blob"), data) for row in rows for name, data in row.unwritten_blobs.items()):
+        lock_blob(session, pointer)
+        put_blob(data)
+    for row in rows:
+        row.unwritten_blobs.clear()
+
+
 # Add a back_populates relationship in the User model
 User.audio_conversions = relationship("AudioConversion", back_populates="user", cascade="all, delete-orphan")
+AudioConversion.segments = relationship("TranscriptSegment", back_populates="conversion", cascade="all, delete-orphan",
+                                        order_by=TranscriptSegment.position)
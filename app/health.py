@@ -0,0 +1,24 @@
+from fastapi import APIRouter, status
+from fastapi.responses import JSONResponse
+from diarization.warmup import readiness
+
+# Create a new APIRouter instance
+router = APIRouter()
+
+''' live: This function tells the load balancer the process is up. It does no work so it stays cheap.'''
+@router.get("/live",
+            tags=["Health"],
+            description="Liveness probe")
+def live():
+    return {"status": "ok"}
+
+''' ready: This function reports whether the models finished warming up, with per-model status and timings.'''
+@router.get("/ready",
+            tags=["Health"],
+            description="Readiness probe with per-model warm-up status and timings")
+def ready():
+    is_ready, models = readiness()
+    return JSONResponse(
+        status_code=status.HTTP_200_OK if is_ready else status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"status": "ready" if is_ready else "not ready", "models": models},
+    )
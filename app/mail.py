@@ -7,6 +7,7 @@ from email.mime.text import MIMEText
 from email.mime.base import MIMEBase
 from email.mime.multipart import MIMEMultipart
 from app import settings
+from app.metrics import smtp_send_seconds
 
 # Load SMTP server details from .env file
 smtp_server = settings.EMAIL_SERVER
@@ -43,11 +44,12 @@ def send_welcome_email(user_name, user_password, user_email, user_credit):
     msg.attach(MIMEText(message, 'plain'))
 
     # Connect to the server, login, and send the email
-    server = smtplib.SMTP(smtp_server, smtp_port)
-    server.starttls()  # Remove this line if using SSL
-    server.login(smtp_username, smtp_password)
-    server.send_message(msg)
-    server.quit()
+    with smtp_send_seconds.labels("welcome").time():
+        server = smtplib.SMTP(smtp_server, smtp_port)
+        server.starttls()  # Remove this line if using SSL
+        server.login(smtp_username, smtp_password)
+        server.send_message(msg)
+        server.quit()
     print("Email sent successfully")
 
 # Send an email to the user when the transcription is complete
@@ -80,10 +82,11 @@ def send_email(user_name, user_email, filename, file_content):
 
 
     # Connect to the server, login, and send the email
-    server = smtplib.SMTP(smtp_server, smtp_port)
-    server.starttls()  # Remove this line if using SSL
-    server.login(smtp_username, smtp_password)
-    server.send_message(msg)
-    server.quit()
+    with smtp_send_seconds.labels("transcription").time():
+        server = smtplib.SMTP(smtp_server, smtp_port)
+        server.starttls()  # Remove this line if using SSL
+        server.login(smtp_username, smtp_password)
+        server.send_message(msg)
+        server.quit()
     print("Email sent successfully")
 
@@ -3,6 +3,11 @@ from fastapi.middleware.cors import CORSMiddleware
 from .core.config import settings
 from users.api.controller import router as user_router
 from transcibe.controller import router as transcibe_router
+from diarization.warmup import start_warm_up, skip_warm_up
+from diarization import model_store
+from diarization.workspace import start_janitor
+from .health import router as health_router
+from .metrics import router as metrics_router, PrometheusMiddleware, instrument_engine
 from .db.models import User
 from .db.database import engine
 from .core.config import settings
@@ -13,6 +18,9 @@ app = FastAPI(title=settings.PROJECT_NAME, description=settings.PROJECT_NAME, ve
 # Configure CORS
 origins = settings.BACKEND_CORS_ORIGINS
 
+app.add_middleware(PrometheusMiddleware)
+instrument_engine(engine)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=[str(origin) for origin in settings.BACKEND_CORS_ORIGINS],
@@ -23,6 +31,17 @@ app.add_middleware(
 
 @app.on_event("startup")
 async def startup():
+    # In offline mode refuse to start when a required model is missing from the store
+    model_store.configure_environment()
+    if settings.MODELS_OFFLINE:
+        model_store.require_offline_artifacts()
+    # Warm the models up in the background; /health/ready reports when they are done
+    if settings.WARMUP_ON_STARTUP:
+        start_warm_up(models=settings.WARMUP_MODELS, profiles=settings.WARMUP_PROFILES)
+    else:
+        skip_warm_up()
+    # Remove scratch workspaces left behind by crashed workers, now and periodically
+    start_janitor()
     print("app started")
 
 
@@ -32,6 +51,8 @@ async def shutdown():
 
 app.include_router(user_router, prefix='/users')
 app.include_router(transcibe_router, prefix='/transcibe')
+app.include_router(health_router, prefix='/health')
+app.include_router(metrics_router)
 
 
 # if __name__ == "__main__":
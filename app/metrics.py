@@ -0,0 +1,156 @@
+import time
+from contextlib import contextmanager
+from fastapi import APIRouter, Response
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+from sqlalchemy import event
+
+# Pipeline stages take from well under a second (sentence mapping) to tens of minutes (ASR on long files)
+STAGE_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200, 2400)
+
+stage_seconds = Histogram(
+    "transcription_stage_seconds", "Time spent in each stage of the transcription pipeline.",
+    ["stage", "profile", "language"], buckets=STAGE_BUCKETS,
+)
+active_jobs = Gauge("transcription_active_jobs", "Transcription jobs currently running in this process.")
+queue_depth = Gauge("transcription_queue_depth", "Work items waiting in an internal queue.", ["queue"])
+audio_seconds = Counter(
+    "transcription_audio_seconds_total",
+    "Seconds of audio transcribed. rate() of it is audio seconds processed per wall second.",
+    ["profile"],
+)
+model_loads = Counter("model_loads_total", "Number of times a model was loaded.", ["model"])
+model_load_seconds = Histogram("model_load_seconds", "Time spent loading a model.", ["model"], buckets=STAGE_BUCKETS)
+align_cache_events = Counter(
+    "align_cache_events_total", "Alignment model cache hits, misses, admissions, evictions and rejections.", ["event"],
+)
+align_cache_bytes = Gauge("align_cache_bytes", "Bytes of the alignment models held by the cache.")
+job_wait_seconds = Histogram(
+    "transcription_job_wait_seconds", "Time a transcription job waited for a pipeline slot.", ["tier"], buckets=STAGE_BUCKETS,
+)
+job_queue_events = Counter(
+    "transcription_job_queue_events_total",
+    "Jobs of the durable queue claimed, finished, failed, retried, dead-lettered, reaped or whose lease was lost.",
+    ["event"],
+)
+
+request_seconds = Histogram("http_request_duration_seconds", "HTTP request latency per route.", ["method", "route", "status"])
+db_query_seconds = Histogram(
+    "db_query_duration_seconds", "Database query time per statement type, of queries that succeeded or failed.",
+    ["operation", "status"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+smtp_send_seconds = Histogram("smtp_send_duration_seconds", "Time spent sending an email over SMTP.", ["email"])
+streaming_step_seconds = Histogram(
+    "streaming_step_seconds", "Time spent decoding one sliding-window step of a live stream.",
+    buckets=(0.1, 0.25, 0.5, 0.75, 1, 1.5, 2, 3, 5, 10),
+)
+
+
+class StageTimer:
+    """Times the stages of one pipeline run and reports them once the language is known.
+
+    With a `progress(stage, status, **details)` callback, stage transitions are reported as
+    they happen, e.g. to the progress stream of a job.
+    """
+
+    def __init__(self, profile, progress=None):
+        self.profile = profile or "default"
+        self.language = "unknown"
+        self.durations = {}
+        self.progress = progress
+
+    def report(self, stage, status, **details):
+        if self.progress is not None:
+            self.progress(stage, status, **details)
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        self.report(name, "started")
+        try:
+            yield
+        finally:
+            self.durations[name] = self.durations.get(name, 0) + time.perf_counter() - started
+        self.report(name, "done", seconds=round(time.perf_counter() - started, 2))
+
+    def observe(self):
+        for name, seconds in self.durations.items():
+            stage_seconds.labels(name, self.profile, self.language or "unknown").observe(seconds)
+
+
+@contextmanager
+def record_model_load(model):
+    started = time.perf_counter()
+    yield
+    model_load_seconds.labels(model).observe(time.perf_counter() - started)
+    model_loads.labels(model).inc()
+
+
+def _observe_query(conn, statement, status):
+    started = conn.info["query_started"].pop()
+    operation = statement.lstrip().split(None, 1)[0].upper() if statement and statement.strip() else "UNKNOWN"
+    db_query_seconds.labels(operation, status).observe(time.perf_counter() - started)
+
+
+def instrument_engine(engine):
+    """Time every statement that goes through the SQLAlchemy engine.
+
+    A failing statement does not reach after_cursor_execute, so handle_error takes its start
+    time off the connection and records it as an error instead.
+    """
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        _observe_query(conn, statement, "ok")
+
+    @event.listens_for(engine, "handle_error")
+    def _handle_error(context):
+        conn = context.connection
+        # errors while connecting or before the statement was sent have no start time
+        if conn is not None and conn.info.get("query_started"):
+            _observe_query(conn, context.statement, "error")
+
+
+class PrometheusMiddleware:
+    """ASGI middleware recording the latency of every HTTP request, labelled by route template."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # the route template keeps the label cardinality bounded, unlike the raw path
+            route = scope.get("route")
+            request_seconds.labels(
+                scope["method"], getattr(route, "path", "unmatched"), str(status_code)
+            ).observe(time.perf_counter() - started)
+
+
+# Create a new APIRouter instance
+router = APIRouter()
+
+''' metrics: This function exposes the collected metrics in the Prometheus text format.'''
+@router.get("/metrics",
+            tags=["Metrics"],
+            description="Prometheus metrics",
+            include_in_schema=False)
+def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,148 @@
+# Cache of wav2vec2 alignment models, one per language
+# Multilingual traffic keeps coming back to the same few languages, so alignment models stay
+# loaded between jobs up to a byte budget. When a new model does not fit, the least recently
+# used ones are evicted; pinned languages are never evicted.
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from app.core.config import settings
+from app.metrics import record_model_load, align_cache_events, align_cache_bytes
+
+
+def model_bytes(model):
+    """Bytes held by the parameters and buffers of a torch module."""
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(tensor.numel() * tensor.element_size() for tensor in tensors)
+
+
+def load_alignment_model(language, device):
+    import whisperx
+    from . import model_store
+
+    with record_model_load("wav2vec2"):
+        return whisperx.load_align_model(
+            language_code=language, device=device, model_dir=model_store.align_model_dir(language)
+        )
+
+
+class AlignmentModelCache:
+    """LRU cache of (alignment_model, metadata) pairs keyed by language and device.
+
+    `get` loads a model on a miss; concurrent misses for the same language share one load.
+    A model is admitted when it fits in `budget_bytes` after evicting unpinned models in
+    least-recently-used order, otherwise it is returned to the caller without being cached.
+    Pinned languages are always admitted and never evicted.
+    """
+
+    def __init__(self, budget_bytes, pinned=(), loader=load_alignment_model, sizer=None):
+        self.budget_bytes = budget_bytes
+        self.pinned = set(pinned)
+        self.loader = loader
+        self.sizer = sizer or (lambda loaded: model_bytes(loaded[0]))
+        self._models = OrderedDict()  # (language, device) -> (loaded, size)
+        self._loading = {}  # (language, device) -> Future
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "admissions": 0, "evictions": 0, "rejections": 0}
+
+    def _count(self, event):
+        self._stats[event] += 1
+        align_cache_events.labels(event).inc()
+
+    @property
+    def size_bytes(self):
+        with self._lock:
+            return sum(size for _, size in self._models.values())
+
+    def get(self, language, device):
+        key = (language, device)
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                self._count("hits")
+                return self._models[key][0]
+            future = self._loading.get(key)
+            owner = future is None
+            if owner:
+                future = self._loading[key] = Future()
+                self._count("misses")
+        if not owner:
+            return future.result()
+
+        try:
+            loaded = self.loader(language, device)
+            self._admit(key, loaded)
+        except BaseException as e:
+            # waiting and later callers must not block on a load that will never finish
+            with self._lock:
+                self._loading.pop(key, None)
+            future.set_exception(e)
+            raise
+        future.set_result(loaded)
+        return loaded
+
+    def _admit(self, key, loaded):
+        size = self.sizer(loaded)
+        evicted = []
+        with self._lock:
+            del self._loading[key]
+            pinned = key[0] in self.pinned
+            pinned_bytes = sum(model_size for other, (_, model_size) in self._models.items() if other[0] in self.pinned)
+            if pinned or pinned_bytes + size <= self.budget_bytes:
+                used = sum(model_size for _, model_size in self._models.values())
+                for other in list(self._models):
+                    if pinned or used + size <= self.budget_bytes:
+                        break
+                    if other[0] in self.pinned:
+                        continue
+                    used -= self._models.pop(other)[1]
+                    evicted.append(other)
+                    self._count("evictions")
+                self._models[key] = (loaded, size)
+                self._count("admissions")
+            else:
+                # too big for what is left next to the pinned models, so nothing is evicted for it
+                # and the caller uses it once
+                self._count("rejections")
+            align_cache_bytes.set(sum(model_size for _, model_size in self._models.values()))
+        if evicted:
+            logging.info(f"Evicted the alignment models of {', '.join(language for language, _ in evicted)}")
+            _empty_cuda_cache()
+
+    def pin(self, language):
+        with self._lock:
+            self.pinned.add(language)
+
+    def unpin(self, language):
+        with self._lock:
+            self.pinned.discard(language)
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+            align_cache_bytes.set(0)
+        _empty_cuda_cache()
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                self._stats,
+                bytes=sum(size for _, size in self._models.values()),
+                budget_bytes=self.budget_bytes,
+                languages=[language for language, _ in self._models],
+                pinned=sorted(self.pinned),
+            )
+
+
+def _empty_cuda_cache():
+    # evicted models are only freed once running jobs drop them; this returns what is free to the driver
+    try:
+        import torch
+    except ImportError:
+        return
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+alignment_cache = AlignmentModelCache(settings.ALIGN_CACHE_MB * 1024 * 1024, pinned=settings.ALIGN_CACHE_PINNED)
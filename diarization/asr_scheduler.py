@@ -0,0 +1,145 @@
+# Shared ASR scheduler: speech chunks of concurrent jobs share Whisper's batched forward passes
+# Every job used to load its own whisperx pipeline and decode its chunks in batches of its own, so
+# a short file ran half-empty batches next to another job's. Jobs now run VAD themselves and hand
+# their chunks to one worker that keeps the pipelines loaded and fills each batch across jobs.
+import logging
+import threading
+from collections import OrderedDict
+
+from app.core.config import settings
+from app.metrics import record_model_load, queue_depth
+from .batching import BatchRequest, MicroBatcher
+
+
+def load_pipeline(model_name, device, compute_dtype, beam_size):
+    import whisperx
+    from .model_store import whisper_model_path
+
+    # numeral suppression is applied per batch by decode_chunks, not baked into the pipeline options
+    with record_model_load("whisper"):
+        pipeline = whisperx.load_model(
+            whisper_model_path(model_name),
+            device,
+            compute_type=compute_dtype,
+            asr_options={"suppress_numerals": False, "beam_size": beam_size},
+        )
+    check_pipeline(pipeline)
+    return pipeline
+
+
+def check_pipeline(pipeline):
+    """Fail when a pipeline is loaded, not in its first batch, if it lacks the whisperx internals decode_chunks uses.
+
+    whisperx is pinned to a commit in requirements.txt; another version may rename them.
+    """
+    for owner, attribute in ((pipeline, "options"), (pipeline.model, "generate_segment_batched"),
+                             (pipeline.model, "hf_tokenizer")):
+        if not hasattr(owner, attribute):
+            raise RuntimeError(f"The whisperx pipeline has no {type(owner).__name__}.{attribute}; "
+                               f"install the whisperx commit pinned in requirements.txt")
+
+
+def mel_bins(model):
+    """Mel bins the features of a faster-whisper model need: 128 for large-v3, 80 for the others."""
+    feature_size = (getattr(model, "feat_kwargs", None) or {}).get("feature_size")
+    if feature_size:
+        return feature_size
+    # faster-whisper versions without feat_kwargs keep the filter bank on the feature extractor
+    mel_filters = getattr(getattr(model, "feature_extractor", None), "mel_filters", None)
+    return mel_filters.shape[0] if mel_filters is not None else 80
+
+
+def decode_chunks(pipeline, language, suppress_numerals, chunks):
+    """One batched forward pass over up to 30 s chunks of 16 kHz audio, as whisperx's pipeline runs it."""
+    import numpy as np
+    from faster_whisper.tokenizer import Tokenizer
+    from whisperx.asr import find_numeral_symbol_tokens
+    from whisperx.audio import N_SAMPLES, log_mel_spectrogram
+
+    model = pipeline.model
+    tokenizer = Tokenizer(model.hf_tokenizer, model.model.is_multilingual, task="transcribe", language=language)
+    options = pipeline.options
+    if suppress_numerals:
+        suppress_tokens = list(set(find_numeral_symbol_tokens(tokenizer) + options.suppress_tokens))
+        options = options._replace(suppress_tokens=suppress_tokens)
+    n_mels = mel_bins(model)
+    features = np.stack([
+        log_mel_spectrogram(chunk, n_mels=n_mels, padding=N_SAMPLES - chunk.shape[0]).numpy() for chunk in chunks
+    ])
+    return model.generate_segment_batched(features, tokenizer, options)
+
+
+class ASRRequest(BatchRequest):
+    def __init__(self, model_key, language, suppress_numerals, chunks, on_segment=None):
+        # chunks of different languages or numeral settings need other decoding options, so never share a batch
+        super().__init__(chunks, key=(model_key, language, suppress_numerals))
+        self.texts = [None] * len(chunks)
+        self.on_segment = on_segment
+
+    @property
+    def chunks(self):
+        return self.items
+
+    def result(self):
+        return self.texts
+
+
+class ASRScheduler(MicroBatcher):
+    """Decodes the speech chunks of concurrent jobs with shared, batched Whisper forward passes.
+
+    Chunks are only batched with chunks of the same model, language and numeral suppression,
+    and those keys take turns. The worker waits at most `max_wait` seconds to fill a batch of
+    `max_batch_size` chunks, taking chunks from the waiting jobs in turn, and hands every job
+    its texts in chunk order. Up to `max_models` pipelines stay loaded; the least recently used
+    one is dropped first.
+    """
+
+    name = "asr-scheduler"
+
+    def __init__(self, max_batch_size=8, max_wait=0.1, max_models=2, loader=None, decoder=None):
+        super().__init__(max_batch_size, max_wait)
+        self.max_models = max_models
+        self.loader = loader or load_pipeline
+        self.decoder = decoder or decode_chunks
+        self._models = OrderedDict()  # (model_name, device, compute_dtype, beam_size) -> pipeline
+        self._models_lock = threading.Lock()
+
+    def model(self, model_name, device, compute_dtype, beam_size=5):
+        """The loaded pipeline for a model; jobs use it for VAD and language detection."""
+        key = (model_name, device, compute_dtype, beam_size)
+        with self._models_lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                return self._models[key]
+            pipeline = self._models[key] = self.loader(*key)
+            while len(self._models) > self.max_models:
+                evicted, _ = self._models.popitem(last=False)
+                logging.info(f"Unloaded the Whisper pipeline of {evicted[0]}")
+            return pipeline
+
+    def submit(self, model_key, language, suppress_numerals, chunks, on_segment=None):
+        """Queue the chunks of one file; the Future resolves to their texts in order.
+
+        `on_segment(index)` is called from the worker as every chunk is decoded, in chunk order.
+        """
+        return self.submit_request(ASRRequest(tuple(model_key), language, suppress_numerals, list(chunks), on_segment))
+
+    def run_batch(self, key, chunks):
+        model_key, language, suppress_numerals = key
+        return self.decoder(self.model(*model_key), language, suppress_numerals, chunks)
+
+    def deliver(self, request, index, text):
+        request.texts[index] = text
+        if request.on_segment is not None:
+            try:
+                request.on_segment(index)
+            except Exception:
+                logging.exception("ASR progress callback failed")
+
+
+asr_scheduler = ASRScheduler(
+    max_batch_size=settings.ASR_BATCH_SIZE,
+    max_wait=settings.ASR_BATCH_WAIT,
+    max_models=settings.ASR_MAX_MODELS,
+)
+queue_depth.labels("asr").set_function(asr_scheduler.queue_depth)
@@ -0,0 +1,54 @@
+# Diarization backends, selectable per job
+# Every backend runs NeMo on a config built by helper.create_config and leaves one
+# RTTM per manifest entry in <out_dir>/pred_rttms.
+from app.metrics import record_model_load
+
+
+class DiarizationBackend:
+    name = None
+    description = None
+
+    def diarize(self, config):
+        raise NotImplementedError
+
+
+class MSDDBackend(DiarizationBackend):
+    name = "msdd"
+    description = "VAD, TitaNet embeddings, clustering and MSDD refinement. Most accurate, needs a GPU to be fast."
+
+    def diarize(self, config):
+        import torch
+        from nemo.collections.asr.models.msdd_models import NeuralDiarizer
+
+        with record_model_load("msdd"):
+            msdd_model = NeuralDiarizer(cfg=config)
+        msdd_model.diarize()
+        del msdd_model
+        torch.cuda.empty_cache()
+
+
+class ClusteringBackend(DiarizationBackend):
+    name = "clustering"
+    description = "VAD, TitaNet embeddings and clustering without the MSDD refinement. Much faster on CPU."
+
+    def diarize(self, config):
+        import torch
+        from nemo.collections.asr.models import ClusteringDiarizer
+
+        with record_model_load("clustering"):
+            clustering_model = ClusteringDiarizer(cfg=config)
+        clustering_model.diarize()
+        del clustering_model
+        torch.cuda.empty_cache()
+
+
+backends = {backend.name: backend() for backend in (MSDDBackend, ClusteringBackend)}
+
+DEFAULT_BACKEND = MSDDBackend.name
+
+
+def get_backend(name=None):
+    name = name or DEFAULT_BACKEND
+    if name not in backends:
+        raise ValueError(f"Unknown diarization backend '{name}'. Choose from {', '.join(backends)}.")
+    return backends[name]
@@ -0,0 +1,157 @@
+# Micro-batching for the shared model workers: items of concurrent jobs share one forward pass
+# The ASR scheduler and the punctuation service both queue requests of many items (speech chunks,
+# word windows) and run one worker thread that fills each batch with items of the waiting requests.
+import time
+import queue
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class BatchRequest:
+    """The items of one job; items of requests with the same key can share a batch."""
+
+    def __init__(self, items, key=None):
+        self.key = key
+        self.items = items
+        self.pending = len(items)
+        self.future = Future()
+
+    def result(self):
+        """What the future resolves to once every item was delivered."""
+        raise NotImplementedError
+
+
+class MicroBatcher:
+    """Runs batches of up to `max_batch_size` items of concurrent requests on one worker thread.
+
+    The worker waits at most `max_wait` seconds to fill a batch and takes one item of every
+    waiting request in turn, so a long request does not hold back short ones. A batch only has
+    items of one key, and the keys take turns: the waiting key that was served longest ago goes
+    next, so a steady stream of requests with one key does not starve the others.
+
+    Subclasses decode a batch in `run_batch` and store each result in `deliver`. A failing batch
+    fails the requests it had items of, a failing delivery fails its request, and an error while
+    collecting a batch fails the waiting requests; the worker itself keeps running.
+    """
+
+    name = "micro-batcher"
+
+    def __init__(self, max_batch_size, max_wait):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._waiting = OrderedDict()  # request -> index of its next item
+        self._served = {}  # key -> number of the last batch it had
+        self._batches = 0
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def run_batch(self, key, items):
+        """The results of a batch of items of one key, in order."""
+        raise NotImplementedError
+
+    def deliver(self, request, index, result):
+        """Store the result of item `index` of a request."""
+        raise NotImplementedError
+
+    def submit_request(self, request):
+        if not request.items:
+            request.future.set_result(request.result())
+            return request.future
+        self._queue.put(request)
+        self._ensure_worker()
+        return request.future
+
+    def queue_depth(self):
+        return self._queue.qsize() + len(self._waiting)
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def _take(self, block, timeout=None):
+        try:
+            request = self._queue.get(block=block, timeout=timeout)
+        except queue.Empty:
+            return False
+        self._waiting[request] = 0
+        return True
+
+    def _pending(self, key):
+        return sum(len(request.items) - index for request, index in self._waiting.items() if request.key == key)
+
+    def _next_key(self):
+        keys = list(OrderedDict.fromkeys(request.key for request in self._waiting))
+        self._served = {key: self._served[key] for key in keys if key in self._served}
+        # keys that were not served while they waited go first, by their oldest request
+        return min(keys, key=lambda key: self._served.get(key, -1))
+
+    def _next_batch(self):
+        if not self._waiting:
+            self._take(block=True)
+        while self._take(block=False):
+            pass
+        key = self._next_key()
+        deadline = time.monotonic() + self.max_wait
+        while self._pending(key) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self._take(block=True, timeout=remaining):
+                break
+        while self._take(block=False):
+            pass
+
+        # one item per request in turn until the batch is full
+        batch = []
+        while len(batch) < self.max_batch_size:
+            requests = [request for request in self._waiting if request.key == key]
+            if not requests:
+                break
+            for request in requests:
+                if len(batch) == self.max_batch_size:
+                    break
+                index = self._waiting[request]
+                batch.append((request, index))
+                if index + 1 == len(request.items):
+                    del self._waiting[request]
+                else:
+                    self._waiting[request] = index + 1
+        self._served[key] = self._batches
+        self._batches += 1
+        return key, batch
+
+    def _run(self):
+        while True:
+            try:
+                key, batch = self._next_batch()
+            except Exception as e:
+                logging.exception(f"The {self.name} could not collect a batch")
+                self._fail(list(self._waiting), e)
+                continue
+            try:
+                results = self.run_batch(key, [request.items[index] for request, index in batch])
+            except Exception as e:
+                logging.exception(f"A batch of the {self.name} failed")
+                self._fail({request for request, _ in batch}, e)
+                continue
+
+            for (request, index), result in zip(batch, results):
+                if request.future.done():
+                    continue
+                try:
+                    self.deliver(request, index, result)
+                except Exception as e:
+                    self._fail({request}, e)
+                    continue
+                request.pending -= 1
+                if request.pending == 0:
+                    request.future.set_result(request.result())
+
+    def _fail(self, requests, error):
+        for request in requests:
+            self._waiting.pop(request, None)
+            if not request.future.done():
+                request.future.set_exception(error)
@@ -0,0 +1,179 @@
+# Stage checkpoints of the transcription pipeline
+# The artifact of every stage is stored under a key derived from the hash of the input audio,
+# the stage's parameters and the keys of the stages it was computed from. A retried job, or the
+# same audio submitted again with the same options, skips every stage with a valid checkpoint.
+# Checkpoints that were not used for CHECKPOINT_MAX_AGE seconds are garbage-collected, the least
+# recently used ones go first when the store outgrows CHECKPOINT_MAX_MB, and a conversion records
+# the keys it used, so deleting it also deletes the stems, segments and embeddings of its audio.
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import tempfile
+
+from app.core.config import settings
+from .workspace import disk_usage
+
+CHECKPOINT_VERSION = 2  # bump when the format of a stage artifact changes
+META_FILE = "meta.json"
+ARTIFACT = "artifact"
+STAGING_PREFIX = ".tmp-"
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _to_json(value):
+    # numpy scalars and arrays in the whisper and whisperx results
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    raise TypeError(f"{type(value).__name__} can not be checkpointed")
+
+
+class CheckpointStore:
+    """Directory of stage artifacts, one `<root>/<key[:2]>/<key>/` directory per checkpoint.
+
+    A checkpoint is written to a staging directory and renamed into place, so readers never
+    see a partial one. Failing to read or write a checkpoint never fails the job: the stage
+    is simply computed. `keys` are the checkpoints that were loaded or saved through this object.
+    """
+
+    def __init__(self, root=None, max_age=None, max_bytes=None):
+        self.root = os.path.abspath(root or settings.CHECKPOINT_DIR)
+        self.max_age = settings.CHECKPOINT_MAX_AGE if max_age is None else max_age
+        self.max_bytes = settings.CHECKPOINT_MAX_MB * 1024 * 1024 if max_bytes is None else max_bytes
+        self.keys = set()
+
+    @staticmethod
+    def key(stage, *inputs, **params):
+        """Key of a stage artifact computed from `inputs` (the input hash or upstream keys) with `params`."""
+        payload = {"version": CHECKPOINT_VERSION, "stage": stage, "inputs": inputs, "params": params}
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+    def _dir(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def _artifact(self, key):
+        """Path of the artifact of a valid checkpoint, or None. Using a checkpoint renews it."""
+        directory = self._dir(key)
+        meta_path = os.path.join(directory, META_FILE)
+        try:
+            if time.time() - os.path.getmtime(meta_path) > self.max_age:
+                return None
+            name = next(name for name in os.listdir(directory) if name.startswith(ARTIFACT))
+            os.utime(meta_path)
+        except (OSError, StopIteration):
+            return None
+        self.keys.add(key)
+        return os.path.join(directory, name)
+
+    def load(self, key):
+        """The JSON artifact of a valid checkpoint, or None."""
+        path = self._artifact(key)
+        if path is None:
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            logging.warning(f"Checkpoint {key} is unreadable, removing it")
+            shutil.rmtree(self._dir(key), ignore_errors=True)
+            return None
+
+    def load_file(self, key):
+        """Path of the file artifact of a valid checkpoint, or None."""
+        return self._artifact(key)
+
+    def _commit(self, key, stage, write):
+        staging = None
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            staging = tempfile.mkdtemp(prefix=STAGING_PREFIX, dir=self.root)
+            write(staging)
+            with open(os.path.join(staging, META_FILE), "w") as f:
+                json.dump({"stage": stage, "version": CHECKPOINT_VERSION, "created": time.time()}, f)
+            target = self._dir(key)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.rmtree(target, ignore_errors=True)  # an expired or unreadable one
+            os.rename(staging, target)
+            self.keys.add(key)
+        except (OSError, TypeError, ValueError) as e:
+            # e.g. a concurrent job with the same input committed the checkpoint first
+            logging.warning(f"Could not checkpoint the {stage} stage: {e}")
+        finally:
+            if staging is not None:
+                shutil.rmtree(staging, ignore_errors=True)
+
+    def save(self, key, stage, value):
+        def write(staging):
+            with open(os.path.join(staging, ARTIFACT + ".json"), "w", encoding="utf-8") as f:
+                json.dump(value, f, default=_to_json)
+        self._commit(key, stage, write)
+
+    def save_file(self, key, stage, path):
+        def write(staging):
+            shutil.copyfile(path, os.path.join(staging, ARTIFACT + os.path.splitext(path)[1]))
+        self._commit(key, stage, write)
+
+    def purge(self, keys):
+        """Remove the checkpoints of `keys`, e.g. of a deleted conversion, and return their paths."""
+        removed = []
+        for key in keys or ():
+            directory = self._dir(key)
+            if os.path.isdir(directory):
+                shutil.rmtree(directory, ignore_errors=True)
+                removed.append(directory)
+        return removed
+
+    def sweep(self):
+        """Remove expired checkpoints and abandoned staging directories, then the least recently used
+        checkpoints until the store fits in max_bytes, and return their paths."""
+        removed = []
+        if not os.path.isdir(self.root):
+            return removed
+        now = time.time()
+        kept = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name.startswith(STAGING_PREFIX):
+                candidates = [path]
+            elif os.path.isdir(path):
+                candidates = [os.path.join(path, key) for key in os.listdir(path)]
+            else:
+                continue
+            for candidate in candidates:
+                meta_path = os.path.join(candidate, META_FILE)
+                try:
+                    used = os.path.getmtime(meta_path if os.path.exists(meta_path) else candidate)
+                except FileNotFoundError:
+                    continue
+                if now - used > self.max_age:
+                    shutil.rmtree(candidate, ignore_errors=True)
+                    removed.append(candidate)
+                elif not name.startswith(STAGING_PREFIX):
+                    kept.append((used, disk_usage(candidate), candidate))
+        total = sum(size for _, size, _ in kept)
+        for used, size, candidate in sorted(kept):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(candidate, ignore_errors=True)
+            removed.append(candidate)
+            total -= size
+        if removed:
+            logging.info(f"Removed {len(removed)} expired or least recently used checkpoints")
+        return removed
+
+
+def sweep_expired(max_age=None):
+    return CheckpointStore(max_age=max_age).sweep()
+
+
+def purge_checkpoints(keys):
+    return CheckpointStore().purge(keys)
@@ -1,143 +1,321 @@
 # Run on GPU with FP16
-import os
+# torch, whisperx, NeMo and the punctuation model are imported inside the functions that
+# use them, so API-only processes can import this module without loading the ML stack.
 import re
-import tempfile
-import torch
-import whisperx
+import time
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor
 # import soundfile
 from pydub import AudioSegment
-from deepmultilingualpunctuation import PunctuationModel
-from nemo.collections.asr.models.msdd_models import NeuralDiarizer
 
-from .speaker import speaker_mapper
+from app.core.config import settings
+from app.metrics import StageTimer, active_jobs, audio_seconds
+from . import model_store
+from .service import diarization_service
 from .processing import processing
-from .transcription import transcribe, transcribe_batched
-from .helper import ( get_realigned_ws_mapping_with_punctuation, 
-                    create_config, get_words_speaker_mapping,
-                    get_sentences_speaker_mapping,
-                    get_speaker_aware_transcript,
-                    cleanup, write_srt,
-                    wav2vec2_langs, punct_model_langs)
-
-def align_timestamps(language, whisper_results, vocal_target, device):
-        if language in wav2vec2_langs:
-            alignment_model, metadata = whisperx.load_align_model(
-                language_code=language, device=device
-            )
+from .profiles import get_profile
+from .workspace import Workspace
+from .checkpoints import CheckpointStore, file_hash
+from .timeline import SpeakerTimeline
+from .transcript import WordTranscript
+from .trimming import OffsetMap, plan_trim, trim_silence
+from .speaker_index import speaker_embeddings
+from .streaming import titanet_embedder
+from .language_id import identify_language, route_whisper_model
+from .align_cache import alignment_cache
+from .punctuation import punctuation_service
+from .transcription import transcribe as transcribe_unbatched, transcribe_batched
+from .helper import get_words_speaker_mapping, wav2vec2_langs, punct_model_langs
+
+_preload_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="align-preload")
+
+def preload_alignment_model(language, device):
+    """Start loading the alignment model of a language into the cache, e.g. while ASR runs."""
+    return _preload_executor.submit(alignment_cache.get, language, device)
+
+def align_timestamps(language, whisper_results, vocal_target, device, align=True, preloaded=None):
+        if align and language in wav2vec2_langs:
+            import whisperx
+            # the model is preloaded only when the language was known before ASR, so it is the right one
+            # it stays in the alignment cache for the next job in this language
+            if preloaded is not None:
+                alignment_model, metadata = preloaded.result()
+            else:
+                alignment_model, metadata = alignment_cache.get(language, device)
             result_aligned = whisperx.align(
                 whisper_results, alignment_model, metadata, vocal_target, device
             )
             word_timestamps = result_aligned["word_segments"]
-            # clear gpu vram
-            del alignment_model
-            torch.cuda.empty_cache()
         else:
             word_timestamps = []
             for segment in whisper_results:
                 for word in segment["words"]:
-                    word_timestamps.append({"text": word[2], "start": word[0], "end": word[1]})
+                    word_timestamps.append({"word": word[2], "start": word[0], "end": word[1]})
         return word_timestamps
 
-def punctuation_model(language, wsm, whisper_results):
-    if language in punct_model_langs:
-        # restoring punctuation in the transcript to help realign the sentences
-        punct_model = PunctuationModel(model="kredor/punctuate-all")
-        words_list = list(map(lambda x: x["word"], wsm))
-        labled_words = punct_model.predict(words_list)
-
-        ending_puncts = ".?!"
-        model_puncts = ".,;:!?"
-
-        # We don't want to punctuate U.S.A. with a period. Right?
-        is_acronym = lambda x: re.fullmatch(r"\b(?:[a-zA-Z]\.){2,}", x)
-        for word_dict, labeled_tuple in zip(wsm, labled_words):
-            word = word_dict["word"]
-            if (
-                word
-                and labeled_tuple[1] in ending_puncts
-                and (word[-1] not in model_puncts or is_acronym(word))
-            ):
-                word += labeled_tuple[1]
-                if word.endswith(".."):
-                    word = word.rstrip(".")
-                word_dict["word"] = word
-
-        wsm_update = get_realigned_ws_mapping_with_punctuation(wsm)
-        return wsm_update
-    else:
+def apply_punctuation(language, words):
+    """Restore sentence-ending punctuation in a list of words and return the new list.
+
+    Realigning the speakers to the restored sentences is left to WordTranscript.render,
+    so a transcript can be realigned again with other settings.
+    """
+    if language not in punct_model_langs:
         print(
-            f'Punctuation restoration is not available for {whisper_results["language"]} language.'
+            f'Punctuation restoration is not available for {language} language.'
         )
+        return list(words)
+
+    # restoring punctuation in the transcript to help realign the sentences
+    # the service batches the word windows of concurrent jobs through one loaded model
+    labled_words = punctuation_service.predict(words)
+
+    ending_puncts = ".?!"
+    model_puncts = ".,;:!?"
+
+    # We don't want to punctuate U.S.A. with a period. Right?
+    is_acronym = lambda x: re.fullmatch(r"\b(?:[a-zA-Z]\.){2,}", x)
+    punctuated = []
+    for word, labeled_tuple in zip(words, labled_words):
+        if (
+            word
+            and labeled_tuple[1] in ending_puncts
+            and (word[-1] not in model_puncts or is_acronym(word))
+        ):
+            word += labeled_tuple[1]
+            if word.endswith(".."):
+                word = word.rstrip(".")
+        punctuated.append(word)
+    return punctuated
+
+def _plan_trim(audio_path):
+    offsets = plan_trim(audio_path, settings.SILENCE_TRIM_MIN_SILENCE, settings.SILENCE_TRIM_PADDING,
+                        settings.SILENCE_TRIM_MIN_RATIO)
+    return offsets.to_list() if offsets is not None else None
+
+def checkpointed(checkpoints, key, stage, timer, compute):
+    """Run a stage, or load its artifact when `checkpoints` has a valid one for `key`."""
+    value = checkpoints.load(key) if checkpoints is not None else None
+    if value is not None:
+        timer.report(stage, "cached")
+        return value
+    with timer.stage(stage):
+        value = compute()
+    if checkpoints is not None:
+        checkpoints.save(key, stage, value)
+    return value
+
+def asr_progress(timer, duration):
+    """Callback that reports ASR progress as the end time of the last decoded segment against the audio duration."""
+    if timer.progress is None or not duration:
+        return None
+    started = time.perf_counter()
+
+    def on_segment(end):
+        fraction = min(end / duration, 1.0)
+        elapsed = time.perf_counter() - started
+        timer.report("asr", "running", percent=round(fraction * 100, 1),
+                     eta=round(elapsed / fraction - elapsed, 1) if fraction else None)
+    return on_segment
 
 def whisper_model(whisper_model_name, 
                    vocal_target, speaker_ts, device, compute_type,
                    language=None, suppress_numerals=False, 
-                    batch_size=8):
+                    batch_size=8, beam_size=5, align=True, punctuate=True, timer=None, duration=None,
+                    checkpoints=None, vocals_key=None, preloaded=None):
+    timer = timer or StageTimer(None)
+    on_segment = asr_progress(timer, duration)
+
     # Transcribe the audio file
-    if batch_size != 0:
-        whisper_results, language = transcribe_batched(
-            vocal_target,
-            language,
-            batch_size,
-            whisper_model_name,
-            compute_type,
-            suppress_numerals,
-            device,
-        )
-    else:
-        whisper_results, language = transcribe(
-            vocal_target,
-            language,
-            whisper_model_name,
-            compute_type,
-            suppress_numerals,
-            device,
-        )
+    # The batched pipeline has no word timestamps, so it is only used when wav2vec2 alignment follows
+    batched = batch_size != 0 and align
+
+    def asr():
+        if batched:
+            whisper_results, detected = transcribe_batched(
+                vocal_target,
+                language,
+                batch_size,
+                whisper_model_name,
+                compute_type,
+                suppress_numerals,
+                device,
+                beam_size=beam_size,
+                on_segment=on_segment,
+            )
+        else:
+            whisper_results, detected = transcribe_unbatched(
+                vocal_target,
+                language,
+                whisper_model_name,
+                compute_type,
+                suppress_numerals,
+                device,
+                beam_size=beam_size,
+                word_timestamps=None if align else True,
+                on_segment=on_segment,
+            )
+        return {"segments": whisper_results, "language": detected}
+
+    asr_key = CheckpointStore.key("asr", vocals_key, model=whisper_model_name, language=language, batched=batched,
+                                  batch_size=batch_size, beam_size=beam_size, suppress_numerals=suppress_numerals)
+    asr_result = checkpointed(checkpoints, asr_key, "asr", timer, asr)
+    whisper_results, language = asr_result["segments"], asr_result["language"]
+    timer.language = language
 
     #Aligning the transcription with the original audio using Wav2Vec2 ,such as speaker diarization
-    word_timestamps = align_timestamps(language, whisper_results, vocal_target, device)
+    alignment_key = CheckpointStore.key("alignment", asr_key, align=align)
+    word_timestamps = checkpointed(checkpoints, alignment_key, "alignment", timer,
+                                   lambda: align_timestamps(language, whisper_results, vocal_target, device, align=align,
+                                                            preloaded=preloaded))
+    if preloaded is not None:
+        # not needed when the alignment was loaded from its checkpoint; a finished preload stays cached
+        preloaded.cancel()
     wsm = get_words_speaker_mapping(word_timestamps, speaker_ts, "start")
 
-     # Realligning Speech segments using Punctuation
-    wsm_update = punctuation_model(language ,wsm, whisper_results)
-    return wsm_update
+    # Restoring punctuation; the speakers are realigned to it when the transcript is rendered
+    if punctuate:
+        punctuation_key = CheckpointStore.key("punctuation", alignment_key)
+        words = checkpointed(checkpoints, punctuation_key, "punctuation", timer,
+                             lambda: apply_punctuation(language, [word["word"] for word in wsm]))
+        for word_dict, word in zip(wsm, words):
+            word_dict["word"] = word
+    return wsm
+
+''' profile  
+    ( choose from the names in diarization.profiles, e.g. 'fast', 'balanced', 'accurate'.
+    The profile decides the whisper model size, beam size, diarization backend and the optional stages)
+    num_speakers / min_speakers / max_speakers
+    ( optional speaker-count hints that narrow the clustering search)
+    workspace
+    ( the job's diarization.workspace.Workspace; intermediate files are written to it.
+    When none is passed a workspace is created for this call and removed at the end)
+    progress
+    ( optional callback progress(stage, status, **details) that is told when a stage starts and
+    finishes, and how far ASR got, e.g. to stream the progress of a job)
+    speaker_index
+    ( optional diarization.speaker_index.SpeakerIndex of the user; speakers that match an enrolled
+    name are rendered with it, and the embeddings are kept on the transcript for indexing)
+    Every stage checkpoints its artifact in diarization.checkpoints unless CHECKPOINTS_ENABLED is off,
+    and stages with a valid checkpoint for the same audio and parameters are skipped ("cached").
+    Returns the sentences and the diarization.transcript.WordTranscript they were rendered from.'''
 
-''' whisper_model_name  
-    ( choose from 'tiny.en', 'tiny', 'base.en', 'base', 
-    'small.en', 'small', 'medium.en', 'medium', 'large-v1', 'large-v2', 'large')'''
+def transcribe(audio_path, profile=None, language=None, diarization_backend=None,
+               num_speakers=None, min_speakers=None, max_speakers=None, workspace=None, progress=None,
+               speaker_index=None):
+    import torch
 
-def transcribe(audio_path, whisper_model_name='large-v2',):
+    options = get_profile(profile)
+    model_store.configure_environment()
     mtypes = {"cpu": "int8", "cuda": "float16"}
     device = "cuda" if torch.cuda.is_available() else "cpu"
-    vocal_target = processing(stemming=True, audio_path=audio_path)
-
-    #Convert audio to mono for NeMo combatibility
-    sound = AudioSegment.from_file(vocal_target).set_channels(1)
-    # ROOT = os.getcwd()
-    # temp_path = os.path.join(ROOT, "temp_outputs")
-    # os.makedirs(temp_path, exist_ok=True)
-    with tempfile.TemporaryDirectory() as temp_path:
-        sound.export(os.path.join(temp_path, "mono_file.wav"), format="wav")
-        
-
-    #Speaker Diarization using NeMo MSDD Model
-    #Initialize NeMo MSDD diarization model
-        msdd_model = NeuralDiarizer(cfg=create_config(temp_path))
-        msdd_model.diarize()
-        del msdd_model
-        torch.cuda.empty_cache()
-
-        speaker_ts = speaker_mapper(temp_path)
-        wsm = whisper_model(whisper_model_name, vocal_target, speaker_ts, device, compute_type=mtypes[device])
-        ssm = get_sentences_speaker_mapping(wsm, speaker_ts)
-
-        # Cleanup and Exporing the results
-        # with open(f"{audio_path[:-4]}.txt", "w", encoding="utf-8-sig") as f:
-        #     get_speaker_aware_transcript(ssm, f)
-
-        # with open(f"{audio_path[:-4]}.srt", "w", encoding="utf-8-sig") as srt:
-        #     write_srt(ssm, srt)
-    cleanup('temp_outputs/htdemucs', 'tmp*')
-    return ssm
+    timer = StageTimer(profile, progress=progress)
+    timer.language = language
+    active_jobs.inc()
+    try:
+        with ExitStack() as stack:
+            if workspace is None:
+                workspace = stack.enter_context(Workspace())
+
+            checkpoints = CheckpointStore() if settings.CHECKPOINTS_ENABLED else None
+            input_hash = file_hash(audio_path) if checkpoints is not None else None
+
+            # Long silences are cut out once up front, so every stage only processes speech;
+            # the offset map translates the times back to the original audio at the end
+            offsets = None
+            trim_key = None
+            if settings.SILENCE_TRIM_ENABLED:
+                trim_key = CheckpointStore.key("trim", input_hash, min_silence=settings.SILENCE_TRIM_MIN_SILENCE,
+                                               padding=settings.SILENCE_TRIM_PADDING, min_ratio=settings.SILENCE_TRIM_MIN_RATIO)
+                planned = checkpointed(checkpoints, trim_key, "trim", timer, lambda: {"offsets": _plan_trim(audio_path)})
+                if planned["offsets"] is not None:
+                    offsets = OffsetMap.from_list(planned["offsets"])
+                    audio_path = trim_silence(audio_path, workspace.path("trimmed.wav"), offsets)
+            vocals_key = CheckpointStore.key("separation", input_hash, stemming=options["stemming"], trim=trim_key)
+
+            # A small model identifies the language first, so English goes to the English-only
+            # models and stages the language does not support are skipped up front
+            if language is None and settings.LANGUAGE_ID_ENABLED:
+                language_key = CheckpointStore.key("language_id", input_hash, model=settings.LANGUAGE_ID_MODEL,
+                                                   windows=settings.LANGUAGE_ID_WINDOWS,
+                                                   seconds=settings.LANGUAGE_ID_WINDOW_SECONDS)
+                detected = checkpointed(checkpoints, language_key, "language_id", timer,
+                                        lambda: identify_language(audio_path, device, mtypes[device]))
+                if detected["probability"] >= settings.LANGUAGE_ID_MIN_PROBABILITY:
+                    language = detected["language"]
+                    timer.language = language
+            whisper_model_name = route_whisper_model(options["whisper_model"], language)
+            align = options["align"] and (language is None or language in wav2vec2_langs)
+            punctuate = options["punctuate"] and (language is None or language in punct_model_langs)
+            preloaded = None
+            if align and language is not None and settings.PRELOAD_ALIGN_MODEL:
+                preloaded = preload_alignment_model(language, device)
+
+            with timer.stage("separation"):
+                vocal_target = checkpoints.load_file(vocals_key) if checkpoints is not None and options["stemming"] else None
+                if vocal_target is not None:
+                    timer.report("separation", "cached")
+                else:
+                    vocal_target = processing(stemming=options["stemming"], audio_path=audio_path, output_dir=workspace.root)
+                    if checkpoints is not None and vocal_target != audio_path:
+                        checkpoints.save_file(vocals_key, "separation", vocal_target)
+
+                #Convert audio to mono for NeMo combatibility
+                sound = AudioSegment.from_file(vocal_target).set_channels(1)
+                mono_path = workspace.path("mono_file.wav")
+                sound.export(mono_path, format="wav")
+            workspace.check()
+
+            #Speaker Diarization using NeMo MSDD Model
+            #Queued with the files of other running jobs and diarized in one NeMo pass
+            diarization_options = dict(backend=diarization_backend or options["diarization"], num_speakers=num_speakers,
+                                       min_speakers=min_speakers, max_speakers=max_speakers)
+            speakers_key = CheckpointStore.key("diarization", vocals_key, **diarization_options)
+            speaker_ts = SpeakerTimeline.from_turns(checkpointed(
+                checkpoints, speakers_key, "diarization", timer,
+                lambda: diarization_service.diarize(mono_path, workspace=workspace, **diarization_options).to_list()
+            ))
+            workspace.check()
+
+            # The speakers are embedded with TitaNet and matched against the user's enrolled names
+            embeddings, speaker_names = None, {}
+            if speaker_index is not None and settings.SPEAKER_INDEX_ENABLED:
+                embeddings_key = CheckpointStore.key("speaker_embeddings", speakers_key,
+                                                     seconds=settings.SPEAKER_EMBEDDING_SECONDS)
+                embeddings = checkpointed(checkpoints, embeddings_key, "speaker_embeddings", timer,
+                                          lambda: speaker_embeddings(mono_path, speaker_ts, titanet_embedder(),
+                                                                     settings.SPEAKER_EMBEDDING_SECONDS))
+                embeddings = {int(speaker): vector for speaker, vector in embeddings.items()}
+                speaker_names = speaker_index.identify(embeddings, threshold=settings.SPEAKER_MATCH_THRESHOLD,
+                                                       top_k=settings.SPEAKER_MATCH_TOP_K)
+            wsm = whisper_model(whisper_model_name, vocal_target, speaker_ts, device,
+                                compute_type=mtypes[device], language=language,
+                                beam_size=options["beam_size"], align=align,
+                                punctuate=punctuate, timer=timer,
+                                duration=sound.duration_seconds,
+                                checkpoints=checkpoints, vocals_key=vocals_key, preloaded=preloaded)
+            workspace.check()
+            if offsets is not None:
+                wsm = offsets.map_words(wsm)
+                speaker_ts = SpeakerTimeline.from_turns(offsets.map_turns(speaker_ts))
+            with timer.stage("sentence_mapping"):
+                transcript = WordTranscript.from_mapping(
+                    wsm, speaker_ts, language=timer.language,
+                    punctuated=punctuate and timer.language in punct_model_langs,
+                    speaker_names=speaker_names, speaker_embeddings=embeddings,
+                )
+                transcript.checkpoint_keys = sorted(checkpoints.keys) if checkpoints is not None else None
+                ssm = transcript.render()
+
+            # Cleanup and Exporing the results
+            # with open(f"{audio_path[:-4]}.txt", "w", encoding="utf-8-sig") as f:
+            #     get_speaker_aware_transcript(ssm, f)
+
+            # with open(f"{audio_path[:-4]}.srt", "w", encoding="utf-8-sig") as srt:
+            #     write_srt(ssm, srt)
+        audio_seconds.labels(profile or "default").inc(offsets.duration / 1000 if offsets is not None else sound.duration_seconds)
+    finally:
+        active_jobs.dec()
+        timer.observe()
+    return ssm, transcript
 
 # transcribe('voice.mp3')
\ No newline at end of file
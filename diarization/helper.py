@@ -1,9 +1,7 @@
 import os
-import wget
 import json
 import shutil
 import glob
-from omegaconf import OmegaConf
 
 punct_model_langs = [
     "en",
@@ -42,37 +40,52 @@ wav2vec2_langs = [
 ]
 
 
-def create_config(output_dir):
+def create_config(output_dir, audio_files=None, num_workers=0, num_speakers=None, max_speakers=None):
+    from omegaconf import OmegaConf
+    from . import model_store
+
     # DOMAIN_TYPE = "msdd_telephonic"  # Can be meeting, telephonic, or general based on domain type of the audio file
     CONFIG_LOCAL_DIRECTORY = "nemo_config"
     CONFIG_FILE_NAME = "diar_msdd_telephonic.yaml"
     MODEL_CONFIG_PATH = os.path.join(CONFIG_LOCAL_DIRECTORY, CONFIG_FILE_NAME)
     if not os.path.exists(MODEL_CONFIG_PATH):
-        os.makedirs(CONFIG_LOCAL_DIRECTORY, exist_ok=True)
-        CONFIG_URL = f"https://raw.githubusercontent.com/NVIDIA/NeMo/main/examples/speaker_tasks/diarization/conf/inference/{CONFIG_FILE_NAME}"
-        MODEL_CONFIG_PATH = wget.download(CONFIG_URL, MODEL_CONFIG_PATH)
+        # Use the prefetched copy; in offline mode a missing one raises instead of downloading
+        MODEL_CONFIG_PATH = model_store.resolve(CONFIG_FILE_NAME)
+        if not os.path.exists(MODEL_CONFIG_PATH):
+            import wget
+            os.makedirs(CONFIG_LOCAL_DIRECTORY, exist_ok=True)
+            MODEL_CONFIG_PATH = wget.download(MODEL_CONFIG_PATH, os.path.join(CONFIG_LOCAL_DIRECTORY, CONFIG_FILE_NAME))
 
     config = OmegaConf.load(MODEL_CONFIG_PATH)
 
     data_dir = os.path.join(output_dir, "data")
     os.makedirs(data_dir, exist_ok=True)
 
-    meta = {
-        "audio_filepath": os.path.join(output_dir, "mono_file.wav"),
-        "offset": 0,
-        "duration": None,
-        "label": "infer",
-        "text": "-",
-        "rttm_filepath": None,
-        "uem_filepath": None,
-    }
+    # One manifest line per file; NeMo names each file's RTTM after its basename
+    # num_speakers, when given, holds the known speaker count of every file
+    if audio_files is None:
+        audio_files = [os.path.join(output_dir, "mono_file.wav")]
+    if num_speakers is None:
+        num_speakers = [None] * len(audio_files)
     with open(os.path.join(data_dir, "input_manifest.json"), "w") as fp:
-        json.dump(meta, fp)
-        fp.write("\n")
+        for audio_file, speakers in zip(audio_files, num_speakers):
+            meta = {
+                "audio_filepath": audio_file,
+                "offset": 0,
+                "duration": None,
+                "label": "infer",
+                "text": "-",
+                "num_speakers": speakers,
+                "rttm_filepath": None,
+                "uem_filepath": None,
+            }
+            json.dump(meta, fp)
+            fp.write("\n")
 
-    pretrained_vad = "vad_multilingual_marblenet"
-    pretrained_speaker_model = "titanet_large"
-    config.num_workers = 0
+    # local .nemo files from the model store, or pretrained names when they were not prefetched
+    pretrained_vad = model_store.resolve("vad_multilingual_marblenet")
+    pretrained_speaker_model = model_store.resolve("titanet_large")
+    config.num_workers = num_workers
     config.diarizer.manifest_filepath = os.path.join(data_dir, "input_manifest.json")
     config.diarizer.out_dir = (
         output_dir  # Directory to store intermediate files and prediction outputs
@@ -82,14 +95,19 @@ def create_config(output_dir):
     config.diarizer.oracle_vad = (
         False  # compute VAD provided with model_path to vad config
     )
-    config.diarizer.clustering.parameters.oracle_num_speakers = False
+    # Known speaker counts skip the search over speaker counts; otherwise it is capped at max_speakers
+    config.diarizer.clustering.parameters.oracle_num_speakers = all(
+        speakers is not None for speakers in num_speakers
+    )
+    if max_speakers is not None:
+        config.diarizer.clustering.parameters.max_num_speakers = max_speakers
 
     # Here, we use our in-house pretrained NeMo VAD model
     config.diarizer.vad.model_path = pretrained_vad
     config.diarizer.vad.parameters.onset = 0.8
     config.diarizer.vad.parameters.offset = 0.6
     config.diarizer.vad.parameters.pad_offset = -0.05
-    config.diarizer.msdd_model.model_path = (
+    config.diarizer.msdd_model.model_path = model_store.resolve(
         "diar_msdd_telephonic"  # Telephonic speaker diarization model
     )
 
@@ -105,10 +123,8 @@ def get_word_ts_anchor(s, e, option="start"):
 
 
 def get_words_speaker_mapping(wrd_ts, spk_ts, word_anchor_option="start"):
-    s, e, sp = spk_ts[0]
-    wrd_pos, turn_idx = 0, 0
-    wrd_spk_mapping = []
-    
+    """Assign every word to the speaker of the turn its anchor falls in; spk_ts is a SpeakerTimeline."""
+    words = []
     for wrd_dict in wrd_ts:
         try:
             ws, we, wrd = (
@@ -119,18 +135,14 @@ def get_words_speaker_mapping(wrd_ts, spk_ts, word_anchor_option="start"):
         except KeyError :
             print(f"KeyError: {KeyError} in wrd_dict: {wrd_dict}")
             continue
+        words.append((ws, we, wrd))
 
-        wrd_pos = get_word_ts_anchor(ws, we, word_anchor_option)
-        while wrd_pos > float(e):
-            turn_idx += 1
-            turn_idx = min(turn_idx, len(spk_ts) - 1)
-            s, e, sp = spk_ts[turn_idx]
-            if turn_idx == len(spk_ts) - 1:
-                e = get_word_ts_anchor(ws, we, option="end")
-        wrd_spk_mapping.append(
-            {"word": wrd, "start_time": ws, "end_time": we, "speaker": sp}
-        )
-    return wrd_spk_mapping
+    anchors = [get_word_ts_anchor(ws, we, word_anchor_option) for ws, we, _ in words]
+    speakers = spk_ts.speaker_at(anchors).tolist() if words else []
+    return [
+        {"word": wrd, "start_time": ws, "end_time": we, "speaker": sp}
+        for (ws, we, wrd), sp in zip(words, speakers)
+    ]
 
 
 sentence_ending_punctuations = ".?!"
@@ -158,7 +170,7 @@ def get_last_word_idx_of_sentence(word_idx, word_list, max_words):
     )
     right_idx = word_idx
     while (
-        right_idx < len(word_list)
+        right_idx < len(word_list) - 1
         and right_idx - word_idx < max_words
         and not is_word_sentence_end(right_idx)
     ):
@@ -232,11 +244,11 @@ def get_realigned_ws_mapping_with_punctuation(
 
 
 def get_sentences_speaker_mapping(word_speaker_mapping, spk_ts):
-    s, e, spk = spk_ts[0]
-    prev_spk = spk
+    first_turn = spk_ts[0]
+    prev_spk = first_turn.speaker
 
     snts = []
-    snt = {"speaker": f"Speaker {spk}", "start_time": s, "end_time": e, "text": ""}
+    snt = {"speaker": f"Speaker {first_turn.speaker}", "start_time": first_turn.start, "end_time": first_turn.end, "text": ""}
 
     for wrd_dict in word_speaker_mapping:
         wrd, spk = wrd_dict["word"], wrd_dict["speaker"]
@@ -313,17 +325,10 @@ def find_numeral_symbol_tokens(tokenizer):
 
 
 def cleanup(path: str, pattern: str):
-    """path could either be relative or absolute."""
-    # check if file or directory exists
-    if os.path.isdir(path) or os.path.isfile(path) or os.path.islink(path):
-        directories = glob.glob(os.path.join(path, pattern))
-                                
-        for directory in directories:
-            if os.path.isdir(directory):
-                try:
-                    shutil.rmtree(directory)
-                except OSError as e:
-                    print(f"Error: {e} - {directory}")
-    else:
-        raise ValueError("Path {} is not a file or dir.".format(path))
-     
\ No newline at end of file
+    """path could either be relative or absolute. A missing path is ignored."""
+    for directory in glob.glob(os.path.join(path, pattern)):
+        if os.path.isdir(directory):
+            try:
+                shutil.rmtree(directory)
+            except OSError as e:
+                print(f"Error: {e} - {directory}")
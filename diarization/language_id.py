@@ -0,0 +1,86 @@
+# Language identification before transcription
+# A small multilingual Whisper model, loaded once per process, looks at a few short windows of
+# speech picked with VAD. Knowing the language up front lets the pipeline route English to the
+# faster English-only models, start loading the alignment model early and skip the stages that
+# do not support the language, instead of letting the large model detect it mid-transcription.
+import logging
+import threading
+
+from app.core.config import settings
+from .model_store import ModelStoreError, whisper_model_path
+
+SAMPLE_RATE = 16000
+MIN_WINDOW_SECONDS = 1.0
+
+_models = {}
+_models_lock = threading.Lock()
+
+
+def load_language_id_model(device, compute_dtype):
+    from .transcription import load_whisper_model
+
+    # the model stays loaded between jobs; it is small next to the transcription models
+    key = (settings.LANGUAGE_ID_MODEL, device, compute_dtype)
+    with _models_lock:
+        if key not in _models:
+            _models[key] = load_whisper_model(settings.LANGUAGE_ID_MODEL, device, compute_dtype)
+        return _models[key]
+
+
+def speech_windows(audio, count, seconds):
+    """Up to `count` windows of at most `seconds` of speech, spread over the file."""
+    from faster_whisper.vad import VadOptions, get_speech_timestamps
+
+    chunks = get_speech_timestamps(audio, VadOptions())
+    chunks = [chunk for chunk in chunks if chunk["end"] - chunk["start"] >= MIN_WINDOW_SECONDS * SAMPLE_RATE]
+    if not chunks:
+        return []
+    picked = sorted({round(k * (len(chunks) - 1) / max(count - 1, 1)) for k in range(count)})
+    return [audio[chunks[k]["start"]:min(chunks[k]["end"], chunks[k]["start"] + int(seconds * SAMPLE_RATE))] for k in picked]
+
+
+def language_probabilities(model, audio):
+    """Whisper's language probabilities for one window of 16 kHz audio, as {code: probability}."""
+    features = model.feature_extractor(audio)
+    encoder_output = model.encode(features[:, : model.feature_extractor.nb_max_frames])
+    return {token[2:-2]: probability for token, probability in model.model.detect_language(encoder_output)[0]}
+
+
+def identify_language(audio_path, device, compute_dtype):
+    """Return {"language", "probability"} averaged over a few speech windows; language is None without speech."""
+    from faster_whisper.audio import decode_audio
+
+    audio = decode_audio(audio_path, sampling_rate=SAMPLE_RATE)
+    windows = speech_windows(audio, settings.LANGUAGE_ID_WINDOWS, settings.LANGUAGE_ID_WINDOW_SECONDS)
+    if not windows:
+        return {"language": None, "probability": 0.0}
+    model = load_language_id_model(device, compute_dtype)
+    return average_probabilities([language_probabilities(model, window) for window in windows])
+
+
+def average_probabilities(window_probabilities):
+    """The most likely language over all windows, with its mean probability."""
+    totals = {}
+    for probabilities in window_probabilities:
+        for language, probability in probabilities.items():
+            totals[language] = totals.get(language, 0.0) + probability / len(window_probabilities)
+    language = max(totals, key=totals.get)
+    return {"language": language, "probability": round(totals[language], 3)}
+
+
+def route_whisper_model(model_name, language):
+    """The Whisper model to transcribe a language with, e.g. small.en instead of small for English.
+
+    The English-only models are optional in the model manifest: when the store cannot provide
+    one, e.g. with MODELS_OFFLINE set and the artifact not prefetched, the profile's multilingual
+    model transcribes English too.
+    """
+    if language != "en" or model_name not in settings.ENGLISH_MODEL_ROUTES:
+        return model_name
+    routed = settings.ENGLISH_MODEL_ROUTES[model_name]
+    try:
+        whisper_model_path(routed)
+    except ModelStoreError as e:
+        logging.warning(f"Transcribing English with {model_name} instead of {routed}: {e}")
+        return model_name
+    return routed
@@ -0,0 +1,276 @@
+# Local store of the model artifacts the pipeline needs, pinned in model_manifest.json
+import os
+import re
+import json
+import shutil
+import hashlib
+import logging
+
+from app.core.config import settings
+from app.metrics import record_model_load
+
+MANIFEST_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "model_manifest.json")
+BUNDLED_CONFIG_DIRECTORY = "nemo_config"
+
+
+class ModelStoreError(Exception):
+    pass
+
+
+def load_manifest(path=MANIFEST_PATH):
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, path=MANIFEST_PATH):
+    with open(path, "w") as f:
+        json.dump(manifest, f, indent=4)
+        f.write("\n")
+
+
+def store_root():
+    return os.path.abspath(settings.MODEL_STORE_DIR)
+
+
+def artifact_path(name, manifest=None):
+    manifest = manifest or load_manifest()
+    if name not in manifest["artifacts"]:
+        raise ModelStoreError(f"Artifact '{name}' is not in the model manifest.")
+    return os.path.join(store_root(), manifest["artifacts"][name]["path"])
+
+
+def is_present(name, manifest=None):
+    return os.path.exists(artifact_path(name, manifest))
+
+
+def is_commit(revision):
+    return bool(revision) and re.fullmatch(r"[0-9a-f]{40}", revision) is not None
+
+
+def unpinned(names=None, manifest=None):
+    """{name: reason} of the artifacts whose content the manifest does not pin yet.
+
+    An artifact is pinned by its sha256 and size; one fetched from a git repository also needs
+    its revision to be a commit rather than a branch such as "main", which moves.
+    """
+    manifest = manifest or load_manifest()
+    reasons = {}
+    for name, artifact in manifest["artifacts"].items():
+        if names and name not in names:
+            continue
+        missing = [field for field in ("sha256", "size") if artifact.get(field) is None]
+        if "revision" in artifact and not is_commit(artifact["revision"]):
+            missing.append(f"commit (revision is {artifact['revision']!r})")
+        if missing:
+            reasons[name] = "no " + ", ".join(missing)
+    return reasons
+
+
+def configure_environment():
+    """Point the torch hub and Hugging Face caches at the store so prefetched weights are reused.
+
+    In offline mode the Hugging Face libraries are told never to reach the network.
+    """
+    os.environ["TORCH_HOME"] = os.path.join(store_root(), "torch")
+    if settings.MODELS_OFFLINE:
+        os.environ["HF_HUB_OFFLINE"] = "1"
+        os.environ["TRANSFORMERS_OFFLINE"] = "1"
+
+
+def resolve(name):
+    """Return the local path of an artifact, or the name to fetch it by when it was not prefetched.
+
+    In offline mode a missing artifact raises ModelStoreError instead of falling back to a download.
+    """
+    manifest = load_manifest()
+    path = artifact_path(name, manifest)
+    if os.path.exists(path):
+        return path
+    if settings.MODELS_OFFLINE:
+        raise ModelStoreError(f"Model '{name}' is missing from {store_root()} and MODELS_OFFLINE is set. Run `python manage.py prefetch-models`.")
+    return manifest["artifacts"][name]["source"]
+
+
+def whisper_model_path(model_name):
+    # model names that are not in the manifest, or are already paths, are passed through
+    if f"whisper-{model_name}" not in load_manifest()["artifacts"]:
+        return model_name
+    return resolve(f"whisper-{model_name}")
+
+
+def align_model_dir(language):
+    """Directory whisperx should cache and read the wav2vec2 alignment model of a language from."""
+    name = f"align-{language}"
+    if name not in load_manifest()["artifacts"]:
+        if settings.MODELS_OFFLINE:
+            raise ModelStoreError(f"No alignment model for '{language}' in the model manifest and MODELS_OFFLINE is set.")
+        return None
+    path = artifact_path(name)
+    if not os.path.exists(path) and settings.MODELS_OFFLINE:
+        raise ModelStoreError(f"Alignment model for '{language}' is missing from {store_root()} and MODELS_OFFLINE is set.")
+    return path
+
+
+def load_nemo_model(name):
+    """Restore a NeMo model from the store, or fetch it by its pretrained name."""
+    from nemo.collections.asr import models as nemo_models
+    model_class = getattr(nemo_models, load_manifest()["artifacts"][name]["class"])
+    path = resolve(name)
+    with record_model_load(name):
+        if path.endswith(".nemo"):
+            return model_class.restore_from(path)
+        return model_class.from_pretrained(path)
+
+
+def checksum(path):
+    """sha256 of a file, or of the sorted relative paths and contents of every file in a directory."""
+    digest = hashlib.sha256()
+    if os.path.isfile(path):
+        files = [(None, path)]
+    else:
+        files = []
+        for root, _, names in os.walk(path):
+            for file_name in names:
+                full_path = os.path.join(root, file_name)
+                files.append((os.path.relpath(full_path, path), full_path))
+        files.sort()
+    for relative_path, full_path in files:
+        if relative_path is not None:
+            digest.update(relative_path.encode("utf-8") + b"\0")
+        with open(full_path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def disk_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, file_name))
+               for root, _, names in os.walk(path) for file_name in names)
+
+
+def verify(names=None, full=True, required_only=False):
+    """Check the artifacts of the manifest and return {name: problem} for every one that is not usable.
+
+    A quick check (full=False) only compares presence and size; a full check also compares the sha256.
+    Artifacts without a pinned checksum are not treated as broken; `unpinned` lists them.
+    """
+    manifest = load_manifest()
+    problems = {}
+    for name, artifact in manifest["artifacts"].items():
+        if names and name not in names:
+            continue
+        if required_only and not artifact.get("required"):
+            continue
+        path = artifact_path(name, manifest)
+        if not os.path.exists(path):
+            problems[name] = "missing"
+        elif artifact.get("size") is not None and disk_size(path) != artifact["size"]:
+            problems[name] = "size mismatch"
+        elif full and artifact.get("sha256") and checksum(path) != artifact["sha256"]:
+            problems[name] = "checksum mismatch"
+    return problems
+
+
+def require_offline_artifacts():
+    """Fail fast at startup when MODELS_OFFLINE is set and a required artifact is not in the store."""
+    problems = verify(full=False, required_only=True)
+    if problems:
+        details = ", ".join(f"{name} ({problem})" for name, problem in problems.items())
+        raise ModelStoreError(f"MODELS_OFFLINE is set but the model store is incomplete: {details}")
+    loose = unpinned()
+    if loose:
+        logging.warning(f"{len(loose)} model artifacts are not pinned in the manifest: {', '.join(sorted(loose))}")
+
+
+def _fetch_file(artifact, path):
+    bundled = os.path.join(BUNDLED_CONFIG_DIRECTORY, os.path.basename(path))
+    if os.path.exists(bundled):
+        shutil.copyfile(bundled, path)
+    else:
+        import wget
+        wget.download(artifact["source"], path)
+
+
+def _fetch_nemo(artifact, path):
+    from nemo.collections.asr import models as nemo_models
+    model_class = getattr(nemo_models, artifact["class"])
+    model_class.from_pretrained(artifact["source"]).save_to(path)
+
+
+def _fetch_huggingface(artifact, path):
+    from huggingface_hub import snapshot_download
+    snapshot_download(repo_id=artifact["source"], revision=artifact.get("revision"), local_dir=path)
+
+
+def _commit_huggingface(artifact):
+    from huggingface_hub import HfApi
+    return HfApi().model_info(artifact["source"], revision=artifact.get("revision")).sha
+
+
+def _fetch_whisper(artifact, path):
+    from faster_whisper import download_model
+    download_model(artifact["source"], output_dir=path)
+
+
+def _fetch_align(artifact, path):
+    import whisperx
+    os.makedirs(path, exist_ok=True)
+    whisperx.load_align_model(language_code=artifact["source"], device="cpu", model_dir=path)
+
+
+def _fetch_demucs(artifact, path):
+    # demucs downloads into the torch hub cache, which configure_environment points at the store
+    from demucs.pretrained import get_model
+    get_model(artifact["source"])
+
+
+fetchers = {
+    "file": _fetch_file,
+    "nemo": _fetch_nemo,
+    "huggingface": _fetch_huggingface,
+    "whisper": _fetch_whisper,
+    "align": _fetch_align,
+    "demucs": _fetch_demucs,
+}
+
+# kind -> the commit a branch revision of an artifact currently points at
+committers = {
+    "huggingface": _commit_huggingface,
+}
+
+
+def prefetch(names=None, pin=False):
+    """Download every missing artifact into the store and verify it.
+
+    With pin=True a branch revision is first replaced by the commit it points at, and the
+    artifact is fetched at that commit even when it is present; then the sha256 and size of the
+    artifacts that have none yet are written to the manifest. Returns {name: problem} for the
+    artifacts that still fail verification.
+    """
+    if settings.MODELS_OFFLINE:
+        raise ModelStoreError("Unset MODELS_OFFLINE to prefetch models.")
+    configure_environment()
+    manifest = load_manifest()
+    for name, artifact in manifest["artifacts"].items():
+        if names and name not in names:
+            continue
+        path = artifact_path(name, manifest)
+        repinned = False
+        if pin and "revision" in artifact and not is_commit(artifact["revision"]) and artifact["kind"] in committers:
+            artifact["revision"] = committers[artifact["kind"]](artifact)
+            artifact["sha256"] = artifact["size"] = None
+            repinned = True
+        if repinned or not os.path.exists(path):
+            logging.info(f"Fetching {name} into {path}")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fetchers[artifact["kind"]](artifact, path)
+        if pin and os.path.exists(path):
+            if not artifact.get("sha256"):
+                artifact["sha256"] = checksum(path)
+            if artifact.get("size") is None:
+                artifact["size"] = disk_size(path)
+    if pin:
+        save_manifest(manifest)
+    return verify(names=names)
@@ -1,13 +1,14 @@
 import os
 import logging
 
-def processing(stemming, audio_path):
+def processing(stemming, audio_path, output_dir):
+    # output_dir is the job's workspace, so the stems count against its quota
 
     if stemming:
         # Isolate vocals from the rest of the audio
 
         return_code = os.system(
-            f'python3 -m demucs.separate -n htdemucs --two-stems=vocals "{audio_path}" -o "temp_outputs"'
+            f'python3 -m demucs.separate -n htdemucs --two-stems=vocals "{audio_path}" -o "{output_dir}"'
         )
         if return_code != 0:
             print("Error", return_code)
@@ -20,7 +21,7 @@ def processing(stemming, audio_path):
             #     "temp_outputs", "htdemucs", os.path.basename(audio_path[:-4]), "vocals.wav"
             # )
             vocal_target = os.path.join(
-            "temp_outputs",
+            output_dir,
             "htdemucs",
             os.path.splitext(os.path.basename(audio_path))[0],
             "vocals.wav",
@@ -0,0 +1,57 @@
+# Named speed/accuracy profiles for the transcription pipeline.
+# Each profile picks the Whisper model size, the beam size, the diarization backend
+# and which of the optional stages (demucs stemming, wav2vec2 alignment, punctuation) are run.
+# `credit_rate` is the number of credits charged per minute of audio.
+from decimal import Decimal, ROUND_HALF_UP
+
+DEFAULT_PROFILE = "accurate"
+
+profiles = {
+    "fast": {
+        "whisper_model": "small",
+        "beam_size": 1,
+        "stemming": False,
+        "align": False,
+        "punctuate": False,
+        "diarization": "clustering",
+        "credit_rate": 0.5,
+    },
+    "balanced": {
+        "whisper_model": "medium",
+        "beam_size": 3,
+        "stemming": False,
+        "align": True,
+        "punctuate": True,
+        "diarization": "msdd",
+        "credit_rate": 0.75,
+    },
+    "accurate": {
+        "whisper_model": "large-v2",
+        "beam_size": 5,
+        "stemming": True,
+        "align": True,
+        "punctuate": True,
+        "diarization": "msdd",
+        "credit_rate": 1.0,
+    },
+}
+
+
+def get_profile(name=None):
+    """Return the settings of a profile, falling back to the default one."""
+    name = name or DEFAULT_PROFILE
+    if name not in profiles:
+        raise ValueError(
+            f"Unknown transcription profile '{name}'. Choose from {', '.join(profiles)}."
+        )
+    return profiles[name]
+
+
+def charge(profile, video_length):
+    """The price of video_length minutes with a profile, to the cent, and the whole credits charged for it.
+
+    The price is computed in Decimal from the printed values, so 0.7 minutes at 0.75 credits is
+    0.53 and not 0.52, and the credits are the price rounded half up instead of truncated.
+    """
+    price = (Decimal(str(video_length)) * Decimal(str(profiles[profile]["credit_rate"]))).quantize(Decimal("0.01"), ROUND_HALF_UP)
+    return price, int(price.to_integral_value(ROUND_HALF_UP))
@@ -0,0 +1,114 @@
+# Batched punctuation restoration: word windows of concurrent jobs share the model's forward passes
+from app.core.config import settings
+from app.metrics import record_model_load, queue_depth
+from .batching import BatchRequest, MicroBatcher
+
+# the windows of deepmultilingualpunctuation's PunctuationModel.predict
+CHUNK_SIZE = 230
+OVERLAP = 5
+
+
+def overlap_chunks(words, chunk_size=CHUNK_SIZE, overlap=OVERLAP):
+    """(start, words, kept) windows like PunctuationModel.predict: `kept` leading words of each window are labelled.
+
+    The last `overlap` words of a window are labelled by the next window, which sees them with
+    context on both sides; the last window keeps all of its words.
+    """
+    if len(words) <= chunk_size:
+        overlap = 0
+    chunks = [(start, words[start:start + chunk_size]) for start in range(0, len(words), chunk_size - overlap)]
+    # a last window that only repeats the overlap of the one before is dropped
+    if len(chunks) > 1 and len(chunks[-1][1]) <= overlap:
+        chunks.pop()
+    return [(start, chunk, len(chunk) if k == len(chunks) - 1 else len(chunk) - overlap)
+            for k, (start, chunk) in enumerate(chunks)]
+
+
+def label_words(chunk, kept, result):
+    """Label the first `kept` words of a window from the token-classification pipeline's output.
+
+    Like PunctuationModel.predict, a word gets the label of the last of its sub-tokens.
+    """
+    text = " ".join(chunk)
+    if result and len(text) != result[-1]["end"]:
+        raise ValueError("chunk size too large, text got clipped")
+    labelled = []
+    char_index = 0
+    result_index = 0
+    for word in chunk[:kept]:
+        char_index += len(word) + 1
+        label, score = "0", 0.0
+        while result_index < len(result) and char_index > result[result_index]["end"]:
+            label = result[result_index]["entity"]
+            score = result[result_index]["score"]
+            result_index += 1
+        labelled.append([word, label, score])
+    return labelled
+
+
+class PunctuationRequest(BatchRequest):
+    def __init__(self, words):
+        super().__init__(overlap_chunks(words))
+        self.labels = [None] * len(words)
+
+    @property
+    def chunks(self):
+        return self.items
+
+    def result(self):
+        return self.labels
+
+
+class PunctuationService(MicroBatcher):
+    """Restores punctuation for concurrent jobs with one model and batched forward passes.
+
+    Every job's words are cut into the overlapping windows of PunctuationModel.predict, so a
+    forward pass never sees more than CHUNK_SIZE words however long the transcript is. The
+    worker waits at most `max_wait` seconds to fill a batch of `max_batch_size` windows,
+    taking windows from the waiting jobs in turn so a long transcript does not hold back
+    short ones, and hands the labels back to each job once all of its windows are done.
+    """
+
+    name = "punctuation-service"
+
+    def __init__(self, max_batch_size=16, max_wait=0.05, loader=None):
+        super().__init__(max_batch_size, max_wait)
+        self.loader = loader or load_pipeline
+        self._pipe = None
+
+    def submit(self, words):
+        """Queue a list of words and return a Future that resolves to [word, label, score] rows."""
+        return self.submit_request(PunctuationRequest(list(words)))
+
+    def predict(self, words):
+        """Drop-in for PunctuationModel.predict that shares batches with other jobs."""
+        return self.submit(words).result()
+
+    def run_batch(self, key, chunks):
+        if self._pipe is None:
+            self._pipe = self.loader()
+        texts = [" ".join(chunk) for _, chunk, _ in chunks]
+        results = self._pipe(texts, batch_size=len(texts))
+        if len(texts) == 1 and results and isinstance(results[0], dict):
+            results = [results]
+        return results
+
+    def deliver(self, request, index, result):
+        start, chunk, kept = request.chunks[index]
+        request.labels[start:start + kept] = label_words(chunk, kept, result)
+
+
+def load_pipeline():
+    from deepmultilingualpunctuation import PunctuationModel
+    from .model_store import resolve
+
+    # the library builds the token-classification pipeline; its predict loop is replaced by the service
+    with record_model_load("punctuation"):
+        return PunctuationModel(model=resolve("kredor/punctuate-all")).pipe
+
+
+punctuation_service = PunctuationService(
+    max_batch_size=settings.PUNCTUATION_BATCH_SIZE,
+    max_wait=settings.PUNCTUATION_BATCH_WAIT,
+)
+queue_depth.labels("punctuation").set_function(punctuation_service.queue_depth)
@@ -0,0 +1,183 @@
+# Batched speaker diarization: files queued by concurrent jobs are diarized in one NeMo pass
+import os
+import time
+import uuid
+import queue
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+from app.core.config import settings
+from app.metrics import queue_depth
+from .backends import get_backend
+from .helper import create_config
+from .speaker import speaker_mapper
+from .workspace import Workspace
+
+
+class DiarizationRequest:
+    def __init__(self, audio_path, backend, num_speakers=None, min_speakers=None, max_speakers=None, workspace=None):
+        self.audio_path = audio_path
+        self.workspace = workspace  # the workspace of the job, whose quota the NeMo outputs count against
+        self.backend = backend
+        self.num_speakers = num_speakers
+        self.min_speakers = min_speakers
+        self.max_speakers = max_speakers
+        self.future = Future()
+
+    def batch_key(self):
+        """Requests can share a NeMo pass only when they share the backend and the clustering settings."""
+        if self.num_speakers is not None:
+            return (self.backend, True, None)
+        return (self.backend, False, self.max_speakers)
+
+
+def validate_speaker_hints(num_speakers=None, min_speakers=None, max_speakers=None):
+    """Check the speaker-count hints of a job and fold an exact range into num_speakers."""
+    for name, value in (("num_speakers", num_speakers), ("min_speakers", min_speakers), ("max_speakers", max_speakers)):
+        if value is not None and value < 1:
+            raise ValueError(f"{name} must be at least 1")
+    if num_speakers is not None and (min_speakers is not None or max_speakers is not None):
+        raise ValueError("Pass either num_speakers or min_speakers/max_speakers, not both")
+    if min_speakers is not None and max_speakers is not None:
+        if min_speakers > max_speakers:
+            raise ValueError("min_speakers can not be larger than max_speakers")
+        if min_speakers == max_speakers:
+            return min_speakers, None, None
+    return num_speakers, min_speakers, max_speakers
+
+
+class DiarizationService:
+    """Collects mono audio files from concurrent jobs and diarizes them together.
+
+    The first queued file waits at most `max_wait` seconds for others to join its batch.
+    Each batch is written to a single NeMo manifest with DataLoader workers enabled, so VAD
+    and speaker-embedding extraction are batched across files, and the per-file RTTMs are
+    handed back to the jobs that queued them. Only files with the same backend and
+    clustering settings share a batch.
+    """
+
+    def __init__(self, max_batch_size=8, max_wait=0.5, num_workers=2):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.num_workers = num_workers
+        self._queue = queue.Queue()
+        self._deferred = deque()  # requests pulled from the queue that did not fit the last batch
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, audio_path, backend=None, num_speakers=None, min_speakers=None, max_speakers=None, workspace=None):
+        """Queue a mono wav file and return a Future that resolves to its SpeakerTimeline."""
+        num_speakers, min_speakers, max_speakers = validate_speaker_hints(num_speakers, min_speakers, max_speakers)
+        request = DiarizationRequest(audio_path, get_backend(backend).name, num_speakers, min_speakers, max_speakers,
+                                     workspace=workspace)
+        self._queue.put(request)
+        self._ensure_worker()
+        return request.future
+
+    def diarize(self, audio_path, **options):
+        """Queue a mono wav file and block until its speaker turns are ready."""
+        return self.submit(audio_path, **options).result()
+
+    def queue_depth(self):
+        return self._queue.qsize() + len(self._deferred)
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="diarization-service", daemon=True)
+                self._thread.start()
+
+    def _next_batch(self):
+        first = self._deferred.popleft() if self._deferred else self._queue.get()
+        key = first.batch_key()
+        batch = [first]
+
+        # deferred requests with the same settings join without waiting
+        for request in list(self._deferred):
+            if len(batch) == self.max_batch_size:
+                break
+            if request.batch_key() == key:
+                self._deferred.remove(request)
+                batch.append(request)
+
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if request.batch_key() == key:
+                batch.append(request)
+            else:
+                self._deferred.append(request)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                results = self._diarize_batch(batch)
+            except Exception as e:
+                logging.exception("Diarization batch failed")
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+
+            for request, speaker_ts in zip(batch, results):
+                if request.min_speakers is not None and speaker_ts.num_speakers < request.min_speakers:
+                    # NeMo has no lower bound, so rerun the file with the minimum as a known count
+                    retry = DiarizationRequest(request.audio_path, request.backend, num_speakers=request.min_speakers,
+                                               workspace=request.workspace)
+                    retry.future = request.future
+                    self._queue.put(retry)
+                else:
+                    request.future.set_result(speaker_ts)
+
+    def _diarize_batch(self, batch):
+        backend = get_backend(batch[0].backend)
+        with batch_workspace(batch) as workspace:
+            batch_dir = workspace.root
+            # NeMo keys manifest entries by file basename, so every file gets a unique link name
+            names, links = [], []
+            for request in batch:
+                name = uuid.uuid4().hex
+                link = os.path.join(batch_dir, f"{name}.wav")
+                os.symlink(os.path.abspath(request.audio_path), link)
+                names.append(name)
+                links.append(link)
+
+            config = create_config(
+                batch_dir,
+                audio_files=links,
+                num_workers=self.num_workers,
+                num_speakers=[request.num_speakers for request in batch] if batch[0].num_speakers else None,
+                max_speakers=batch[0].max_speakers,
+            )
+            backend.diarize(config)
+            workspace.check()
+
+            return [speaker_mapper(batch_dir, name) for name in names]
+
+
+def batch_workspace(batch):
+    """Workspace of one NeMo pass, with the summed quota of the jobs in the batch.
+
+    NeMo writes the VAD frames, embeddings and RTTMs of all files of a pass into one directory,
+    so the pass gets its own workspace next to the jobs' ones instead of the system temp dir.
+    """
+    quotas = [request.workspace.quota_bytes for request in batch if request.workspace is not None]
+    quota_mb = sum(quotas) // (1024 * 1024) if quotas else None
+    return Workspace(job_id=f"diarization-{uuid.uuid4().hex}", quota_mb=quota_mb)
+
+
+diarization_service = DiarizationService(
+    max_batch_size=settings.DIARIZATION_BATCH_SIZE,
+    max_wait=settings.DIARIZATION_BATCH_WAIT,
+    num_workers=settings.DIARIZATION_NUM_WORKERS,
+)
+queue_depth.labels("diarization").set_function(diarization_service.queue_depth)
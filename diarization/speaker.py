@@ -1,14 +1,16 @@
 # Reading timestamps <> Speaker Labels mapping
 import os
+from .timeline import SpeakerTimeline
 
-def speaker_mapper(temp_path):
-    speaker_ts = []
-    with open(os.path.join(temp_path, "pred_rttms", "mono_file.rttm"), "r") as f:
+def speaker_mapper(temp_path, name="mono_file"):
+    starts, ends, speakers = [], [], []
+    with open(os.path.join(temp_path, "pred_rttms", f"{name}.rttm"), "r") as f:
         lines = f.readlines()
         for line in lines:
             line_list = line.split(" ")
             s = int(float(line_list[5]) * 1000)
-            e = s + int(float(line_list[8]) * 1000)
-            speaker_ts.append([s, e, int(line_list[11].split("_")[-1])])
+            starts.append(s)
+            ends.append(s + int(float(line_list[8]) * 1000))
+            speakers.append(int(line_list[11].split("_")[-1]))
 
-    return speaker_ts
\ No newline at end of file
+    return SpeakerTimeline(starts, ends, speakers)
@@ -0,0 +1,342 @@
+# Per-user index of speaker embeddings, for recognizing recurring speakers
+# After every job the TitaNet embedding of each of its speakers is appended to the user's index,
+# tagged with the conversion and the speaker number. Users enroll a name on one of those entries,
+# and the speakers of new jobs are matched against the named entries with one cosine query.
+import os
+import json
+import fcntl
+import shutil
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+
+from app.core.config import settings
+
+SAMPLE_RATE = 16000
+MIN_TURN_SECONDS = 1.0
+EMBEDDINGS_FILE = "embeddings.f32"
+ENTRIES_FILE = "entries.jsonl"
+NAMES_FILE = "names.json"
+LOCK_FILE = ".lock"
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1.0, norms)
+
+
+def kmeans(vectors, n_lists, iterations=10, seed=0):
+    """Spherical k-means centroids of unit vectors, for the IVF partition."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_lists, replace=False)]
+    for _ in range(iterations):
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        for k in range(n_lists):
+            members = vectors[assignments == k]
+            if len(members):
+                centroids[k] = normalize(members.sum(axis=0))
+    return centroids
+
+
+class SpeakerIndex:
+    """Unit-length speaker embeddings of one user, with the names enrolled on some of them.
+
+    Rows are appended to a raw float32 file and a JSON-lines file of (conversion_id, speaker)
+    entries, so adding the speakers of a job only writes their rows. The matrix is read on the
+    first search. With `ivf_lists` set and enough rows, the rows are partitioned with k-means
+    and a search only scores the rows of the `ivf_probe` lists closest to each query.
+
+    API and worker processes share the files: writes hold an exclusive flock on a lock file in
+    the index directory, and every access re-reads the files once their mtime, size or inode
+    differ from the last read, so speakers added or named in one process are seen by the others.
+    """
+
+    def __init__(self, root, ivf_lists=0, ivf_probe=4):
+        self.root = root
+        self.ivf_lists = ivf_lists
+        self.ivf_probe = ivf_probe
+        self._matrix = None
+        self._entries = None
+        self._names = None
+        self._centroids = None
+        self._assignments = None
+        self._trained_rows = 0
+        self._stamp = None
+        self._lock = threading.Lock()
+
+    def _path(self, name):
+        return os.path.join(self.root, name)
+
+    def _replace(self, name, write, mode="w"):
+        staging = self._path(name + ".tmp")
+        with open(staging, mode, **({} if "b" in mode else {"encoding": "utf-8"})) as f:
+            write(f)
+        os.replace(staging, self._path(name))
+
+    def _save_names(self):
+        self._replace(NAMES_FILE, lambda f: json.dump({str(row): name for row, name in self._names.items()}, f))
+
+    @contextmanager
+    def _locked(self, exclusive):
+        """Hold the lock file of the index; shared for reads, which need no directory of their own."""
+        if not exclusive and not os.path.isdir(self.root):
+            yield
+            return
+        os.makedirs(self.root, exist_ok=True)
+        with open(self._path(LOCK_FILE), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _files(self):
+        stamp = []
+        for name in (EMBEDDINGS_FILE, ENTRIES_FILE, NAMES_FILE):
+            try:
+                stat = os.stat(self._path(name))
+                stamp.append((stat.st_ino, stat.st_size, stat.st_mtime_ns))
+            except FileNotFoundError:
+                stamp.append(None)
+        return tuple(stamp)
+
+    def _load(self):
+        """Read the files if they changed since the last read; call with self._lock held."""
+        if self._matrix is not None and self._files() == self._stamp:
+            return
+        with self._locked(exclusive=False):
+            self._refresh()
+
+    @contextmanager
+    def _writing(self):
+        """Hold the exclusive lock over a read-modify-write of the files; call with self._lock held."""
+        with self._locked(exclusive=True):
+            self._refresh()
+            yield
+            self._stamp = self._files()
+
+    def _refresh(self):
+        stamp = self._files()
+        if self._matrix is not None and stamp == self._stamp:
+            return
+        entries, names = [], {}
+        if os.path.exists(self._path(ENTRIES_FILE)):
+            with open(self._path(ENTRIES_FILE), "r", encoding="utf-8") as f:
+                entries = [json.loads(line) for line in f if line.strip()]
+        if os.path.exists(self._path(NAMES_FILE)):
+            with open(self._path(NAMES_FILE), "r", encoding="utf-8") as f:
+                names = {int(row): name for row, name in json.load(f).items()}
+        matrix = np.zeros((0, 0), dtype=np.float32)
+        if entries:
+            matrix = np.fromfile(self._path(EMBEDDINGS_FILE), dtype=np.float32).reshape(-1, entries[0]["dim"])
+            # rows written without their entry, e.g. by a crash between the two appends, are ignored
+            matrix = matrix[:len(entries)]
+            entries = entries[:len(matrix)]
+        self._matrix, self._entries, self._names, self._stamp = matrix, entries, names, stamp
+        if self._centroids is not None:
+            # rows may have been added or renumbered by another process; the lists keep their centroids
+            if len(matrix) and matrix.shape[1] == self._centroids.shape[1]:
+                self._assignments = np.argmax(matrix @ self._centroids.T, axis=1)
+            else:
+                self._centroids = self._assignments = None
+                self._trained_rows = 0
+        logging.info(f"Loaded {len(entries)} speaker embeddings from {self.root}")
+
+    def __len__(self):
+        with self._lock:
+            self._load()
+            return len(self._entries)
+
+    def add(self, embeddings, conversion_id):
+        """Append the {speaker: embedding} of one conversion; returns the new rows."""
+        if not embeddings:
+            return []
+        speakers = sorted(embeddings)
+        vectors = normalize([embeddings[speaker] for speaker in speakers])
+        with self._lock, self._writing():
+            if len(self._matrix) and vectors.shape[1] != self._matrix.shape[1]:
+                raise ValueError(f"Embeddings of size {vectors.shape[1]} do not fit an index of size {self._matrix.shape[1]}")
+            with open(self._path(EMBEDDINGS_FILE), "ab") as f:
+                f.write(vectors.tobytes())
+            entries = [{"conversion_id": conversion_id, "speaker": int(speaker), "dim": vectors.shape[1]} for speaker in speakers]
+            with open(self._path(ENTRIES_FILE), "a", encoding="utf-8") as f:
+                f.writelines(json.dumps(entry) + "\n" for entry in entries)
+            first = len(self._entries)
+            self._matrix = np.concatenate([self._matrix.reshape(-1, vectors.shape[1]), vectors])
+            self._entries.extend(entries)
+            if self._centroids is not None:
+                # new rows join their closest list; the partition is retrained once the index doubled
+                self._assignments = np.concatenate([self._assignments, np.argmax(vectors @ self._centroids.T, axis=1)])
+            return list(range(first, len(self._entries)))
+
+    def enroll(self, conversion_id, speaker, name):
+        """Name the speaker of a conversion, or forget the name with None; returns how many rows changed."""
+        with self._lock, self._writing():
+            rows = [row for row, entry in enumerate(self._entries)
+                    if entry["conversion_id"] == conversion_id and entry["speaker"] == speaker]
+            for row in rows:
+                if name:
+                    self._names[row] = name
+                else:
+                    self._names.pop(row, None)
+            if rows:
+                self._save_names()
+            return len(rows)
+
+    def remove(self, conversion_id):
+        """Forget the embeddings of a deleted conversion and the names enrolled on them; returns how many rows went.
+
+        The remaining rows are renumbered, so the files are rewritten and swapped in one at a time,
+        embeddings and entries before names: a crash in between leaves extra rows at the end, which
+        the loader drops, and the names of the previous numbering.
+        """
+        if not os.path.isdir(self.root):
+            return 0
+        with self._lock, self._writing():
+            keep = [row for row, entry in enumerate(self._entries) if entry["conversion_id"] != conversion_id]
+            removed = len(self._entries) - len(keep)
+            if not removed:
+                return 0
+            renumbered = {old: new for new, old in enumerate(keep)}
+            matrix = self._matrix[keep] if keep else np.zeros((0, 0), dtype=np.float32)
+            entries = [self._entries[row] for row in keep]
+            names = {renumbered[row]: name for row, name in self._names.items() if row in renumbered}
+            self._replace(EMBEDDINGS_FILE, lambda f: f.write(matrix.tobytes()), mode="wb")
+            self._replace(ENTRIES_FILE, lambda f: f.writelines(json.dumps(entry) + "\n" for entry in entries))
+            self._matrix, self._entries, self._names = matrix, entries, names
+            self._save_names()
+            self._centroids = self._assignments = None
+            self._trained_rows = 0
+            return removed
+
+    def names(self):
+        """Enrolled names with how many embeddings carry them."""
+        with self._lock:
+            self._load()
+            counts = {}
+            for name in self._names.values():
+                counts[name] = counts.get(name, 0) + 1
+            return counts
+
+    def _partition(self):
+        rows = len(self._matrix)
+        # like faiss, a list should get at least ~39 training rows
+        if not self.ivf_lists or rows < self.ivf_lists * 39:
+            self._centroids = self._assignments = None
+            return False
+        if self._centroids is None or rows >= 2 * self._trained_rows:
+            self._centroids = kmeans(self._matrix, self.ivf_lists)
+            self._assignments = np.argmax(self._matrix @ self._centroids.T, axis=1)
+            self._trained_rows = rows
+        return True
+
+    def search(self, queries, top_k=5, named_only=False):
+        """Top-k (row, cosine similarity) pairs for every query vector, best first."""
+        return self._search(queries, top_k, named_only)[0]
+
+    def _search(self, queries, top_k, named_only):
+        # the names are copied with the rows they belong to, before an enrollment or removal renumbers them
+        queries = normalize(np.atleast_2d(queries))
+        with self._lock:
+            self._load()
+            names = dict(self._names)
+            if not len(self._matrix):
+                return [[] for _ in queries], names
+            candidates = np.fromiter(sorted(self._names), dtype=np.int64) if named_only else np.arange(len(self._matrix))
+            if self._partition():
+                closest = np.argsort(-(queries @ self._centroids.T), axis=1)[:, :self.ivf_probe]
+                candidate_sets = [candidates[np.isin(self._assignments[candidates], lists)] for lists in closest]
+            else:
+                candidate_sets = [candidates] * len(queries)
+            matrix = self._matrix
+        results = []
+        for query, rows in zip(queries, candidate_sets):
+            scores = matrix[rows] @ query
+            best = np.argsort(-scores)[:top_k] if len(scores) <= top_k else np.argpartition(-scores, top_k)[:top_k]
+            best = best[np.argsort(-scores[best])]
+            results.append([(int(rows[k]), float(scores[k])) for k in best])
+        return results, names
+
+    def identify(self, embeddings, threshold=0.7, top_k=5):
+        """{speaker: name} for the speakers of a job whose closest enrolled embeddings pass the threshold.
+
+        All speakers are matched with one query; each takes the name with the highest summed
+        similarity among its top-k enrolled neighbours, and a name is given to one speaker only.
+        """
+        if not embeddings:
+            return {}
+        speakers = sorted(embeddings)
+        neighbours, names = self._search([embeddings[speaker] for speaker in speakers], top_k, named_only=True)
+        candidates = []
+        for speaker, found in zip(speakers, neighbours):
+            votes = {}
+            for row, score in found:
+                if score >= threshold:
+                    votes[names[row]] = votes.get(names[row], 0.0) + score
+            candidates.extend((score, speaker, name) for name, score in votes.items())
+        identified, taken = {}, set()
+        for score, speaker, name in sorted(candidates, reverse=True):
+            if speaker not in identified and name not in taken:
+                identified[speaker] = name
+                taken.add(name)
+        return identified
+
+
+class SpeakerIndexStore:
+    """The speaker indexes of all users, each loaded on first use; the least recently used are unloaded."""
+
+    def __init__(self, root, max_loaded=32, **options):
+        self.root = root
+        self.max_loaded = max_loaded
+        self.options = options
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            if user_id in self._indexes:
+                self._indexes.move_to_end(user_id)
+                return self._indexes[user_id]
+            index = self._indexes[user_id] = SpeakerIndex(os.path.join(self.root, str(user_id)), **self.options)
+            while len(self._indexes) > self.max_loaded:
+                self._indexes.popitem(last=False)
+            return index
+
+    def drop(self, user_id):
+        """Delete the whole index of a deleted user."""
+        with self._lock:
+            self._indexes.pop(user_id, None)
+            shutil.rmtree(os.path.join(self.root, str(user_id)), ignore_errors=True)
+
+
+def speaker_embeddings(audio_path, speaker_ts, embed, max_seconds=30.0):
+    """{speaker: mean unit embedding} over the longest turns of each speaker, up to max_seconds of speech."""
+    from faster_whisper.audio import decode_audio
+
+    audio = decode_audio(audio_path, sampling_rate=SAMPLE_RATE)
+    turns = {}
+    for start, end, speaker in speaker_ts.to_list():
+        if end - start >= MIN_TURN_SECONDS * 1000:
+            turns.setdefault(speaker, []).append((start, end))
+    embeddings = {}
+    for speaker, speaker_turns in turns.items():
+        vectors, total = [], 0
+        for start, end in sorted(speaker_turns, key=lambda turn: turn[0] - turn[1]):
+            if total >= max_seconds * 1000:
+                break
+            end = min(end, start + int(max_seconds * 1000) - total)
+            vectors.append(embed(audio[start * SAMPLE_RATE // 1000:end * SAMPLE_RATE // 1000]))
+            total += end - start
+        embeddings[speaker] = normalize(normalize(vectors).mean(axis=0)).tolist()
+    return embeddings
+
+
+speaker_indexes = SpeakerIndexStore(
+    settings.SPEAKER_INDEX_DIR,
+    ivf_lists=settings.SPEAKER_INDEX_IVF_LISTS,
+    ivf_probe=settings.SPEAKER_INDEX_IVF_PROBE,
+)
@@ -0,0 +1,266 @@
+# Live transcription of a PCM stream on a sliding window
+# Audio that has not been finalized yet is kept in a window. Every `step` seconds of new audio
+# the window is checked with VAD and decoded with faster-whisper. Segments that ended at least
+# `stable_lag` seconds before the end of the window will not change any more: they are
+# finalized, labelled with a provisional speaker and dropped from the window. The rest is
+# reported as a partial result and decoded again with the next step.
+import logging
+import threading
+
+import numpy as np
+
+from app.core.config import settings
+from app.metrics import streaming_step_seconds
+from .helper import get_words_speaker_mapping, get_sentences_speaker_mapping
+from .profiles import get_profile
+from .service import diarization_service
+from .timeline import SpeakerTimeline
+
+SAMPLE_RATE = 16000  # the client sends 16 kHz, 16-bit little-endian mono PCM
+MIN_EMBEDDING_SECONDS = 0.5
+PROMPT_CHARACTERS = 200
+
+_models = {}
+_models_lock = threading.Lock()
+
+
+def _cached(key, load):
+    # streaming sessions share their models, which stay loaded between sessions
+    with _models_lock:
+        if key not in _models:
+            _models[key] = load()
+        return _models[key]
+
+
+def whisper_decoder(model_name, device, compute_dtype, language=None, beam_size=1):
+    """Decoder on the faster-whisper path of diarization.transcription, with word timestamps."""
+    from .transcription import load_whisper_model, decode
+
+    whisper_model = _cached(("whisper", model_name, device, compute_dtype),
+                            lambda: load_whisper_model(model_name, device, compute_dtype))
+
+    def decoder(audio, language=language, prompt=None):
+        segments, detected = decode(whisper_model, audio, language, beam_size=beam_size,
+                                    word_timestamps=True, vad_filter=True, initial_prompt=prompt)
+        for segment in segments:
+            segment["words"] = [{"word": w.word, "start": w.start, "end": w.end} for w in segment["words"] or []]
+        return segments, detected
+    return decoder
+
+
+def silero_vad(min_silence_ms=500):
+    """VAD with the Silero model that ships with faster-whisper."""
+    from faster_whisper.vad import VadOptions, get_speech_timestamps
+
+    options = VadOptions(min_silence_duration_ms=min_silence_ms)
+
+    def has_speech(audio):
+        return bool(get_speech_timestamps(audio, options))
+    return has_speech
+
+
+def titanet_embedder():
+    """Speaker embeddings from the TitaNet model the diarization pipeline uses."""
+    from .model_store import load_nemo_model
+
+    speaker_model = _cached(("titanet_large",), lambda: load_nemo_model("titanet_large").eval())
+
+    def embed(audio):
+        embedding, _ = speaker_model.infer_segment(audio)
+        return embedding.squeeze().cpu().numpy()
+    return embed
+
+
+class SpeakerTracker:
+    """Online clustering of segment embeddings into provisional speaker ids.
+
+    A segment joins the speaker whose centroid is most cosine-similar when the similarity
+    is above `threshold`, otherwise it starts a new speaker.
+    """
+
+    def __init__(self, threshold=0.5, max_speakers=None):
+        self.threshold = threshold
+        self.max_speakers = max_speakers
+        self.centroids = []
+        self.counts = []
+
+    def assign(self, embedding):
+        embedding = np.asarray(embedding, dtype=np.float32)
+        embedding = embedding / (np.linalg.norm(embedding) or 1.0)
+        if self.centroids:
+            centroids = np.stack(self.centroids)
+            similarities = centroids @ embedding / np.linalg.norm(centroids, axis=1)
+            best = int(np.argmax(similarities))
+            full = self.max_speakers is not None and len(self.centroids) >= self.max_speakers
+            if similarities[best] >= self.threshold or full:
+                self.counts[best] += 1
+                self.centroids[best] = self.centroids[best] + (embedding - self.centroids[best]) / self.counts[best]
+                return best
+        self.centroids.append(embedding)
+        self.counts.append(1)
+        return len(self.centroids) - 1
+
+
+class StreamingSession:
+    """Incremental transcription of one audio stream.
+
+    `decoder(audio, language, prompt)` returns (segments, language) with times relative to
+    the audio it was given; `vad(audio)` tells whether there is speech in it and `embedder(audio)`
+    returns a speaker embedding. Times in the emitted events are seconds since the stream started.
+    """
+
+    def __init__(self, decoder, vad=None, embedder=None, language=None, step=1.0, max_window=15.0,
+                 stable_lag=1.0, max_speakers=None):
+        self.decoder = decoder
+        self.vad = vad
+        self.embedder = embedder
+        self.language = language
+        self.step = step
+        self.max_window = max_window
+        self.stable_lag = stable_lag
+        self.tracker = SpeakerTracker(max_speakers=max_speakers)
+        self.window = np.zeros(0, dtype=np.float32)
+        self.offset = 0.0  # stream time of the first sample of the window
+        self.pending = 0  # samples received since the last decode
+        self.segments = []  # finalized segments
+        self.last_speaker = 0
+
+    @property
+    def duration(self):
+        return self.offset + len(self.window) / SAMPLE_RATE
+
+    def feed(self, pcm):
+        """Append 16-bit PCM bytes to the window."""
+        samples = np.frombuffer(pcm, dtype="<i2").astype(np.float32) / 32768.0
+        self.window = np.concatenate([self.window, samples])
+        self.pending += len(samples)
+
+    def ready(self):
+        return self.pending >= self.step * SAMPLE_RATE
+
+    def _advance(self, seconds):
+        drop = max(0, min(int(seconds * SAMPLE_RATE), len(self.window)))
+        self.window = self.window[drop:]
+        self.offset += drop / SAMPLE_RATE
+
+    def _prompt(self):
+        return " ".join(segment["text"] for segment in self.segments)[-PROMPT_CHARACTERS:] or None
+
+    def _speaker(self, start, end):
+        audio = self.window[int(start * SAMPLE_RATE):int(end * SAMPLE_RATE)]
+        if self.embedder is not None and len(audio) >= MIN_EMBEDDING_SECONDS * SAMPLE_RATE:
+            try:
+                self.last_speaker = self.tracker.assign(self.embedder(audio))
+            except Exception:
+                logging.exception("Speaker embedding failed, keeping the previous speaker")
+        return self.last_speaker
+
+    def _finalize(self, segment):
+        speaker = self._speaker(segment["start"], segment["end"])
+        final = {
+            "start": round(self.offset + segment["start"], 3),
+            "end": round(self.offset + segment["end"], 3),
+            "text": segment["text"].strip(),
+            "speaker": speaker,
+            "words": [
+                {"word": word["word"].strip(), "start": round(self.offset + word["start"], 3), "end": round(self.offset + word["end"], 3)}
+                for word in segment.get("words") or []
+            ],
+        }
+        self.segments.append(final)
+        return final
+
+    def process(self, final=False):
+        """Decode the window and return the events for the client."""
+        with streaming_step_seconds.time():
+            return self._process(final)
+
+    def _process(self, final):
+        self.pending = 0
+        window_seconds = len(self.window) / SAMPLE_RATE
+        if not len(self.window):
+            return []
+        if self.vad is not None and not self.vad(self.window):
+            # nothing to transcribe; keep a little audio in case a word is starting
+            if not final:
+                self._advance(window_seconds - self.stable_lag)
+            return []
+
+        segments, language = self.decoder(self.window, language=self.language, prompt=self._prompt())
+        self.language = self.language or language
+        if final:
+            stable = segments
+        else:
+            stable = [segment for segment in segments[:-1] if segment["end"] <= window_seconds - self.stable_lag]
+            if window_seconds >= self.max_window and not stable:
+                # the window is full, so the oldest segment is finalized even if it might still change
+                stable = segments[:1]
+
+        events = [dict(self._finalize(segment), type="final") for segment in stable]
+        partial = segments[len(stable):]
+        if partial and not final:
+            events.append({
+                "type": "partial",
+                "start": round(self.offset + partial[0]["start"], 3),
+                "end": round(self.offset + partial[-1]["end"], 3),
+                "text": " ".join(segment["text"].strip() for segment in partial),
+                "speaker": self.last_speaker,
+            })
+
+        if stable:
+            self._advance(stable[-1]["end"])
+        elif not segments and window_seconds >= self.max_window:
+            self._advance(window_seconds - self.stable_lag)
+        return events
+
+    def finish(self):
+        """Finalize whatever is left in the window."""
+        return self.process(final=True)
+
+    def timeline(self):
+        """Provisional speaker turns of the finalized segments."""
+        return SpeakerTimeline.from_turns(
+            [int(segment["start"] * 1000), int(segment["end"] * 1000), segment["speaker"]] for segment in self.segments
+        )
+
+    def sentences(self, speaker_ts=None):
+        """Sentences of the finalized words, labelled with speaker_ts or the provisional speakers."""
+        words = [word for segment in self.segments for word in segment["words"]]
+        if not words:
+            return []
+        speaker_ts = speaker_ts if speaker_ts is not None and len(speaker_ts) else self.timeline()
+        wsm = get_words_speaker_mapping(words, speaker_ts, "start")
+        return get_sentences_speaker_mapping(wsm, speaker_ts)
+
+
+def create_session(profile=None, language=None, max_speakers=None):
+    """Streaming session with the Whisper model and beam size of a profile. Loads the models on first use."""
+    import torch
+
+    options = get_profile(profile)
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    compute_dtype = {"cpu": "int8", "cuda": "float16"}[device]
+    return StreamingSession(
+        whisper_decoder(options["whisper_model"], device, compute_dtype, beam_size=options["beam_size"]),
+        vad=silero_vad(),
+        embedder=titanet_embedder(),
+        language=language,
+        step=settings.STREAMING_STEP,
+        max_window=settings.STREAMING_MAX_WINDOW,
+        max_speakers=max_speakers,
+    )
+
+
+def final_sentences(session, audio_path=None, backend=None, max_speakers=None):
+    """Sentences of a finished session.
+
+    With the recording of the session, the provisional speakers are replaced by a full
+    diarization of it; if that fails the provisional speakers are kept.
+    """
+    speaker_ts = None
+    if audio_path is not None and session.segments:
+        try:
+            speaker_ts = diarization_service.diarize(audio_path, backend=backend, max_speakers=max_speakers)
+        except Exception:
+            logging.exception("Diarization of the stream recording failed, keeping the provisional speakers")
+    return session.sentences(speaker_ts)
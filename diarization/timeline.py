@@ -0,0 +1,115 @@
+# Speaker turns of one file, as sorted NumPy arrays of start/end milliseconds and speaker ids
+from collections import namedtuple
+
+import numpy as np
+
+Turn = namedtuple("Turn", ["start", "end", "speaker"])
+
+
+class SpeakerTimeline:
+    """Diarization result of one file.
+
+    Turns are kept sorted by start time in three parallel arrays. Point and range lookups
+    binary-search the starts and the running maximum of the ends, so they stay O(log n)
+    even when turns of different speakers overlap.
+    """
+
+    def __init__(self, starts, ends, speakers):
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        speakers = np.asarray(speakers, dtype=np.int64)
+        if not (len(starts) == len(ends) == len(speakers)):
+            raise ValueError("starts, ends and speakers must have the same length")
+        if np.any(ends < starts):
+            raise ValueError("a turn can not end before it starts")
+        order = np.argsort(starts, kind="stable")
+        self.starts = starts[order]
+        self.ends = ends[order]
+        self.speakers = speakers[order]
+        # the latest end seen so far, non-decreasing even with overlapping turns
+        self._max_ends = np.maximum.accumulate(self.ends) if len(self.ends) else self.ends
+
+    @classmethod
+    def from_turns(cls, turns):
+        """Build from [start_ms, end_ms, speaker] rows."""
+        turns = list(turns)
+        if not turns:
+            return cls([], [], [])
+        starts, ends, speakers = zip(*turns)
+        return cls(starts, ends, speakers)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, index):
+        return Turn(int(self.starts[index]), int(self.ends[index]), int(self.speakers[index]))
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def __repr__(self):
+        return f"SpeakerTimeline({len(self)} turns, {self.num_speakers} speakers)"
+
+    def to_list(self):
+        return [list(turn) for turn in self]
+
+    @property
+    def speaker_ids(self):
+        return np.unique(self.speakers)
+
+    @property
+    def num_speakers(self):
+        return len(self.speaker_ids)
+
+    @property
+    def duration(self):
+        return int(self._max_ends[-1]) if len(self) else 0
+
+    def index_at(self, times):
+        """Index of the turn that covers each time, in milliseconds.
+
+        This is the first turn that has not ended yet, so a time in a pause belongs to the next
+        turn and a time after the last turn belongs to the last one. Accepts a scalar or an array.
+        """
+        if not len(self):
+            raise ValueError("the timeline has no turns")
+        indices = np.searchsorted(self._max_ends, times, side="left")
+        return np.minimum(indices, len(self) - 1)
+
+    def speaker_at(self, times):
+        return self.speakers[self.index_at(times)]
+
+    def between(self, start, end):
+        """Indices of the turns that overlap [start, end)."""
+        first = np.searchsorted(self._max_ends, start, side="right")
+        last = np.searchsorted(self.starts, end, side="left")
+        candidates = np.arange(first, last)
+        return candidates[self.ends[first:last] > start]
+
+    def overlaps(self):
+        """(i, j) index pairs of turns of different speakers that overlap in time."""
+        pairs = []
+        # a turn can only overlap earlier turns when it starts before the latest end so far
+        for j in np.flatnonzero(self.starts[1:] < self._max_ends[:-1]) + 1:
+            for i in self.between(self.starts[j], self.ends[j]):
+                if i < j and self.speakers[i] != self.speakers[j]:
+                    pairs.append((int(i), int(j)))
+        return pairs
+
+    def merge_adjacent(self, max_gap=0):
+        """New timeline where consecutive turns of a speaker separated by at most max_gap ms are one turn."""
+        if len(self) < 2:
+            return SpeakerTimeline(self.starts, self.ends, self.speakers)
+        new_turn = np.ones(len(self), dtype=bool)
+        new_turn[1:] = (self.speakers[1:] != self.speakers[:-1]) | (self.starts[1:] - self.ends[:-1] > max_gap)
+        first = np.flatnonzero(new_turn)
+        return SpeakerTimeline(
+            self.starts[first], np.maximum.reduceat(self.ends, first), self.speakers[first]
+        )
+
+    def talk_time(self):
+        """Total milliseconds each speaker talks, as {speaker: ms}."""
+        speakers, inverse = np.unique(self.speakers, return_inverse=True)
+        totals = np.bincount(inverse, weights=self.ends - self.starts, minlength=len(speakers))
+        return {int(speaker): int(total) for speaker, total in zip(speakers, totals)}
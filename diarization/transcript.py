@@ -0,0 +1,168 @@
+# Word-level result of a transcription, stored with each conversion
+# Segmentation choices (the word anchor, the realignment window and how words are grouped into
+# blocks) are applied when the transcript is rendered, not when it is computed, so a conversion
+# can be rendered again with other settings without running the pipeline.
+import json
+import zlib
+
+import numpy as np
+
+from .helper import (get_word_ts_anchor,
+                     get_realigned_ws_mapping_with_punctuation,
+                     get_sentences_speaker_mapping,
+                     sentence_ending_punctuations)
+from .timeline import SpeakerTimeline
+
+FORMAT_VERSION = 1
+WORD_ANCHORS = ("start", "mid", "end")
+SPLIT_OPTIONS = ("speaker", "sentence")
+
+
+class WordTranscript:
+    """Words with their times in ms and the speaker turns they are mapped to.
+
+    `punctuated` tells whether punctuation was restored, in which case rendering realigns
+    the speakers to sentence boundaries by default, like the pipeline does. `speaker_names`
+    maps speaker numbers to the enrolled names they were recognized as; the others are
+    rendered as "Speaker <n>". `speaker_embeddings` are only kept until the job indexed them,
+    and `checkpoint_keys`, the pipeline checkpoints of the job, until they are stored with it.
+    """
+
+    def __init__(self, words, starts, ends, speaker_ts, language=None, punctuated=False, speaker_names=None,
+                 speaker_embeddings=None):
+        self.words = list(words)
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.ends = np.asarray(ends, dtype=np.int64)
+        self.speaker_ts = speaker_ts
+        self.language = language
+        self.punctuated = punctuated
+        self.speaker_names = {int(speaker): name for speaker, name in (speaker_names or {}).items()}
+        self.speaker_embeddings = speaker_embeddings
+        self.checkpoint_keys = None
+
+    @classmethod
+    def from_mapping(cls, wsm, speaker_ts, language=None, punctuated=False, speaker_names=None, speaker_embeddings=None):
+        """Build from a word-speaker mapping; the speakers are not kept, they follow from speaker_ts."""
+        return cls(
+            [word["word"] for word in wsm],
+            [word["start_time"] for word in wsm],
+            [word["end_time"] for word in wsm],
+            speaker_ts,
+            language=language,
+            punctuated=punctuated,
+            speaker_names=speaker_names,
+            speaker_embeddings=speaker_embeddings,
+        )
+
+    def __len__(self):
+        return len(self.words)
+
+    def to_bytes(self):
+        # times are delta-encoded, which keeps the numbers short before compression
+        turns = self.speaker_ts
+        payload = {
+            "v": FORMAT_VERSION,
+            "language": self.language,
+            "punctuated": self.punctuated,
+            "words": self.words,
+            "starts": np.diff(self.starts, prepend=0).tolist(),
+            "durations": (self.ends - self.starts).tolist(),
+            "turn_starts": np.diff(turns.starts, prepend=0).tolist(),
+            "turn_durations": (turns.ends - turns.starts).tolist(),
+            "speakers": turns.speakers.tolist(),
+            "names": {str(speaker): name for speaker, name in self.speaker_names.items()},
+        }
+        return zlib.compress(json.dumps(payload, separators=(",", ":")).encode("utf-8"), 9)
+
+    @classmethod
+    def from_bytes(cls, data):
+        payload = json.loads(zlib.decompress(data).decode("utf-8"))
+        if payload.get("v") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported word transcript version {payload.get('v')}")
+        starts = np.cumsum(payload["starts"], dtype=np.int64)
+        turn_starts = np.cumsum(payload["turn_starts"], dtype=np.int64)
+        speaker_ts = SpeakerTimeline(turn_starts, turn_starts + np.asarray(payload["turn_durations"], dtype=np.int64),
+                                     payload["speakers"])
+        return cls(payload["words"], starts, starts + np.asarray(payload["durations"], dtype=np.int64), speaker_ts,
+                   language=payload["language"], punctuated=payload["punctuated"], speaker_names=payload.get("names"))
+
+    def speaker_mapping(self, anchor="start"):
+        """Word-speaker mapping with the speaker of the turn each word's anchor falls in."""
+        starts, ends = self.starts.tolist(), self.ends.tolist()
+        anchors = [get_word_ts_anchor(start, end, anchor) for start, end in zip(starts, ends)]
+        speakers = self.speaker_ts.speaker_at(anchors).tolist() if anchors else []
+        return [
+            {"word": word, "start_time": start, "end_time": end, "speaker": speaker}
+            for word, start, end, speaker in zip(self.words, starts, ends, speakers)
+        ]
+
+    def render(self, anchor="start", max_words=50, realign=None, split="speaker", min_words=0):
+        """Sentences in the format of get_sentences_speaker_mapping.
+
+        anchor
+        ( which time of a word decides its speaker: "start", "mid" or "end")
+        max_words / realign
+        ( with punctuation, speakers are realigned to sentence boundaries within max_words;
+        realign defaults to whether the transcript was punctuated)
+        split
+        ( "speaker" starts a new block when the speaker changes, "sentence" also after every sentence)
+        min_words
+        ( speaker runs shorter than this are merged into the previous run, e.g. to fold
+        backchannels like "yeah" into the surrounding turn)
+        """
+        if anchor not in WORD_ANCHORS:
+            raise ValueError(f"Unknown word anchor '{anchor}'. Choose from {', '.join(WORD_ANCHORS)}.")
+        if split not in SPLIT_OPTIONS:
+            raise ValueError(f"Unknown split '{split}'. Choose from {', '.join(SPLIT_OPTIONS)}.")
+        if max_words < 1 or min_words < 0:
+            raise ValueError("max_words must be at least 1 and min_words can not be negative")
+        if not self.words or not len(self.speaker_ts):
+            return []
+        wsm = self.speaker_mapping(anchor)
+        if self.punctuated if realign is None else realign:
+            wsm = get_realigned_ws_mapping_with_punctuation(wsm, max_words)
+        if min_words > 1:
+            wsm = merge_short_runs(wsm, min_words)
+        if split == "sentence":
+            sentences = split_sentences(wsm)
+        else:
+            sentences = get_sentences_speaker_mapping(wsm, self.speaker_ts)
+        labels = {f"Speaker {speaker}": name for speaker, name in self.speaker_names.items()}
+        for sentence in sentences:
+            sentence["speaker"] = labels.get(sentence["speaker"], sentence["speaker"])
+        return sentences
+
+
+def merge_short_runs(wsm, min_words):
+    """Give speaker runs shorter than min_words the speaker of the run before them (or after, for the first run)."""
+    runs = []  # [speaker, first index, length]
+    for k, word in enumerate(wsm):
+        if runs and runs[-1][0] == word["speaker"]:
+            runs[-1][2] += 1
+        else:
+            runs.append([word["speaker"], k, 1])
+    merged = [word.copy() for word in wsm]
+    previous = None
+    for k, (speaker, first, length) in enumerate(runs):
+        if length < min_words:
+            speaker = previous if previous is not None else next(
+                (run[0] for run in runs[k + 1:] if run[2] >= min_words), speaker
+            )
+        for word in merged[first:first + length]:
+            word["speaker"] = speaker
+        previous = speaker
+    return merged
+
+
+def split_sentences(wsm):
+    """Blocks that end at a speaker change or after a sentence-ending word."""
+    sentences = []
+    for word in wsm:
+        last = sentences[-1] if sentences else None
+        text = last["text"].rstrip() if last else ""
+        if last is None or last["speaker"] != f"Speaker {word['speaker']}" or (text and text[-1] in sentence_ending_punctuations):
+            sentences.append({"speaker": f"Speaker {word['speaker']}", "start_time": word["start_time"],
+                              "end_time": word["end_time"], "text": ""})
+        sentences[-1]["end_time"] = word["end_time"]
+        sentences[-1]["text"] += word["word"] + " "
+    return sentences
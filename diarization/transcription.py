@@ -1,4 +1,47 @@
-import torch
+from app.metrics import record_model_load
+
+
+def load_whisper_model(model_name: str, device: str, compute_dtype: str):
+    from faster_whisper import WhisperModel
+    from .model_store import whisper_model_path
+
+    # Run on GPU with FP16, or on CPU with INT8
+    with record_model_load("whisper"):
+        return WhisperModel(whisper_model_path(model_name), device=device, compute_type=compute_dtype)
+
+
+def decode(
+    whisper_model,
+    audio,
+    language: str,
+    beam_size: int = 5,
+    suppress_tokens=None,
+    word_timestamps: bool = False,
+    vad_filter: bool = True,
+    initial_prompt: str = None,
+    on_segment=None,
+):
+    """Run faster-whisper on a file path or a 16 kHz float32 array and return (segments, language).
+
+    faster-whisper decodes lazily, so `on_segment(end)` is called with the end time of every
+    segment as soon as it is decoded.
+    """
+    segments, info = whisper_model.transcribe(
+        audio,
+        language=language,
+        beam_size=beam_size,
+        word_timestamps=word_timestamps,
+        suppress_tokens=suppress_tokens,
+        vad_filter=vad_filter,
+        initial_prompt=initial_prompt,
+    )
+    whisper_results = []
+    for segment in segments:
+        whisper_results.append(segment._asdict())
+        if on_segment is not None:
+            on_segment(segment.end)
+    return whisper_results, info.language
+
 
 def transcribe(
     audio_file: str,
@@ -7,44 +50,59 @@ def transcribe(
     compute_dtype: str,
     suppress_numerals: bool,
     device: str,
+    beam_size: int = 5,
+    word_timestamps: bool = None,
+    on_segment=None,
 ):
-    from faster_whisper import WhisperModel
-    from helper import find_numeral_symbol_tokens, wav2vec2_langs
+    import torch
+    from .helper import find_numeral_symbol_tokens, wav2vec2_langs
 
     # Faster Whisper non-batched
-    # Run on GPU with FP16
-    whisper_model = WhisperModel(model_name, device=device, compute_type=compute_dtype)
-
-    # or run on GPU with INT8
-    # model = WhisperModel(model_size, device="cuda", compute_type="int8_float16")
-    # or run on CPU with INT8
-    # model = WhisperModel(model_size, device="cpu", compute_type="int8")
+    whisper_model = load_whisper_model(model_name, device, compute_dtype)
 
     if suppress_numerals:
         numeral_symbol_tokens = find_numeral_symbol_tokens(whisper_model.hf_tokenizer)
     else:
         numeral_symbol_tokens = None
 
-    if language is not None and language in wav2vec2_langs:
-        word_timestamps = False
-    else:
-        word_timestamps = True
+    if word_timestamps is None:
+        # Word timestamps are only needed when wav2vec2 alignment can't provide them
+        word_timestamps = language is None or language not in wav2vec2_langs
 
-    segments, info = whisper_model.transcribe(
+    whisper_results, language = decode(
+        whisper_model,
         audio_file,
-        language=language,
-        beam_size=5,
-        word_timestamps=word_timestamps,  # TODO: disable this if the language is supported by wav2vec2
+        language,
+        beam_size=beam_size,
         suppress_tokens=numeral_symbol_tokens,
-        vad_filter=True,
+        word_timestamps=word_timestamps,
+        on_segment=on_segment,
     )
-    whisper_results = []
-    for segment in segments:
-        whisper_results.append(segment._asdict())
     # clear gpu vram
     del whisper_model
     torch.cuda.empty_cache()
-    return whisper_results, info.language
+    return whisper_results, language
+
+
+def speech_chunks(whisper_model, audio, language=None, chunk_size=30):
+    """VAD of whisperx's FasterWhisperPipeline.transcribe: speech merged into chunks of at most chunk_size seconds.
+
+    This follows whisperx 3.1 up to the decoding, which the ASR scheduler batches across jobs.
+    Returns (language, vad segments with "start" and "end" in seconds).
+    """
+    import torch
+    from whisperx.audio import SAMPLE_RATE
+    from whisperx.vad import merge_chunks
+
+    vad_segments = whisper_model.vad_model({"waveform": torch.from_numpy(audio).unsqueeze(0), "sample_rate": SAMPLE_RATE})
+    vad_segments = merge_chunks(
+        vad_segments,
+        chunk_size,
+        onset=whisper_model._vad_params["vad_onset"],
+        offset=whisper_model._vad_params["vad_offset"],
+    )
+    language = language or whisper_model.detect_language(audio)
+    return language, vad_segments
 
 
 def transcribe_batched(
@@ -55,18 +113,34 @@ def transcribe_batched(
     compute_dtype: str,
     suppress_numerals: bool,
     device: str,
+    beam_size: int = 5,
+    on_segment=None,
 ):
+    """Batched Whisper through the shared ASR scheduler; returns (segments, language).
+
+    The chunks of this file share forward passes with other jobs, so the batch size is the
+    scheduler's ASR_BATCH_SIZE; `batch_size` only selects this path.
+    """
     import whisperx
+    from whisperx.audio import SAMPLE_RATE
+    from .asr_scheduler import asr_scheduler
 
     # Faster Whisper batched
-    whisper_model = whisperx.load_model(
-        model_name,
-        device,
-        compute_type=compute_dtype,
-        asr_options={"suppress_numerals": suppress_numerals},
-    )
+    whisper_model = asr_scheduler.model(model_name, device, compute_dtype, beam_size)
     audio = whisperx.load_audio(audio_file)
-    result = whisper_model.transcribe(audio, language=language, batch_size=batch_size)
-    del whisper_model
-    torch.cuda.empty_cache()
-    return result["segments"], result["language"]
\ No newline at end of file
+    language, vad_segments = speech_chunks(whisper_model, audio, language)
+    chunks = [audio[int(segment["start"] * SAMPLE_RATE):int(segment["end"] * SAMPLE_RATE)] for segment in vad_segments]
+
+    report = None
+    if on_segment is not None:
+        def report(index):
+            on_segment(vad_segments[index]["end"])
+
+    texts = asr_scheduler.submit(
+        (model_name, device, compute_dtype, beam_size), language, suppress_numerals, chunks, on_segment=report
+    ).result()
+    segments = [
+        {"text": text, "start": round(segment["start"], 3), "end": round(segment["end"], 3)}
+        for text, segment in zip(texts, vad_segments)
+    ]
+    return segments, language
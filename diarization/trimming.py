@@ -0,0 +1,148 @@
+# Silence trimming before every stage
+# One VAD pass finds the speech of a file and the long silences between it are cut out, so
+# separation, diarization, ASR and alignment only process speech. The OffsetMap translates the
+# millisecond times of the compact audio back to the original file.
+import math
+import numpy as np
+
+SAMPLE_RATE = 16000
+
+
+class OffsetMap:
+    """Speech regions of a file and where they start in the compact audio, all in milliseconds.
+
+    Compact times inside a region map to the same place in the original; a time on the boundary
+    of two regions is the start of the next region for starts and the end of the last for ends.
+    """
+
+    def __init__(self, regions, duration):
+        regions = np.asarray(regions, dtype=np.int64).reshape(-1, 2)
+        if np.any(regions[:, 1] < regions[:, 0]) or np.any(regions[1:, 0] < regions[:-1, 1]):
+            raise ValueError("regions must be sorted and must not overlap")
+        self.original_starts = regions[:, 0]
+        self.lengths = regions[:, 1] - regions[:, 0]
+        self.compact_starts = np.concatenate(([0], np.cumsum(self.lengths)[:-1])).astype(np.int64)
+        self.duration = int(duration)
+
+    @property
+    def regions(self):
+        return np.stack([self.original_starts, self.original_starts + self.lengths], axis=1)
+
+    @property
+    def compact_duration(self):
+        return int(self.lengths.sum())
+
+    def to_list(self):
+        return {"regions": self.regions.tolist(), "duration": self.duration}
+
+    @classmethod
+    def from_list(cls, value):
+        return cls(value["regions"], value["duration"])
+
+    def _region(self, times, end):
+        side = "left" if end else "right"
+        return np.clip(np.searchsorted(self.compact_starts, times, side=side) - 1, 0, len(self.lengths) - 1)
+
+    def to_original(self, times, end=False):
+        """Original milliseconds of compact milliseconds, a number or an array."""
+        times = np.asarray(times, dtype=np.int64)
+        if not len(self.lengths):
+            return times
+        index = self._region(times, end)
+        return self.original_starts[index] + times - self.compact_starts[index]
+
+    def map_words(self, wsm):
+        """A word-speaker mapping with its start_time and end_time in original time."""
+        if not wsm:
+            return []
+        starts = self.to_original([word["start_time"] for word in wsm])
+        ends = self.to_original([word["end_time"] for word in wsm], end=True)
+        return [dict(word, start_time=int(start), end_time=int(end)) for word, start, end in zip(wsm, starts, ends)]
+
+    def map_turns(self, speaker_ts):
+        """Speaker turns as [start, end, speaker] rows in original time, split where silence was cut out."""
+        turns = []
+        for start, end, speaker in speaker_ts.to_list():
+            first, last = self._region(start, False), self._region(end, True)
+            for index in range(first, max(last, first) + 1):
+                compact_start = max(start, self.compact_starts[index])
+                compact_end = min(end, self.compact_starts[index] + self.lengths[index])
+                offset = self.original_starts[index] - self.compact_starts[index]
+                turns.append([int(compact_start + offset), int(max(compact_end, compact_start) + offset), speaker])
+        return turns
+
+
+def grid_ms(frame_rate):
+    """The shortest step in whole milliseconds that is also a whole number of frames at frame_rate.
+
+    1 ms at 16 and 48 kHz, 10 ms at 44.1 kHz, 20 ms at 22.05 kHz and 40 ms at 11.025 kHz.
+    """
+    return 1000 // math.gcd(int(frame_rate), 1000)
+
+
+def snap(regions, duration, frame_rate):
+    """Regions widened to the grid of frame_rate, with regions that now touch merged.
+
+    On the grid every boundary is a whole number of frames of the file, so the cut audio has
+    exactly the length the map assumes.
+    """
+    grid = grid_ms(frame_rate)
+    limit = duration // grid * grid
+    snapped = []
+    for start, end in regions:
+        start = start // grid * grid
+        end = min(-(-end // grid) * grid, limit)
+        if snapped and start <= snapped[-1][1]:
+            snapped[-1][1] = max(snapped[-1][1], end)
+        elif end > start:
+            snapped.append([start, end])
+    return snapped
+
+
+def frame_rate(audio_path):
+    """The sample rate of the first audio stream of a file, before any resampling."""
+    import av
+
+    with av.open(audio_path) as container:
+        return container.streams.audio[0].rate
+
+
+def speech_regions(audio_path, min_silence, padding):
+    """Speech regions of a file in milliseconds, and its duration; only silences of min_silence seconds are cut.
+
+    VAD runs on 16 kHz audio, but the regions are snapped to the grid of the file's own rate,
+    which is what trim_silence cuts.
+    """
+    from faster_whisper.audio import decode_audio
+    from faster_whisper.vad import VadOptions, get_speech_timestamps
+
+    audio = decode_audio(audio_path, sampling_rate=SAMPLE_RATE)
+    options = VadOptions(min_silence_duration_ms=int(min_silence * 1000), speech_pad_ms=int(padding * 1000))
+    duration = len(audio) * 1000 // SAMPLE_RATE
+    regions = [
+        [chunk["start"] * 1000 // SAMPLE_RATE, -(-chunk["end"] * 1000 // SAMPLE_RATE)]
+        for chunk in get_speech_timestamps(audio, options)
+    ]
+    return snap(regions, duration, frame_rate(audio_path)), duration
+
+
+def trim_silence(audio_path, output_path, offsets):
+    """Write the speech regions of a file, back to back and in its own format, to output_path as WAV."""
+    from pydub import AudioSegment
+
+    sound = AudioSegment.from_file(audio_path)
+    frames = [
+        sound.get_sample_slice(start * sound.frame_rate // 1000, end * sound.frame_rate // 1000).raw_data
+        for start, end in offsets.regions.tolist()
+    ]
+    sound._spawn(b"".join(frames)).export(output_path, format="wav")
+    return output_path
+
+
+def plan_trim(audio_path, min_silence, padding, min_ratio):
+    """The OffsetMap of a file, or None when less than min_ratio of it is silence worth cutting."""
+    regions, duration = speech_regions(audio_path, min_silence, padding)
+    offsets = OffsetMap(regions, duration)
+    if not regions or duration - offsets.compact_duration < min_ratio * duration:
+        return None
+    return offsets
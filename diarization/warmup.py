@@ -0,0 +1,178 @@
+# Loading and exercising the pipeline models before the first real upload
+# Models are loaded into the caches the request path reads them from, so the first job finds
+# them loaded: the ASR scheduler's pipelines, the language-ID model, the TitaNet model of the
+# speaker embeddings, the punctuation service and the alignment cache. NeMo builds the VAD and
+# MSDD models per diarization batch from the store and demucs runs in its own process, so for
+# those the warm-up only checks the artifacts load and pages them into the OS file cache.
+import os
+import time
+import wave
+import logging
+import tempfile
+import threading
+
+from .profiles import get_profile
+from .model_store import configure_environment, load_nemo_model
+
+warmup_models = ["whisper", "language_id", "vad", "titanet", "msdd", "htdemucs", "punctuation", "alignment"]
+
+# model name -> {"status": "pending" | "loading" | "ready" | "failed" | "skipped", "seconds": float, "error": str}
+model_status = {name: {"status": "pending", "seconds": None, "error": None} for name in warmup_models}
+_status_lock = threading.Lock()
+
+
+def make_warmup_clip(path, duration_ms=2000):
+    """Write a tiny built-in clip (a quiet tone between two short silences) to path."""
+    from pydub import AudioSegment
+    from pydub.generators import Sine
+
+    silence = AudioSegment.silent(duration=250, frame_rate=16000)
+    tone = Sine(220, sample_rate=16000).to_audio_segment(duration=duration_ms - 500, volume=-20)
+    clip = (silence + tone + silence).set_channels(1).set_frame_rate(16000)
+    clip.export(path, format="wav")
+    return path
+
+
+def _device():
+    import torch
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def read_clip(clip_path):
+    """The 16-bit mono warm-up clip as float32 samples."""
+    import numpy as np
+    with wave.open(clip_path, "rb") as f:
+        return np.frombuffer(f.readframes(f.getnframes()), dtype=np.int16).astype(np.float32) / 32768
+
+
+def whisper_pipelines(profiles):
+    """(model, beam size) of the ASR scheduler pipelines the profiles decode with, English routes first."""
+    from .language_id import route_whisper_model
+    pipelines = []
+    for profile in profiles:
+        options = get_profile(profile)
+        for language in ("en", None):
+            pipelines.append((route_whisper_model(options["whisper_model"], language), options["beam_size"]))
+    return list(dict.fromkeys(pipelines))
+
+
+def _warm_whisper(clip_path, profiles):
+    from .asr_scheduler import asr_scheduler
+    from .transcription import transcribe_batched
+    mtypes = {"cpu": "int8", "cuda": "float16"}
+    device = _device()
+    pipelines = whisper_pipelines(profiles)
+    if len(pipelines) > asr_scheduler.max_models:
+        logging.warning(f"Warming up {len(pipelines)} Whisper pipelines, but ASR_MAX_MODELS keeps only {asr_scheduler.max_models} loaded")
+    for name, beam_size in pipelines:
+        # the pipeline stays in the scheduler's cache under the key the jobs of the profile use
+        asr_scheduler.model(name, device, mtypes[device], beam_size)
+        transcribe_batched(clip_path, "en", 1, name, mtypes[device], False, device, beam_size=beam_size)
+
+
+def _warm_language_id(clip_path, profiles):
+    from .language_id import load_language_id_model
+    mtypes = {"cpu": "int8", "cuda": "float16"}
+    device = _device()
+    load_language_id_model(device, mtypes[device])
+
+
+def _warm_vad(clip_path, profiles):
+    load_nemo_model("vad_multilingual_marblenet")
+
+
+def _warm_titanet(clip_path, profiles):
+    from .streaming import titanet_embedder
+    # the embedder keeps the model loaded for the speaker index and live sessions
+    titanet_embedder()(read_clip(clip_path))
+
+
+def _warm_msdd(clip_path, profiles):
+    load_nemo_model("diar_msdd_telephonic")
+
+
+def _warm_htdemucs(clip_path, profiles):
+    from .processing import processing
+    from .workspace import Workspace
+    with Workspace() as workspace:
+        vocal_target = processing(stemming=True, audio_path=clip_path, output_dir=workspace.root)
+        if vocal_target == clip_path:
+            raise RuntimeError("demucs source separation failed on the warm-up clip")
+
+
+def _warm_punctuation(clip_path, profiles):
+    from .punctuation import punctuation_service
+    punctuation_service.predict(["this", "is", "a", "warm", "up", "run"])
+
+
+def _warm_alignment(clip_path, profiles):
+    from .align_cache import alignment_cache
+    device = _device()
+    for language in sorted(alignment_cache.pinned):
+        alignment_cache.get(language, device)
+
+
+warmers = {
+    "whisper": _warm_whisper,
+    "language_id": _warm_language_id,
+    "vad": _warm_vad,
+    "titanet": _warm_titanet,
+    "msdd": _warm_msdd,
+    "htdemucs": _warm_htdemucs,
+    "punctuation": _warm_punctuation,
+    "alignment": _warm_alignment,
+}
+
+
+def _set_status(name, **values):
+    with _status_lock:
+        model_status[name].update(values)
+
+
+def warm_up(models=None, profiles=None):
+    """Load and exercise every requested model once on the built-in clip.
+
+    Models that are not requested are reported as skipped. A failing model is
+    reported as failed with its error; the remaining models are still warmed up.
+    """
+    models = warmup_models if models is None else models
+    profiles = profiles or [None]
+    for name in warmup_models:
+        if name not in models:
+            _set_status(name, status="skipped")
+
+    configure_environment()
+    with tempfile.TemporaryDirectory() as temp_path:
+        clip_path = make_warmup_clip(os.path.join(temp_path, "warmup_clip.wav"))
+        for name in warmup_models:
+            if name not in models:
+                continue
+            _set_status(name, status="loading", error=None)
+            started = time.perf_counter()
+            try:
+                warmers[name](clip_path, profiles)
+            except Exception as e:
+                logging.exception(f"Warm-up of {name} failed")
+                _set_status(name, status="failed", seconds=round(time.perf_counter() - started, 3), error=str(e))
+            else:
+                _set_status(name, status="ready", seconds=round(time.perf_counter() - started, 3))
+
+
+def start_warm_up(models=None, profiles=None):
+    """Run warm_up in a background thread so the process can answer liveness probes meanwhile."""
+    thread = threading.Thread(target=warm_up, args=(models, profiles), name="model-warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+def skip_warm_up():
+    for name in warmup_models:
+        _set_status(name, status="skipped")
+
+
+def readiness():
+    """Return (is_ready, per-model status) for the readiness endpoint."""
+    with _status_lock:
+        status = {name: dict(values) for name, values in model_status.items()}
+    is_ready = all(values["status"] in ("ready", "skipped") for values in status.values())
+    return is_ready, status
@@ -0,0 +1,221 @@
+# Per-job scratch directories for uploads, demucs stems and NeMo inputs
+# Every job gets its own directory, so concurrent jobs never share file names, and the
+# directory is removed when the job ends however it ends. A janitor removes directories
+# left behind by workers that crashed.
+import os
+import json
+import time
+import uuid
+import shutil
+import socket
+import logging
+import threading
+
+from app.core.config import settings
+
+WORKSPACE_PREFIX = "job-"
+OWNER_FILE = ".owner"
+
+
+class WorkspaceError(Exception):
+    pass
+
+
+class WorkspaceQuotaExceeded(WorkspaceError):
+    pass
+
+
+class JobCancelled(WorkspaceError):
+    pass
+
+
+def disk_usage(path):
+    total = 0
+    for root, _, names in os.walk(path):
+        for file_name in names:
+            try:
+                total += os.lstat(os.path.join(root, file_name)).st_size
+            except FileNotFoundError:
+                pass
+    return total
+
+
+def base_dirs():
+    dirs = [os.path.abspath(settings.WORKSPACE_DIR)]
+    if settings.WORKSPACE_TMPFS_DIR:
+        dirs.append(os.path.abspath(settings.WORKSPACE_TMPFS_DIR))
+    return dirs
+
+
+def _pick_base_dir(quota_bytes, tmpfs):
+    # tmpfs is only used when it exists and has room for a full quota, otherwise the job goes to disk
+    tmpfs_dir = settings.WORKSPACE_TMPFS_DIR
+    if tmpfs and tmpfs_dir and os.path.isdir(tmpfs_dir):
+        if shutil.disk_usage(tmpfs_dir).free >= quota_bytes:
+            return os.path.abspath(tmpfs_dir)
+        logging.warning(f"Not enough space on {tmpfs_dir} for a {quota_bytes} byte workspace, using {settings.WORKSPACE_DIR}")
+    return os.path.abspath(settings.WORKSPACE_DIR)
+
+
+class Workspace:
+    """Scratch directory of one job, removed on exit.
+
+    `check()` is called between pipeline stages; it raises WorkspaceQuotaExceeded when the
+    job wrote more than its quota, and JobCancelled once `cancel()` was called from another
+    thread. Either way the directory is removed when the `with` block ends.
+    """
+
+    def __init__(self, job_id=None, quota_mb=None, tmpfs=None):
+        self.job_id = job_id or uuid.uuid4().hex
+        self.quota_bytes = (quota_mb or settings.WORKSPACE_QUOTA_MB) * 1024 * 1024
+        tmpfs = settings.WORKSPACE_USE_TMPFS if tmpfs is None else tmpfs
+        self.root = os.path.join(_pick_base_dir(self.quota_bytes, tmpfs), f"{WORKSPACE_PREFIX}{self.job_id}")
+        self._cancelled = threading.Event()
+
+    def __enter__(self):
+        # a workspace that was created earlier, e.g. by a resumable upload, is adopted as it is
+        if not os.path.isdir(self.root):
+            self.create()
+        return self
+
+    @classmethod
+    def find(cls, job_id):
+        """The existing workspace of a job in any of the base directories, or None."""
+        for base_dir in base_dirs():
+            root = os.path.join(base_dir, f"{WORKSPACE_PREFIX}{job_id}")
+            if os.path.isdir(root):
+                workspace = cls(job_id)
+                workspace.root = root
+                return workspace
+        return None
+
+    def create(self, expires=None):
+        os.makedirs(self.root)
+        self.claim(expires)
+        return self
+
+    def claim(self, expires=None):
+        """Make this process the owner of the workspace.
+
+        With `expires`, a unix time, the janitor removes the workspace once that time passed
+        whether or not its owner is alive, e.g. an upload nobody finishes; without it the
+        workspace is kept as long as the owner lives.
+        """
+        owner_file = os.path.join(self.root, OWNER_FILE)
+        try:
+            with open(owner_file, "r") as f:
+                created = json.load(f)["created"]
+        except (OSError, ValueError, KeyError):
+            created = time.time()
+        owner = {"host": socket.gethostname(), "pid": os.getpid(), "created": created, "expires": expires}
+        with open(owner_file + ".tmp", "w") as f:
+            json.dump(owner, f)
+        os.replace(owner_file + ".tmp", owner_file)
+
+    def __exit__(self, exc_type, exc, tb):
+        self.cleanup()
+        return False
+
+    def path(self, *parts):
+        """Path inside the workspace; parent directories are created."""
+        path = os.path.join(self.root, *parts)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def usage(self):
+        return disk_usage(self.root)
+
+    def reserve(self, size):
+        """Fail before writing `size` more bytes when they would not fit in the quota."""
+        if self.usage() + size > self.quota_bytes:
+            raise WorkspaceQuotaExceeded(f"Job {self.job_id} needs more than its {self.quota_bytes // (1024 * 1024)} MB workspace quota")
+
+    def check(self):
+        if self._cancelled.is_set():
+            raise JobCancelled(f"Job {self.job_id} was cancelled")
+        self.reserve(0)
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cleanup(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def is_orphan(path, max_age):
+    """A workspace is orphaned when its process on this host is gone, or when it is older than max_age.
+
+    The age rule only covers workspaces of other hosts on a shared volume and ones without a
+    readable owner; a workspace whose process on this host is alive is never orphaned, however
+    long its job runs. A workspace with an expiry, such as an unfinished upload, is orphaned
+    once it expired, and not before, whoever owns it.
+    """
+    try:
+        with open(os.path.join(path, OWNER_FILE), "r") as f:
+            owner = json.load(f)
+        created = owner["created"]
+    except (OSError, ValueError, KeyError):
+        owner, created = None, os.path.getmtime(path)
+    if owner and owner.get("expires") is not None:
+        return time.time() > owner["expires"]
+    if owner and owner.get("host") == socket.gethostname() and isinstance(owner.get("pid"), int):
+        return not _pid_alive(owner["pid"])
+    return time.time() - created > max_age
+
+
+def sweep_orphans(max_age=None):
+    """Remove orphaned workspaces and return their paths."""
+    max_age = settings.WORKSPACE_MAX_AGE if max_age is None else max_age
+    removed = []
+    for base_dir in base_dirs():
+        if not os.path.isdir(base_dir):
+            continue
+        for name in os.listdir(base_dir):
+            path = os.path.join(base_dir, name)
+            if not name.startswith(WORKSPACE_PREFIX) or not os.path.isdir(path):
+                continue
+            try:
+                orphan = is_orphan(path, max_age)
+            except FileNotFoundError:
+                continue  # finished while we looked at it
+            if orphan:
+                shutil.rmtree(path, ignore_errors=True)
+                removed.append(path)
+    if removed:
+        logging.info(f"Removed {len(removed)} orphaned workspaces")
+    return removed
+
+
+def _janitor(interval):
+    from .checkpoints import sweep_expired
+
+    while True:
+        try:
+            sweep_orphans()
+            sweep_expired()
+        except Exception:
+            logging.exception("Workspace janitor failed")
+        time.sleep(interval)
+
+
+def start_janitor(interval=None):
+    """Sweep orphaned workspaces and expired checkpoints now and then every `interval` seconds in a daemon thread."""
+    thread = threading.Thread(
+        target=_janitor, args=(interval or settings.WORKSPACE_JANITOR_INTERVAL,), name="workspace-janitor", daemon=True
+    )
+    thread.start()
+    return thread
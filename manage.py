@@ -1,7 +1,14 @@
+import signal
+import asyncio
+import logging
 import click
+from app import blobs
 from app.db import models
 from app.db.database import SessionLocal
+from app.core.config import settings
 from users import auth_service                       
+from diarization import model_store, workspace, checkpoints
+from transcibe import job_queue
 from email_validator import validate_email, EmailNotValidError
 
 def is_valid_email(ctx, param, value):
@@ -112,5 +119,100 @@ def change_admin_email(username, new_email):
         else:
             echo_failure(f"Admin '{username}' not found.")
 
+@cli.command()
+@click.option('--only', multiple=True, help='Artifact name from model_manifest.json. Can be repeated.')
+@click.option('--pin', is_flag=True, help='Pin branch revisions to commits and write the sha256 and size of unpinned artifacts to the manifest.')
+def prefetch_models(only, pin):
+    # Download every missing model artifact into the model store and verify it
+    try:
+        problems = model_store.prefetch(names=list(only) or None, pin=pin)
+    except model_store.ModelStoreError as e:
+        echo_failure(str(e))
+        raise SystemExit(1)
+    if problems:
+        for name, problem in problems.items():
+            echo_failure(f"{name}: {problem}")
+        raise SystemExit(1)
+    echo_success(f"Model store at '{model_store.store_root()}' is complete.")
+
+@cli.command()
+@click.option('--only', multiple=True, help='Artifact name from model_manifest.json. Can be repeated.')
+@click.option('--quick', is_flag=True, help='Only check presence and size, skip the sha256 comparison.')
+@click.option('--strict', is_flag=True, help='Also fail on artifacts the manifest does not pin by commit, sha256 and size.')
+def verify_models(only, quick, strict):
+    # Check every model artifact in the store against the manifest
+    problems = model_store.verify(names=list(only) or None, full=not quick)
+    manifest = model_store.load_manifest()
+    unpinned = model_store.unpinned(names=list(only) or None, manifest=manifest)
+    for name, artifact in manifest['artifacts'].items():
+        if only and name not in only:
+            continue
+        if name in problems:
+            echo_failure(f"{name}: {problems[name]}")
+        elif name in unpinned:
+            (echo_failure if strict else click.echo)(f"{name}: ok (unpinned: {unpinned[name]})")
+        else:
+            echo_success(f"{name}: ok")
+    if problems or (strict and unpinned):
+        raise SystemExit(1)
+
+@cli.command()
+@click.option('--max-age', type=int, default=None, help='Seconds after which a workspace of a live process is removed too.')
+def clean_workspaces(max_age):
+    # Remove the scratch workspaces of crashed workers
+    removed = workspace.sweep_orphans(max_age=max_age)
+    for path in removed:
+        click.echo(f"removed {path}")
+    echo_success(f"Removed {len(removed)} orphaned workspaces.")
+
+@cli.command()
+@click.option('--max-age', type=int, default=None, help='Seconds since their last use after which checkpoints are removed.')
+def clean_checkpoints(max_age):
+    # Remove the stage checkpoints that expired
+    removed = checkpoints.sweep_expired(max_age=max_age)
+    echo_success(f"Removed {len(removed)} expired checkpoints.")
+
+@cli.command()
+@click.option('--batch-size', type=int, default=500, help='Rows moved per transaction.')
+@click.option('--workers', type=int, default=8, help='Blobs compressed and written in parallel.')
+def backfill_blobs(batch_size, workers):
+    # Move the transcripts still stored inline into the blob store
+    try:
+        moved = blobs.backfill(SessionLocal, batch_size=batch_size, workers=workers,
+                               on_batch=lambda moved: click.echo(f"moved {moved} conversions"))
+    except Exception as e:
+        echo_failure(f"Backfill stopped: {str(e)}")
+        raise SystemExit(1)
+    echo_success(f"Moved {moved} conversions to the '{blobs.settings.BLOB_STORE}' blob store.")
+
+@cli.command()
+@click.option('--concurrency', type=int, default=None,
+              help='Jobs transcribed at the same time by this worker. Defaults to SCHEDULER_SLOTS.')
+@click.option('--worker-id', type=str, default=None, help='Name of the worker in the job leases. Defaults to host:pid.')
+def worker(concurrency, worker_id):
+    # Work off the durable job queue until SIGINT or SIGTERM, then finish the running jobs
+    from transcibe.controller import run_queued_job
+    logging.basicConfig(level=logging.INFO)
+
+    async def run():
+        queue_worker = job_queue.Worker(SessionLocal, run_queued_job, worker_id=worker_id,
+                                        concurrency=concurrency or settings.SCHEDULER_SLOTS)
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, queue_worker.stop)
+        echo_success(f"Worker '{queue_worker.worker_id}' is polling the job queue.")
+        await queue_worker.run()
+
+    asyncio.run(run())
+    echo_success("Worker stopped.")
+
+@cli.command()
+@click.argument('job_ids', nargs=-1)
+def requeue_jobs(job_ids):
+    # Give dead-lettered jobs, or only the given ones, a new set of attempts
+    with SessionLocal() as db:
+        count = job_queue.requeue(db, list(job_ids) or None)
+    echo_success(f"Requeued {count} dead jobs.")
+
 if __name__ == '__main__':
     cli()
@@ -0,0 +1,11 @@
+import pytest
+
+
+def pytest_collection_modifyitems(config, items):
+    # The benchmarks are slow, so they only run when asked for with --benchmark-only
+    if config.getoption("benchmark_only", default=False):
+        return
+    skip = pytest.mark.skip(reason="run with --benchmark-only")
+    for item in items:
+        if "benchmarks" in item.nodeid.split("/"):
+            item.add_marker(skip)
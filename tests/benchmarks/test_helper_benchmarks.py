@@ -0,0 +1,95 @@
+import io
+import os
+import functools
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from diarization.helper import (
+    get_words_speaker_mapping,
+    get_realigned_ws_mapping_with_punctuation,
+    get_sentences_speaker_mapping,
+    write_srt,
+    format_timestamp,
+)
+from diarization.speaker import speaker_mapper
+from diarization.timeline import SpeakerTimeline
+from .timeline import make_timeline, write_rttm
+
+# 1M words takes minutes per function, so it is opt-in
+SIZES = [1_000, 10_000, 100_000] + ([1_000_000] if os.environ.get("BENCHMARK_LARGE") else [])
+SWITCH_RATES = [0.01, 0.1, 0.5]
+
+
+@functools.lru_cache(maxsize=None)
+def timeline(n_words, switch_rate):
+    word_timestamps, turns = make_timeline(n_words, switch_rate, seed=n_words)
+    return word_timestamps, SpeakerTimeline.from_turns(turns)
+
+
+@functools.lru_cache(maxsize=None)
+def word_speaker_mapping(n_words, switch_rate):
+    word_timestamps, speaker_ts = timeline(n_words, switch_rate)
+    return get_words_speaker_mapping(word_timestamps, speaker_ts, "start")
+
+
+def run(benchmark, function, n_words, *args):
+    # large inputs get a fixed, small number of rounds to keep the suite bounded
+    if n_words >= 100_000:
+        return benchmark.pedantic(function, args=args, rounds=3, iterations=1)
+    return benchmark(function, *args)
+
+
+@pytest.mark.parametrize("switch_rate", SWITCH_RATES)
+@pytest.mark.parametrize("n_words", SIZES)
+class TestMappingBenchmarks:
+
+    ''' Benchmark mapping every word to a speaker turn'''
+    def test_get_words_speaker_mapping(self, benchmark, n_words, switch_rate):
+        benchmark.group = f"get_words_speaker_mapping-{n_words}"
+        word_timestamps, speaker_ts = timeline(n_words, switch_rate)
+        result = run(benchmark, get_words_speaker_mapping, n_words, word_timestamps, speaker_ts, "start")
+        assert len(result) == n_words
+
+    ''' Benchmark realigning speakers on sentence boundaries'''
+    def test_get_realigned_ws_mapping_with_punctuation(self, benchmark, n_words, switch_rate):
+        benchmark.group = f"get_realigned_ws_mapping_with_punctuation-{n_words}"
+        wsm = word_speaker_mapping(n_words, switch_rate)
+        result = run(benchmark, get_realigned_ws_mapping_with_punctuation, n_words, wsm)
+        assert len(result) == n_words
+
+    ''' Benchmark grouping words into speaker sentences'''
+    def test_get_sentences_speaker_mapping(self, benchmark, n_words, switch_rate):
+        benchmark.group = f"get_sentences_speaker_mapping-{n_words}"
+        wsm = word_speaker_mapping(n_words, switch_rate)
+        _, speaker_ts = timeline(n_words, switch_rate)
+        result = run(benchmark, get_sentences_speaker_mapping, n_words, wsm, speaker_ts)
+        assert result
+
+
+@pytest.mark.parametrize("n_words", SIZES)
+class TestExportBenchmarks:
+
+    ''' Benchmark writing the sentences as SRT'''
+    def test_write_srt(self, benchmark, n_words):
+        benchmark.group = "write_srt"
+        wsm = word_speaker_mapping(n_words, 0.1)
+        ssm = get_sentences_speaker_mapping(wsm, timeline(n_words, 0.1)[1])
+        run(benchmark, lambda: write_srt(ssm, io.StringIO()), n_words)
+
+    ''' Benchmark reading the speaker turns from an RTTM file'''
+    def test_speaker_mapper(self, benchmark, n_words, tmp_path):
+        benchmark.group = "speaker_mapper"
+        _, speaker_ts = timeline(n_words, 0.1)
+        os.makedirs(tmp_path / "pred_rttms")
+        write_rttm(tmp_path / "pred_rttms" / "mono_file.rttm", speaker_ts.to_list())
+        result = run(benchmark, speaker_mapper, n_words, str(tmp_path))
+        assert len(result) == len(speaker_ts)
+
+
+class TestFormatTimestampBenchmark:
+
+    ''' Benchmark formatting one SRT timestamp'''
+    def test_format_timestamp(self, benchmark):
+        benchmark.group = "format_timestamp"
+        assert benchmark(format_timestamp, 3_723_456, True, ",") == "01:02:03,456"
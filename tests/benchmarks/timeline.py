@@ -0,0 +1,41 @@
+import random
+
+# Words drawn for the synthetic transcripts; a few carry sentence-ending punctuation
+VOCABULARY = [
+    "the", "a", "we", "you", "call", "about", "account", "order", "today", "think",
+    "number", "please", "thanks", "right", "okay", "yes", "no", "maybe", "later", "support",
+]
+SENTENCE_END_RATE = 0.08
+
+
+def make_timeline(n_words, switch_rate, n_speakers=3, seed=0):
+    """Generate a seeded synthetic transcript.
+
+    Returns (word_timestamps, speaker_ts): whisper-style word dicts with start/end in seconds,
+    and [start_ms, end_ms, speaker] turns as read from an RTTM. At every word the speaker
+    changes with probability switch_rate.
+    """
+    rng = random.Random(seed)
+    words, turns = [], []
+    t, speaker, turn_start, previous_end = 0.0, 0, 0.0, 0.0
+    for i in range(n_words):
+        start = t + rng.expovariate(20)  # ~50 ms pauses
+        end = start + rng.uniform(0.15, 0.6)
+        if i and rng.random() < switch_rate:
+            turns.append([int(turn_start * 1000), int(previous_end * 1000), speaker])
+            speaker = rng.choice([s for s in range(n_speakers) if s != speaker])
+            turn_start = start
+        word = rng.choice(VOCABULARY)
+        if rng.random() < SENTENCE_END_RATE:
+            word += rng.choice(".?!")
+        words.append({"word": word, "start": round(start, 3), "end": round(end, 3)})
+        t = previous_end = end
+    turns.append([int(turn_start * 1000), int(previous_end * 1000), speaker])
+    return words, turns
+
+
+def write_rttm(path, speaker_ts, name="mono_file"):
+    """Write speaker turns in the RTTM layout NeMo produces."""
+    with open(path, "w") as f:
+        for s, e, speaker in speaker_ts:
+            f.write(f"SPEAKER {name} 1   {s / 1000:.3f}   {(e - s) / 1000:.3f} <NA> <NA> speaker_{speaker} <NA> <NA>\n")
@@ -4,10 +4,12 @@ from datetime import datetime
 sys.path.append("C:/Users/admin/Desktop/fastAPI")
 
 from app.main import app
+from app.db.database import get_db
 from httpx import AsyncClient
+from fastapi.testclient import TestClient
 
 from users.schemas import UserInDB, UserCreate
-from users import auth_service
+from users import auth_service, get_current_active_user, get_websocket_user
 from users.accounts import generate_username
 
 
@@ -28,3 +30,96 @@ def dummy_user() -> UserInDB:
     credit = 60
     time = datetime.now()
     return UserInDB(**new_user.model_dump(), username=generated_username, current_credit=credit, created_at=time, updated_at=time)
+
+
+class FakeUser:
+    """The signed-in user of the API tests; tests change the attributes they need."""
+    id = 1
+    username = "ada"
+    email = "ada@example.com"
+    current_credit = 10
+    is_admin = False
+    is_superuser = False
+    default_profile = None
+    tier = None
+
+
+class FakeDB:
+    """A session whose queries return `rows` and whose execute returns `results` in turn.
+
+    Added and deleted records are kept; a flush gives added records without an id the next one.
+    """
+
+    def __init__(self, rows=(), results=(), next_id=1):
+        self.rows = list(rows)
+        self.results = iter(results)
+        self.next_id = next_id
+        self.added = []
+        self.deleted = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def query(self, *models):
+        return self
+
+    def filter(self, *args):
+        return self
+
+    def first(self):
+        return self.rows[0] if self.rows else None
+
+    def all(self):
+        return self.rows
+
+    def execute(self, statement):
+        return next(self.results)
+
+    def add(self, record):
+        self.added.append(record)
+
+    def delete(self, record):
+        self.deleted.append(record)
+
+    def flush(self):
+        for record in self.added:
+            if getattr(record, "id", None) is None:
+                record.id = self.next_id
+                self.next_id += 1
+
+    def commit(self):
+        self.flush()
+
+    def rollback(self):
+        pass
+
+    def refresh(self, record):
+        pass
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def user():
+    return FakeUser()
+
+
+@pytest.fixture
+def db():
+    return FakeDB()
+
+
+@pytest.fixture
+def client(user, db):
+    """A client of the app signed in as `user`, over HTTP and WebSocket, with `db` as its session."""
+    app.dependency_overrides[get_current_active_user] = lambda: user
+    app.dependency_overrides[get_websocket_user] = lambda: user
+    app.dependency_overrides[get_db] = lambda: db
+    try:
+        yield TestClient(app)
+    finally:
+        app.dependency_overrides.clear()
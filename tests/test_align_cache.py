@@ -0,0 +1,114 @@
+import threading
+from concurrent.futures import Future
+from diarization import align_cache
+from diarization.align_cache import AlignmentModelCache
+
+
+def make_cache(budget, pinned=(), sizes=None):
+    sizes = sizes or {}
+    loads = []
+
+    def loader(language, device):
+        loads.append(language)
+        return (f"model-{language}", {"language": language})
+
+    cache = AlignmentModelCache(budget, pinned=pinned, loader=loader, sizer=lambda loaded: sizes.get(loaded[1]["language"], 100))
+    return cache, loads
+
+
+class TestAlignmentModelCache:
+
+    ''' Test that the least recently used model is evicted to stay within the byte budget'''
+    def test_lru_eviction(self):
+        cache, loads = make_cache(250)
+        cache.get("en", "cpu")
+        cache.get("de", "cpu")
+        cache.get("en", "cpu")
+        cache.get("es", "cpu")
+        assert cache.stats()["languages"] == ["en", "es"]
+        cache.get("en", "cpu")
+        assert loads == ["en", "de", "es"]
+        stats = cache.stats()
+        assert (stats["hits"], stats["misses"], stats["admissions"], stats["evictions"]) == (2, 3, 3, 1)
+        assert stats["bytes"] == 200
+
+    ''' Test that pinned languages are never evicted and a model that does not fit is used once without caching'''
+    def test_pinning_and_rejection(self):
+        cache, loads = make_cache(250, pinned=["en"], sizes={"en": 200, "ja": 300})
+        cache.get("en", "cpu")
+        assert cache.get("ja", "cpu") == ("model-ja", {"language": "ja"})
+        cache.get("ja", "cpu")
+        assert loads == ["en", "ja", "ja"]
+        assert cache.stats()["languages"] == ["en"] and cache.stats()["rejections"] == 2
+
+    ''' Test that concurrent misses for one language share a single load'''
+    def test_concurrent_misses(self, monkeypatch):
+        release, blocked = threading.Event(), threading.Semaphore(0)
+        loads = []
+
+        class WaitedFuture(Future):
+            def result(self, timeout=None):
+                blocked.release()
+                return super().result(timeout)
+
+        def loader(language, device):
+            loads.append(language)
+            blocked.release()
+            release.wait(5)
+            return ("model", {})
+
+        monkeypatch.setattr(align_cache, "Future", WaitedFuture)
+        cache = AlignmentModelCache(1000, loader=loader, sizer=lambda loaded: 10)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get("en", "cpu"))) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        # one thread is in the loader and the other three wait for its load before it finishes
+        for _ in threads:
+            assert blocked.acquire(timeout=5)
+        release.set()
+        for thread in threads:
+            thread.join()
+        assert loads == ["en"] and len(results) == 4
+
+    ''' Test that a model that cannot fit next to the pinned ones is rejected without evicting anything'''
+    def test_rejection_keeps_cache(self):
+        cache, loads = make_cache(100, pinned=["a"], sizes={"a": 60, "b": 30, "c": 50})
+        cache.get("a", "cpu")
+        cache.get("b", "cpu")
+        cache.get("c", "cpu")
+        stats = cache.stats()
+        assert stats["languages"] == ["a", "b"] and (stats["evictions"], stats["rejections"]) == (0, 1)
+
+    ''' Test that a failing sizer fails the waiting threads and lets later calls load again'''
+    def test_sizer_failure(self):
+        release, sizes = threading.Event(), []
+
+        def loader(language, device):
+            release.wait(5)
+            return ("model", {})
+
+        def sizer(loaded):
+            sizes.append(loaded)
+            if len(sizes) == 1:
+                raise RuntimeError("no parameters")
+            return 10
+
+        cache = AlignmentModelCache(1000, loader=loader, sizer=sizer)
+        errors = []
+
+        def get():
+            try:
+                cache.get("en", "cpu")
+            except RuntimeError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=get) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        release.set()
+        for thread in threads:
+            thread.join(5)
+            assert not thread.is_alive()
+        assert len(errors) >= 1
+        assert cache.get("en", "cpu") == ("model", {}) and cache.stats()["languages"] == ["en"]
@@ -0,0 +1,92 @@
+import threading
+import numpy as np
+import pytest
+from diarization.asr_scheduler import ASRScheduler, check_pipeline, mel_bins
+
+
+def fake_decoder(pipeline, language, suppress_numerals, chunks):
+    # a chunk is its own text; the options it was decoded with are appended
+    batches.append((language, suppress_numerals, len(chunks)))
+    return [f"{chunk}/{language}/{'nonum' if suppress_numerals else 'num'}" for chunk in chunks]
+
+batches = []
+
+
+def run_jobs(scheduler, jobs):
+    results = [None] * len(jobs)
+    barrier = threading.Barrier(len(jobs))
+
+    def run(k):
+        language, suppress_numerals, chunks, progress = jobs[k]
+        barrier.wait()
+        future = scheduler.submit(("small", "cpu", "int8", 5), language, suppress_numerals, chunks, on_segment=progress.append)
+        results[k] = future.result(timeout=10)
+
+    threads = [threading.Thread(target=run, args=(k,)) for k in range(len(jobs))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+class TestASRScheduler:
+
+    ''' Test that chunks of concurrent jobs fill shared batches and come back to each job in order'''
+    def test_shared_batches(self):
+        batches.clear()
+        scheduler = ASRScheduler(max_batch_size=4, max_wait=0.5, loader=lambda *key: object(), decoder=fake_decoder)
+        progress = [[], [], []]
+        jobs = [("en", False, [f"a{k}" for k in range(5)], progress[0]),
+                ("en", False, [f"b{k}" for k in range(2)], progress[1]),
+                ("en", False, ["c0"], progress[2])]
+        results = run_jobs(scheduler, jobs)
+        assert results[0] == [f"a{k}/en/num" for k in range(5)]
+        assert results[1] == ["b0/en/num", "b1/en/num"] and results[2] == ["c0/en/num"]
+        assert progress == [list(range(5)), [0, 1], [0]]
+        assert sorted(size for _, _, size in batches) == [4, 4]
+
+    ''' Test that chunks of other languages or numeral settings are never decoded in the same batch'''
+    def test_options_not_mixed(self):
+        batches.clear()
+        scheduler = ASRScheduler(max_batch_size=8, max_wait=0.2, loader=lambda *key: object(), decoder=fake_decoder)
+        jobs = [("en", False, ["a0", "a1"], []), ("de", False, ["b0"], []), ("en", True, ["c0"], [])]
+        results = run_jobs(scheduler, jobs)
+        assert results == [["a0/en/num", "a1/en/num"], ["b0/de/num"], ["c0/en/nonum"]]
+        assert sorted(batches) == [("de", False, 1), ("en", False, 2), ("en", True, 1)]
+
+    ''' Test that only the most recently used pipelines stay loaded'''
+    def test_model_eviction(self):
+        loads = []
+        scheduler = ASRScheduler(max_models=2, loader=lambda *key: loads.append(key[0]) or key[0], decoder=fake_decoder)
+        for name in ["small", "medium", "small", "large-v2", "small", "medium"]:
+            assert scheduler.model(name, "cpu", "int8") == name
+        assert loads == ["small", "medium", "large-v2", "medium"]
+
+    ''' Test that the mel bins come from feat_kwargs, else from the feature extractor's filter bank'''
+    def test_mel_bins(self):
+        class Extractor:
+            mel_filters = np.zeros((128, 201))
+
+        class Model:
+            feat_kwargs = {"feature_size": 128}
+
+        assert mel_bins(Model()) == 128
+        Model.feat_kwargs = {}
+        assert mel_bins(Model()) == 80
+        Model.feature_extractor = Extractor()
+        assert mel_bins(Model()) == 128
+
+    ''' Test that a whisperx pipeline without the internals decode_chunks uses is rejected when it is loaded'''
+    def test_check_pipeline(self):
+        class Model:
+            hf_tokenizer = None
+
+        class Pipeline:
+            model = Model()
+            options = None
+
+        with pytest.raises(RuntimeError, match="generate_segment_batched"):
+            check_pipeline(Pipeline())
+        Model.generate_segment_batched = lambda self, *args: []
+        check_pipeline(Pipeline())
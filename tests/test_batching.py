@@ -0,0 +1,63 @@
+import threading
+from diarization.batching import BatchRequest, MicroBatcher
+
+
+class Request(BatchRequest):
+    def __init__(self, items, key=None):
+        super().__init__(items, key)
+        self.results = [None] * len(items)
+
+    def result(self):
+        return self.results
+
+
+class Recorder(MicroBatcher):
+    """Doubles items and records the key of every batch; the first batch waits for `release`."""
+
+    def __init__(self, max_batch_size=1, max_wait=0.0):
+        super().__init__(max_batch_size, max_wait)
+        self.keys = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def run_batch(self, key, items):
+        self.keys.append(key)
+        self.started.set()
+        self.release.wait(timeout=5)
+        return [item * 2 for item in items]
+
+    def deliver(self, request, index, result):
+        if result < 0:
+            raise ValueError("negative item")
+        request.results[index] = result
+
+
+class TestMicroBatcher:
+
+    ''' Test that a key that arrives behind a long request of another key gets the next batch'''
+    def test_keys_take_turns(self):
+        batcher = Recorder()
+        long_request = batcher.submit_request(Request([1, 2, 3, 4], key="small"))
+        assert batcher.started.wait(timeout=5)
+        other_request = batcher.submit_request(Request([5], key="medium"))
+        batcher.release.set()
+        assert long_request.result(timeout=5) == [2, 4, 6, 8] and other_request.result(timeout=5) == [10]
+        assert batcher.keys == ["small", "medium", "small", "small", "small"]
+
+    ''' Test that an error while collecting a batch fails the waiting requests and the worker keeps serving'''
+    def test_worker_survives(self):
+        batcher = Recorder()
+        batcher.release.set()
+        broken = batcher.submit_request(Request([1], key=["unhashable"]))
+        assert isinstance(broken.exception(timeout=5), TypeError)
+        assert batcher.submit_request(Request([1, 2], key="small")).result(timeout=5) == [2, 4]
+        assert batcher._thread.is_alive()
+
+    ''' Test that a failed delivery only fails its own request'''
+    def test_delivery_failure(self):
+        batcher = Recorder(max_batch_size=4, max_wait=0.2)
+        batcher.release.set()
+        bad, good = Request([-1, 1]), Request([3])
+        futures = [batcher.submit_request(bad), batcher.submit_request(good)]
+        assert isinstance(futures[0].exception(timeout=5), ValueError)
+        assert futures[1].result(timeout=5) == [6] and batcher.queue_depth() == 0
@@ -0,0 +1,176 @@
+import io
+import os
+import pytest
+import zstandard
+from datetime import datetime
+from sqlalchemy import create_engine, delete, text, DefaultClause, MetaData
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker
+from app import blobs
+from app.blobs import LocalBlobStore
+from app.db.models import AudioConversion, TranscriptionJob, User
+from transcibe import job_queue
+
+
+@pytest.fixture
+def session(store):
+    engine = create_engine("sqlite://")
+    metadata = MetaData()
+    for table in (User.__table__, AudioConversion.__table__, TranscriptionJob.__table__):
+        for column in table.to_metadata(metadata).columns:
+            # SQLite has no now()
+            if column.server_default is not None and "now()" in str(column.server_default.arg):
+                column.server_default = DefaultClause(text("CURRENT_TIMESTAMP"))
+    metadata.create_all(engine)
+    with sessionmaker(bind=engine)() as db:
+        db.add(User(id=1, username="alice", email="a@example.com", password="x", created_at=datetime.now(), updated_at=datetime.now()))
+        db.commit()
+        yield db
+
+
+def conversion(text, user_id=1):
+    return AudioConversion(text_content=text, words=b"words of " + text.encode(), user_id=user_id, created_at=datetime.now())
+
+
+def blob_files(store):
+    return sorted(name for _, _, names in os.walk(store.root) for name in names)
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = LocalBlobStore(str(tmp_path), level=3)
+    monkeypatch.setitem(blobs._stores, "local", store)
+    monkeypatch.setattr(blobs.settings, "BLOB_STORE", "local")
+    return store
+
+
+class TestBlobStore:
+
+    ''' Test that content is stored once under its hash, compressed, and streamed back in chunks'''
+    def test_put_and_stream(self, store):
+        data = b"Speaker 0: hello there. " * 10000
+        ref = store.put(data)
+        assert ref.pointer == f"local:{ref.sha256}" and ref.size == len(data)
+        assert store.put(data).pointer == ref.pointer
+        files = [name for _, _, names in os.walk(store.root) for name in names]
+        assert files == [f"{ref.sha256}.zst"]
+        assert os.path.getsize(store.path(ref.sha256)) < len(data) // 20
+        with open(store.path(ref.sha256), "rb") as f:
+            assert zstandard.ZstdDecompressor().decompressobj().decompress(f.read()) == data
+        chunks = list(store.stream(ref.sha256, chunk_size=4096))
+        assert len(chunks) > 1 and b"".join(chunks) == data
+        with pytest.raises(blobs.BlobNotFound):
+            store.read("0" * 64)
+
+    ''' Test that a blob whose content does not match its hash fails to read'''
+    def test_corrupted(self, store):
+        ref = store.put(b"Speaker 0: hello")
+        with open(store.path(ref.sha256), "wb") as f:
+            f.write(zstandard.ZstdCompressor().compress(b"Speaker 0: hellO"))
+        with pytest.raises(blobs.BlobCorrupted):
+            store.read(ref.sha256)
+
+
+    ''' Test that a file is streamed into the store under the same hash as its bytes'''
+    def test_put_file(self, store, tmp_path):
+        data = os.urandom(300 * 1024)
+        path = tmp_path / "upload.wav"
+        path.write_bytes(data)
+        with open(path, "rb") as f:
+            ref = store.put_file(f, level=1, chunk_size=4096)
+        assert ref.size == len(data) and ref.pointer == store.put(data).pointer
+        assert store.read(ref.sha256) == data
+
+
+class TestConversionBlobs:
+
+    ''' Test that a conversion keeps only the pointer, size and hash of its text and words'''
+    def test_conversion_blobs(self, store):
+        conversion = AudioConversion(text_content="\n\nSpeaker 0: héllo", words=b"\x78\x9c")
+        assert conversion._text_content is None and conversion._words is None
+        assert conversion.text_blob == f"local:{conversion.text_sha256}" and conversion.text_size == len("\n\nSpeaker 0: héllo".encode())
+        assert conversion.text_content == "\n\nSpeaker 0: héllo" and conversion.words == b"\x78\x9c"
+        assert b"".join(conversion.stream_text()).decode() == "\n\nSpeaker 0: héllo"
+
+    ''' Test that the text stays inline when the blob store is turned off'''
+    def test_inline(self, store, monkeypatch):
+        monkeypatch.setattr(blobs.settings, "BLOB_STORE_ENABLED", False)
+        conversion = AudioConversion(text_content="inline", words=None)
+        assert conversion._text_content == "inline" and conversion.text_blob is None and conversion.text_content == "inline"
+        assert conversion.words is None and list(conversion.stream_text()) == [b"inline"]
+
+    ''' Test that listing conversions reads no blobs: the list has the text size but not the text'''
+    def test_list_without_text(self, store, client, db):
+        conversion = AudioConversion(id=3, user_id=1, profile="fast", text_blob="local:" + "0" * 64, text_size=1200)
+        conversion.user = User(id=1, username="alice", email="a@example.com", current_credit=10, is_superuser=False)
+        db.rows = [conversion]
+        response = client.get("/transcibe/")
+        assert response.status_code == 200
+        assert response.json()[0]["text_size"] == 1200 and "text_content" not in response.json()[0]
+
+
+class TestBlobLifecycle:
+
+    ''' Test that blobs are written when their row is flushed, and not at all when the insert fails'''
+    def test_write_after_flush(self, store, session):
+        row = conversion("Speaker 0: hello")
+        assert blob_files(store) == [] and row.text_content == "Speaker 0: hello"
+        session.add(conversion("Speaker 0: orphan", user_id=None))
+        with pytest.raises(IntegrityError):
+            session.flush()
+        session.rollback()
+        assert blob_files(store) == []
+        session.add(row)
+        session.commit()
+        assert blob_files(store) == sorted([f"{row.text_sha256}.zst", f"{row.words_sha256}.zst"])
+        assert row.unwritten_blobs == {} and row.text_content == "Speaker 0: hello"
+
+    ''' Test that the blobs of deleted conversions are deleted once no other conversion points at them'''
+    def test_release(self, store, session):
+        first, second = conversion("Speaker 0: same"), conversion("Speaker 0: same")
+        session.add_all([first, second])
+        session.commit()
+        pointers = [first.text_blob, first.words_blob]
+        session.execute(delete(AudioConversion).where(AudioConversion.id == first.id))
+        session.commit()
+        assert blobs.release_blobs(session, pointers) == [] and len(blob_files(store)) == 2
+        session.execute(delete(AudioConversion).where(AudioConversion.id == second.id))
+        session.commit()
+        assert sorted(blobs.release_blobs(session, pointers + [None])) == sorted(pointers) and blob_files(store) == []
+
+    ''' Test that a blob deleted after it was hashed but before it was locked is written again'''
+    def test_put_file_lock(self, store):
+        existing = store.put(b"audio")
+        locked = []
+
+        def lock(pointer):
+            locked.append(pointer)
+            store.delete(existing.sha256)
+
+        ref = store.put_file(io.BytesIO(b"audio"), lock=lock)
+        assert locked == [ref.pointer] and store.read(ref.sha256) == b"audio"
+
+    ''' Test that a finished job's audio is kept while another job with the same file is queued'''
+    def test_release_audio(self, store, session):
+        ref = store.put(b"audio")
+        done, queued = (job_queue.enqueue(session, 1, "fast", {}, ref.pointer) for _ in range(2))
+        done.status = "done"
+        session.commit()
+        job_queue.release_audio(session, done)
+        assert store.exists(ref.sha256)
+        queued.status = "done"
+        session.commit()
+        job_queue.release_audio(session, done)
+        assert not store.exists(ref.sha256)
+
+    ''' Test that on PostgreSQL a blob is locked for the rest of the transaction before it is written or checked'''
+    def test_lock(self):
+        class Connection:
+            class dialect:
+                name = "postgresql"
+            def execute(self, statement):
+                self.statement = str(statement)
+
+        connection = Connection()
+        blobs.lock_blob(type("Session", (), {"connection": lambda self: connection})(), "local:abc")
+        assert connection.statement.startswith("SELECT pg_advisory_xact_lock(hashtext(")
@@ -0,0 +1,119 @@
+import os
+import time
+import pytest
+from app.metrics import StageTimer
+from diarization import checkpoints as checkpoints_module
+from diarization import workspace as workspace_module
+from diarization.checkpoints import CheckpointStore
+from diarization.diarize import checkpointed
+from diarization.speaker_index import SpeakerIndexStore
+from diarization.workspace import Workspace
+from transcibe import audio_helper, controller
+
+
+class TestCheckpointStore:
+
+    ''' Test that a saved artifact is loaded back, and that other parameters give another key'''
+    def test_roundtrip(self, tmp_path):
+        store = CheckpointStore(root=str(tmp_path))
+        key = CheckpointStore.key("asr", "input-hash", model="small", beam_size=1)
+        assert store.load(key) is None
+        store.save(key, "asr", {"segments": [{"start": 0.0, "end": 1.5, "words": [(0.0, 0.4, "hi")]}], "language": "en"})
+        assert store.load(key)["segments"][0]["words"] == [[0.0, 0.4, "hi"]]
+        assert CheckpointStore.key("asr", "input-hash", model="small", beam_size=5) != key
+
+    ''' Test that expired checkpoints are not used and are garbage-collected'''
+    def test_expiry(self, tmp_path):
+        store = CheckpointStore(root=str(tmp_path), max_age=60)
+        vocals = tmp_path / "vocals.wav"
+        vocals.write_bytes(b"RIFF")
+        store.save_file("a" * 64, "separation", str(vocals))
+        store.save("b" * 64, "diarization", [[0, 1000, 0]])
+        assert open(store.load_file("a" * 64), "rb").read() == b"RIFF"
+
+        old = time.time() - 120
+        os.utime(os.path.join(store._dir("a" * 64), "meta.json"), (old, old))
+        assert store.load_file("a" * 64) is None
+        assert store.sweep() == [store._dir("a" * 64)]
+        assert store.load("b" * 64) == [[0, 1000, 0]]
+
+    ''' Test that the least recently used checkpoints are removed while the store is over its size'''
+    def test_size_bound(self, tmp_path):
+        store = CheckpointStore(root=str(tmp_path / "store"), max_bytes=2500)
+        for k, key in enumerate(("a" * 64, "b" * 64, "c" * 64)):
+            store.save(key, "asr", "x" * 1000)
+            used = time.time() - 100 + k
+            os.utime(os.path.join(store._dir(key), "meta.json"), (used, used))
+        assert store.sweep() == [store._dir("a" * 64)]
+        assert store.load("a" * 64) is None and store.load("c" * 64) == "x" * 1000
+
+    ''' Test that the keys a job used are recorded and their checkpoints purged on request'''
+    def test_purge(self, tmp_path):
+        store = CheckpointStore(root=str(tmp_path))
+        store.save("a" * 64, "asr", [])
+        store.save("b" * 64, "diarization", [])
+        assert CheckpointStore(root=str(tmp_path)).load("b" * 64) == []
+        assert store.keys == {"a" * 64, "b" * 64}
+        assert store.purge(["a" * 64, "d" * 64]) == [store._dir("a" * 64)]
+        assert store.load("a" * 64) is None and store.load("b" * 64) == []
+
+    ''' Test that a stage with a valid checkpoint is not computed again'''
+    def test_checkpointed(self, tmp_path):
+        store = CheckpointStore(root=str(tmp_path))
+        reported, calls = [], []
+        timer = StageTimer(None, progress=lambda stage, status, **details: reported.append(status))
+
+        def compute():
+            calls.append(1)
+            return [{"word": "hello", "start": 0.0, "end": 0.5}]
+
+        first = checkpointed(store, "c" * 64, "alignment", timer, compute)
+        second = checkpointed(store, "c" * 64, "alignment", timer, compute)
+        assert first == second and len(calls) == 1
+        assert reported == ["started", "done", "cached"]
+
+
+class TestRetries:
+
+    ''' Test that a failed attempt is retried in the same workspace, and that cancellation is not retried'''
+    def test_retry(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(workspace_module.settings, "WORKSPACE_DIR", str(tmp_path))
+        monkeypatch.setattr(workspace_module.settings, "WORKSPACE_TMPFS_DIR", None)
+        monkeypatch.setattr(audio_helper.settings, "JOB_RETRIES", 1)
+        attempts = []
+
+        def flaky(audio_path, profile=None, workspace=None, **options):
+            attempts.append(audio_path)
+            if len(attempts) == 1:
+                raise RuntimeError("CUDA out of memory")
+            return [{"speaker": "Speaker 0", "text": "hi", "end_time": 1000}]
+
+        monkeypatch.setattr(audio_helper, "transcribe", flaky)
+        assert audio_helper.transcribe_in_workspace(Workspace(), b"RIFF")[0]["text"] == "hi"
+        assert len(attempts) == 2 and attempts[0] == attempts[1]
+
+        workspace = Workspace()
+        workspace.cancel()
+        monkeypatch.setattr(audio_helper, "transcribe", lambda audio_path, workspace=None, **options: workspace.check())
+        with pytest.raises(workspace_module.JobCancelled):
+            audio_helper.transcribe_in_workspace(workspace, b"RIFF")
+
+
+class TestDeletion:
+
+    ''' Test that deleting a conversion deletes the checkpoints it was computed from'''
+    def test_delete_conversion(self, client, db, tmp_path, monkeypatch):
+        monkeypatch.setattr(checkpoints_module.settings, "CHECKPOINT_DIR", str(tmp_path))
+        store = CheckpointStore()
+        store.save("a" * 64, "asr", [])
+        store.save("b" * 64, "asr", [])
+
+        class FakeConversion:
+            user_id = 1
+            text_blob = words_blob = None
+            checkpoint_keys = ["a" * 64]
+
+        db.rows = [FakeConversion()]
+        monkeypatch.setattr(controller, "speaker_indexes", SpeakerIndexStore(str(tmp_path / "speakers")))
+        assert client.delete("/transcibe/transcribe/7").status_code == 200
+        assert store.load("a" * 64) is None and store.load("b" * 64) == []
@@ -0,0 +1,99 @@
+import os
+import threading
+import pytest
+from diarization import workspace as workspace_module
+from diarization.service import DiarizationService, DiarizationRequest, validate_speaker_hints, batch_workspace
+from diarization.workspace import Workspace
+from diarization.timeline import SpeakerTimeline
+
+
+class RecordingService(DiarizationService):
+    ''' DiarizationService that records its batches instead of running NeMo'''
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.batches = []
+        self.release = threading.Event()
+
+    def _diarize_batch(self, batch):
+        self.release.wait(timeout=5)
+        self.batches.append([request.audio_path for request in batch])
+        # one speaker per file, or the known count when it was passed
+        results = []
+        for index, request in enumerate(batch):
+            speakers = range(request.num_speakers) if request.num_speakers else [index]
+            results.append(SpeakerTimeline.from_turns([0, 1000, speaker] for speaker in speakers))
+        return results
+
+
+class TestDiarizationService:
+
+    ''' Test that files queued together are diarized in one pass and routed back to their jobs'''
+    def test_batches_queued_files(self):
+        service = RecordingService(max_batch_size=4, max_wait=0.5)
+        futures = [service.submit(f"file_{i}.wav") for i in range(3)]
+        service.release.set()
+        results = [future.result(timeout=5).to_list() for future in futures]
+        assert service.batches == [["file_0.wav", "file_1.wav", "file_2.wav"]]
+        assert results == [[[0, 1000, 0]], [[0, 1000, 1]], [[0, 1000, 2]]]
+
+    ''' Test that a batch never grows past max_batch_size'''
+    def test_respects_max_batch_size(self):
+        service = RecordingService(max_batch_size=2, max_wait=0.5)
+        futures = [service.submit(f"file_{i}.wav") for i in range(5)]
+        service.release.set()
+        for future in futures:
+            future.result(timeout=5)
+        assert [len(batch) for batch in service.batches] == [2, 2, 1]
+
+    ''' Test that a failing pass fails every job of the batch'''
+    def test_failure_is_propagated(self):
+        class FailingService(DiarizationService):
+            def _diarize_batch(self, batch):
+                raise RuntimeError("NeMo failed")
+
+        service = FailingService(max_batch_size=2, max_wait=0.1)
+        future = service.submit("file.wav")
+        with pytest.raises(RuntimeError) as error:
+            future.result(timeout=5)
+        assert str(error.value) == "NeMo failed"
+
+    ''' Test that files with different backends or clustering settings never share a pass'''
+    def test_groups_by_backend_and_hints(self):
+        service = RecordingService(max_batch_size=4, max_wait=0.5)
+        futures = [
+            service.submit("msdd_1.wav"),
+            service.submit("clustering.wav", backend="clustering"),
+            service.submit("msdd_2.wav"),
+            service.submit("two_speakers.wav", num_speakers=2),
+        ]
+        service.release.set()
+        for future in futures:
+            future.result(timeout=5)
+        assert service.batches == [["msdd_1.wav", "msdd_2.wav"], ["clustering.wav"], ["two_speakers.wav"]]
+
+    ''' Test that a result with fewer speakers than min_speakers is rerun with the minimum as a known count'''
+    def test_min_speakers_reruns_file(self):
+        service = RecordingService(max_batch_size=2, max_wait=0.1)
+        service.release.set()
+        speaker_ts = service.submit("call.wav", min_speakers=3).result(timeout=5)
+        assert service.batches == [["call.wav"], ["call.wav"]]
+        assert speaker_ts.num_speakers == 3
+
+    ''' Test that a NeMo pass writes into a workspace with the summed quota of its jobs'''
+    def test_batch_workspace(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(workspace_module.settings, "WORKSPACE_DIR", str(tmp_path))
+        monkeypatch.setattr(workspace_module.settings, "WORKSPACE_TMPFS_DIR", None)
+        batch = [DiarizationRequest("a.wav", "msdd", workspace=Workspace(quota_mb=100)),
+                 DiarizationRequest("b.wav", "msdd", workspace=Workspace(quota_mb=50))]
+        with batch_workspace(batch) as workspace:
+            assert workspace.root.startswith(str(tmp_path)) and os.path.isdir(workspace.root)
+            assert workspace.quota_bytes == 150 * 1024 * 1024
+        assert not os.path.exists(workspace.root)
+
+    ''' Test the validation of the speaker-count hints'''
+    def test_validate_speaker_hints(self):
+        assert validate_speaker_hints(None, 2, 2) == (2, None, None)
+        assert validate_speaker_hints(None, 1, 4) == (None, 1, 4)
+        for hints in [(0, None, None), (2, 1, None), (None, 3, 2)]:
+            with pytest.raises(ValueError):
+                validate_speaker_hints(*hints)
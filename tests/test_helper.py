@@ -0,0 +1,15 @@
+from diarization.helper import get_realigned_ws_mapping_with_punctuation
+
+
+class TestHelper:
+
+    ''' Test that realigning a transcript whose last sentence has no punctuation does not run past the end'''
+    def test_realign_unpunctuated_tail(self):
+        wsm = [
+            {"word": "hello.", "start_time": 0, "end_time": 100, "speaker": 0},
+            {"word": "how", "start_time": 100, "end_time": 200, "speaker": 0},
+            {"word": "are", "start_time": 200, "end_time": 300, "speaker": 1},
+            {"word": "you", "start_time": 300, "end_time": 400, "speaker": 1},
+        ]
+        result = get_realigned_ws_mapping_with_punctuation(wsm)
+        assert [word["speaker"] for word in result] == [0, 1, 1, 1]
@@ -0,0 +1,273 @@
+import os
+import uuid
+import asyncio
+import threading
+import pytest
+from sqlalchemy import create_engine, func, select, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import sessionmaker
+from app.db.database import Base
+from app.db.models import AudioConversion, TranscriptionJob, User
+from transcibe import job_queue
+from transcibe.job_queue import Worker, JobFailed
+
+# The TestPostgres tests run the queue statements against this database, each in a schema of its own
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+
+
+def sql(statement):
+    return str(statement.compile(dialect=postgresql.dialect()))
+
+
+def top_level_terms(clause):
+    terms, depth, current = [], 0, ""
+    for char in clause:
+        depth += {"(": 1, ")": -1}.get(char, 0)
+        if char == "," and depth == 0:
+            terms.append(current.strip())
+            current = ""
+        else:
+            current += char
+    return terms + [current.strip()]
+
+
+def make_job(attempts=1):
+    return TranscriptionJob(id="job1", user_id=1, status="running", profile="fast", options={},
+                            audio_blob="local:abc", attempts=attempts, max_attempts=3, version=1)
+
+
+def make_worker(execute, jobs, **options):
+    """A worker whose database calls are recorded instead of run."""
+    calls = {"heartbeats": [], "failed": [], "released": []}
+    worker = Worker(session_factory=None, execute=execute, worker_id="w1", poll_interval=0.01,
+                    heartbeat_interval=0.02, retry_backoff=10.0, **options)
+
+    def claim():
+        return jobs.pop(0) if jobs else None
+
+    def heartbeat(job_id, progress):
+        calls["heartbeats"].append(progress)
+        return options.get("visibility_timeout", 1) > 0
+
+    worker._claim = claim
+    worker._heartbeat = heartbeat
+    worker._fail = lambda job, error, retry: calls["failed"].append((job.id, error, retry)) or "queued"
+    worker._release = lambda job: calls["released"].append(job.id)
+    return worker, calls
+
+
+@pytest.fixture
+def pg_session():
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    schema = f"test_job_queue_{uuid.uuid4().hex[:8]}"
+    admin = create_engine(TEST_DATABASE_URL)
+    with admin.begin() as conn:
+        conn.execute(text(f"CREATE SCHEMA {schema}"))
+    # a claim that waits on another worker's lock instead of skipping it fails instead of hanging
+    engine = create_engine(TEST_DATABASE_URL,
+                           connect_args={"options": f"-csearch_path={schema} -cstatement_timeout=5000"})
+    try:
+        Base.metadata.create_all(engine, tables=[User.__table__, AudioConversion.__table__, TranscriptionJob.__table__])
+        session = sessionmaker(bind=engine)
+        with session() as db:
+            db.add(User(id=1, username="alice", email="a@example.com", password="x"))
+            db.commit()
+        yield session
+    finally:
+        engine.dispose()
+        with admin.begin() as conn:
+            conn.execute(text(f"DROP SCHEMA {schema} CASCADE"))
+        admin.dispose()
+
+
+def enqueue(db, count=1, **options):
+    return [job_queue.enqueue(db, 1, "fast", {}, "local:abc", audio_duration=60.0, **options).id for _ in range(count)]
+
+
+def run_until_idle(worker, seconds=0.3):
+    async def main():
+        asyncio.get_running_loop().call_later(seconds, worker.stop)
+        await worker.run()
+    asyncio.run(main())
+
+
+class TestStatements:
+
+    ''' Test that workers claim one row with FOR UPDATE SKIP LOCKED and lease it in the same statement'''
+    def test_claim(self):
+        statement = sql(job_queue.claim_statement("w1", 60))
+        assert statement.startswith("UPDATE transcription_jobs SET status=")
+        assert "FOR UPDATE SKIP LOCKED" in statement and "LIMIT" in statement
+        assert "attempts=(transcription_jobs.attempts +" in statement and "RETURNING" in statement
+
+    ''' Test that claims go to the users with the fewest running jobs for their weight, shortest file first'''
+    def test_claim_order(self):
+        statement = sql(job_queue.claim_statement("w1", 60))
+        order = statement.split("ORDER BY", 1)[1].split("LIMIT", 1)[0]
+        running, shortest, oldest = top_level_terms(order)
+        assert "count(*)" in running and "transcription_jobs_1.user_id = transcription_jobs.user_id" in running
+        assert running.endswith("/ CAST(transcription_jobs.weight AS FLOAT)")
+        assert shortest.startswith("coalesce(transcription_jobs.audio_duration") and "EXTRACT(epoch FROM now()" in shortest
+        assert oldest == "transcription_jobs.available_at"
+
+    ''' Test that expired leases are requeued or dead-lettered once the attempts are used up'''
+    def test_reap(self):
+        statement = sql(job_queue.reap_statement())
+        assert "transcription_jobs.lease_expires_at < now()" in statement
+        assert "FOR UPDATE SKIP LOCKED" in statement
+        assert "CASE WHEN (transcription_jobs.attempts >= transcription_jobs.max_attempts)" in statement
+
+    ''' Test that the jobs of dead workers wait out the same exponential backoff as failed jobs'''
+    def test_reap_backoff(self):
+        statement = sql(job_queue.reap_statement(retry_backoff=30))
+        available_at = statement.split("available_at=", 1)[1].split(", finished_at=", 1)[0]
+        assert available_at.startswith("(now() +") and "power(" in available_at
+        assert "greatest(transcription_jobs.attempts" in available_at
+
+    ''' Test that the state of a queued job is reported like the events of in-process jobs'''
+    def test_event(self):
+        job = make_job()
+        job.stage, job.percent = "asr", 40.0
+        assert job_queue.event(job) == {"id": 1, "event": "progress", "data": {
+            "stage": "asr", "status": "running", "percent": 40.0, "eta": None, "job_id": "job1"}}
+        job.status, job.error = "dead", "The worker stopped sending heartbeats"
+        assert job_queue.event(job)["event"] == "failed"
+
+
+class TestWorker:
+
+    ''' Test that a worker sends heartbeats with the progress of a running job and releases its audio when done'''
+    def test_heartbeats(self):
+        async def execute(job, worker_id, progress):
+            progress("asr", "running", percent=50.0, eta=2.0)
+            await asyncio.sleep(0.1)
+            return 7
+
+        worker, calls = make_worker(execute, [make_job()])
+        run_until_idle(worker)
+        assert calls["heartbeats"][0] == {"stage": "asr", "percent": 50.0, "eta": 2.0}
+        # unchanged progress only extends the lease
+        assert all(progress == {} for progress in calls["heartbeats"][1:])
+        assert calls["released"] == ["job1"] and calls["failed"] == []
+
+    ''' Test that a job is abandoned as soon as a heartbeat finds its lease taken over'''
+    def test_lease_lost(self):
+        finished = []
+
+        async def execute(job, worker_id, progress):
+            await asyncio.sleep(1)
+            finished.append(job.id)
+
+        worker, calls = make_worker(execute, [make_job()], visibility_timeout=0)
+        run_until_idle(worker, seconds=0.2)
+        assert finished == [] and calls["released"] == [] and calls["failed"] == []
+
+    ''' Test that errors are retried and failures that a retry does not fix are not'''
+    def test_failures(self):
+        async def execute(job, worker_id, progress):
+            if job.attempts == 1:
+                raise RuntimeError("CUDA out of memory")
+            raise JobFailed("Insufficient credit")
+
+        worker, calls = make_worker(execute, [make_job(attempts=1), make_job(attempts=2)])
+        run_until_idle(worker)
+        assert calls["failed"] == [("job1", "CUDA out of memory", True), ("job1", "Insufficient credit", False)]
+
+    ''' Test that a worker runs up to its concurrency of jobs at the same time'''
+    def test_concurrency(self):
+        running, peak = [], []
+
+        async def execute(job, worker_id, progress):
+            running.append(job.id)
+            peak.append(len(running))
+            await asyncio.sleep(0.05)
+            running.remove(job.id)
+
+        jobs = [make_job() for _ in range(5)]
+        for k, job in enumerate(jobs):
+            job.id = f"job{k}"
+        worker, calls = make_worker(execute, jobs, concurrency=2)
+        run_until_idle(worker)
+        assert max(peak) == 2 and sorted(calls["released"]) == [f"job{k}" for k in range(5)]
+
+
+class TestStoreQueuedJob:
+
+    ''' Test that the job is marked done with its conversion id in one commit and the mail goes out after it'''
+    def test_one_transaction(self, user, db, monkeypatch):
+        from transcibe import controller
+        finished, calls = make_job(), []
+        db.rows, db.next_id = [user], 42
+        flush = db.flush
+        monkeypatch.setattr(db, "flush", lambda: calls.append("flush") or flush())
+        monkeypatch.setattr(db, "commit", lambda: calls.append(("commit", finished.conversion_id)))
+        monkeypatch.setattr(controller, "SessionLocal", lambda: db)
+        monkeypatch.setattr(controller.job_queue, "finish", lambda db, job_id, worker_id: finished)
+        monkeypatch.setattr(controller, "send_email", lambda *args: calls.append("mail"))
+        job = make_job()
+        job.filename = "call.wav"
+        assert controller.store_queued_job(job, "w1", 2.0, "Speaker 0: Hello.", 10.0, None) == 42
+        assert calls == ["flush", ("commit", 42), "mail"]
+
+
+class TestPostgres:
+
+    ''' Test that a claim skips the row another worker has locked instead of waiting on it'''
+    def test_concurrent_claims(self, pg_session):
+        with pg_session() as db:
+            ids = enqueue(db, 2)
+        with pg_session() as first, pg_session() as second:
+            # the first worker's claim stays uncommitted, so it keeps its row locked
+            held = first.execute(job_queue.claim_statement("w1", 60)).scalars().first()
+            claimed = job_queue.claim(second, "w2", 60)
+            assert {held.id, claimed.id} == set(ids)
+            assert claimed.worker_id == "w2" and claimed.attempts == 1
+            assert job_queue.claim(second, "w2", 60) is None
+            first.commit()
+
+    ''' Test that workers claiming at the same time get every job exactly once'''
+    def test_claim_threads(self, pg_session):
+        with pg_session() as db:
+            ids = enqueue(db, 20)
+        claimed, lock = [], threading.Lock()
+
+        def work(worker_id):
+            with pg_session() as db:
+                while (job := job_queue.claim(db, worker_id, 60)) is not None:
+                    with lock:
+                        claimed.append(job.id)
+
+        threads = [threading.Thread(target=work, args=(f"w{k}",)) for k in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert sorted(claimed) == sorted(ids)
+
+    ''' Test that expired leases are requeued after the backoff and dead-lettered once the attempts are used up'''
+    def test_reap(self, pg_session):
+        with pg_session() as db:
+            retried, = enqueue(db)
+            dead, = enqueue(db, max_attempts=1)
+            assert job_queue.claim(db, "w1", -1) is not None
+            assert job_queue.claim(db, "w1", -1) is not None
+            assert job_queue.reap(db, retry_backoff=30) == {retried: "queued", dead: "dead"}
+            job = job_queue.get(db, retried)
+            assert job.worker_id is None and job.available_at > db.execute(select(func.now())).scalar()
+            # the backoff keeps the requeued job from being claimed right away
+            assert job_queue.claim(db, "w1", 60) is None
+            assert job_queue.get(db, dead).finished_at is not None
+
+    ''' Test that a failed job is retried, fails for good without retry, and only its lease holder can fail it'''
+    def test_fail(self, pg_session):
+        with pg_session() as db:
+            job_id, = enqueue(db)
+            job_queue.claim(db, "w1", 60)
+            assert job_queue.fail(db, job_id, "w2", "lease lost") is None
+            assert not job_queue.heartbeat(db, job_id, "w2", 60)
+            assert job_queue.fail(db, job_id, "w1", "CUDA out of memory") == "queued"
+            assert job_queue.claim(db, "w2", 60).attempts == 2
+            assert job_queue.fail(db, job_id, "w2", "Insufficient credit", retry=False) == "failed"
+            job = job_queue.get(db, job_id)
+            assert job.error == "Insufficient credit" and job.finished_at is not None
@@ -0,0 +1,73 @@
+import asyncio
+import threading
+from transcibe import controller
+from transcibe.jobs import JobManager
+
+
+class FakeConversion:
+    id = 7
+
+
+class TestJobManager:
+
+    ''' Test that a subscriber gets the backlog and the events published from a worker thread, until the job ends'''
+    def test_subscribe(self):
+        manager = JobManager()
+        job = manager.create(user_id=1)
+        progress = manager.progress_callback(job.id)
+        progress("separation", "done", seconds=1.0)
+
+        async def collect():
+            def work():
+                progress("asr", "running", percent=50.0, eta=3.0)
+                manager.publish(job.id, "done", conversion_id=7)
+            events = []
+            async for message in manager.subscribe(job.id):
+                events.append(message)
+                if len(events) == 2:
+                    threading.Thread(target=work).start()
+            return events
+
+        events = asyncio.run(collect())
+        assert [message["event"] for message in events] == ["queued", "progress", "progress", "done"]
+        assert events[2]["data"]["percent"] == 50.0
+        assert job.snapshot()["status"] == "done" and job.percent == 50.0 and job.conversion_id == 7
+
+    ''' Test that a reconnecting subscriber only gets the events after Last-Event-ID'''
+    def test_resume(self):
+        manager = JobManager()
+        job = manager.create(user_id=1)
+        manager.publish(job.id, "progress", stage="diarization", status="done")
+        manager.publish(job.id, "failed", error="boom")
+
+        async def collect():
+            return [message async for message in manager.subscribe(job.id, last_event_id=1)]
+
+        assert [message["event"] for message in asyncio.run(collect())] == ["failed"]
+
+
+class TestJobEndpoints:
+
+    ''' Test that a job is accepted with 202 and its progress is streamed as Server-Sent Events'''
+    def test_job_events(self, client, user, db, monkeypatch):
+        async def fake_transcribe_content(content, profile=None, progress=None, **options):
+            progress("separation", "started")
+            progress("separation", "done", seconds=0.1)
+            progress("asr", "running", percent=40.0, eta=1.5)
+            progress("asr", "done", seconds=1.0)
+            return 1.0, "\n\nSpeaker 0: hello", 2.0, None
+
+        db.rows = [user]
+        monkeypatch.setattr(controller, "transcribe_content", fake_transcribe_content)
+        monkeypatch.setattr(controller, "SessionLocal", lambda: db)
+        monkeypatch.setattr(controller, "save_conversion", lambda *args: FakeConversion())
+        response = client.post("/transcibe/jobs", files={"audio_file": ("call.wav", b"RIFF", "audio/wav")},
+                               data={"profile": "fast"})
+        assert response.status_code == 202
+        job_id = response.json()["id"]
+        with client.stream("GET", f"/transcibe/jobs/{job_id}/events") as events:
+            assert events.headers["content-type"].startswith("text/event-stream")
+            body = "".join(events.iter_text())
+        status = client.get(f"/transcibe/jobs/{job_id}").json()
+        assert "event: queued" in body and '"percent": 40.0' in body and "event: done" in body
+        assert status["status"] == "done" and status["conversion_id"] == 7 and status["percent"] == 100.0
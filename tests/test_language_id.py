@@ -0,0 +1,34 @@
+from app.core.config import settings
+from diarization import language_id
+from diarization.model_store import load_manifest
+from diarization.language_id import average_probabilities, route_whisper_model
+
+
+class TestLanguageId:
+
+    ''' Test that one confidently English window does not outvote two German ones'''
+    def test_average_probabilities(self):
+        result = average_probabilities([{"en": 0.9, "de": 0.1}, {"en": 0.3, "de": 0.7}, {"en": 0.2, "de": 0.8}])
+        assert result == {"language": "de", "probability": 0.533}
+
+    ''' Test that English is routed to the English-only models and other languages keep the profile's model'''
+    def test_route_whisper_model(self, monkeypatch):
+        monkeypatch.setattr(language_id.settings, "ENGLISH_MODEL_ROUTES", {"small": "small.en"})
+        assert route_whisper_model("small", "en") == "small.en"
+        assert route_whisper_model("small", "de") == "small"
+        assert route_whisper_model("large-v2", "en") == "large-v2"
+        assert route_whisper_model("small", None) == "small"
+
+    ''' Test that English falls back to the multilingual model when the English-only one is not in the offline store'''
+    def test_route_fallback(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(language_id.settings, "ENGLISH_MODEL_ROUTES", {"small": "small.en"})
+        monkeypatch.setattr(language_id.settings, "MODEL_STORE_DIR", str(tmp_path))
+        monkeypatch.setattr(language_id.settings, "MODELS_OFFLINE", True)
+        assert route_whisper_model("small", "en") == "small"
+        (tmp_path / "whisper" / "small.en").mkdir(parents=True)
+        assert route_whisper_model("small", "en") == "small.en"
+
+    ''' Test that every English-only model a route can pick is in the model manifest'''
+    def test_routes_in_manifest(self):
+        artifacts = load_manifest()["artifacts"]
+        assert all(f"whisper-{model}" in artifacts for model in settings.ENGLISH_MODEL_ROUTES.values())
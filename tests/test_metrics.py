@@ -0,0 +1,44 @@
+import pytest
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+from app.main import app
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+from app.metrics import StageTimer, instrument_engine
+
+
+class TestMetrics:
+
+    ''' Test that request latency is labelled with the route template, not the raw path'''
+    def test_request_latency_by_route(self):
+        client = TestClient(app)
+        client.get("/health/live")
+        client.get("/metrics")
+        labels = {"method": "GET", "route": "/health/live", "status": "200"}
+        assert REGISTRY.get_sample_value("http_request_duration_seconds_count", labels) >= 1
+        assert "transcription_stage_seconds" in client.get("/metrics").text
+
+    ''' Test that stage timings are reported with the profile and the language found by ASR'''
+    def test_stage_timer(self):
+        labels = {"stage": "asr", "profile": "fast", "language": "de"}
+        before = REGISTRY.get_sample_value("transcription_stage_seconds_count", labels) or 0
+        timer = StageTimer("fast")
+        with timer.stage("asr"):
+            timer.language = "de"
+        timer.observe()
+        assert REGISTRY.get_sample_value("transcription_stage_seconds_count", labels) == before + 1
+
+    ''' Test that failed queries are timed as errors and do not leave their start time on the connection'''
+    def test_failed_query(self):
+        engine = create_engine("sqlite://")
+        instrument_engine(engine)
+        ok, error = {"operation": "SELECT", "status": "ok"}, {"operation": "SELECT", "status": "error"}
+        before = {status: REGISTRY.get_sample_value("db_query_duration_seconds_count", labels) or 0
+                  for status, labels in (("ok", ok), ("error", error))}
+        with engine.connect() as conn:
+            with pytest.raises(OperationalError):
+                conn.execute(text("SELECT * FROM missing"))
+            conn.execute(text("SELECT 1"))
+            assert conn.info["query_started"] == []
+        assert REGISTRY.get_sample_value("db_query_duration_seconds_count", error) == before["error"] + 1
+        assert REGISTRY.get_sample_value("db_query_duration_seconds_count", ok) == before["ok"] + 1
@@ -0,0 +1,59 @@
+import copy
+import pytest
+from diarization import model_store
+
+COMMIT = "0123456789abcdef0123456789abcdef01234567"
+
+MANIFEST = {"artifacts": {
+    "vad": {"kind": "file", "path": "vad.bin", "sha256": None, "size": None, "required": True},
+    "punctuation": {"kind": "huggingface", "source": "kredor/punctuate-all", "revision": "main",
+                    "path": "punctuation", "sha256": None, "size": None, "required": True},
+}}
+
+
+@pytest.fixture
+def store(monkeypatch, tmp_path):
+    """An in-memory manifest over a store in a temporary directory, with fetchers that write files."""
+    state = {"manifest": copy.deepcopy(MANIFEST), "fetched": []}
+
+    def fetch(artifact, path):
+        state["fetched"].append((artifact["path"], artifact.get("revision")))
+        with open(path, "wb") as f:
+            f.write(artifact.get("revision", "weights").encode())
+
+    monkeypatch.setattr(model_store.settings, "MODEL_STORE_DIR", str(tmp_path))
+    monkeypatch.setattr(model_store.settings, "MODELS_OFFLINE", False)
+    monkeypatch.setattr(model_store, "load_manifest", lambda: copy.deepcopy(state["manifest"]))
+    monkeypatch.setattr(model_store, "save_manifest", lambda manifest: state.update(manifest=manifest))
+    monkeypatch.setattr(model_store, "fetchers", {"file": fetch, "huggingface": fetch})
+    monkeypatch.setattr(model_store, "committers", {"huggingface": lambda artifact: COMMIT})
+    return state
+
+
+class TestPinning:
+
+    ''' Test that artifacts without a digest, a size or a commit revision are reported as unpinned'''
+    def test_unpinned(self, store):
+        reasons = model_store.unpinned()
+        assert reasons["vad"] == "no sha256, size"
+        assert reasons["punctuation"] == "no sha256, size, commit (revision is 'main')"
+        assert model_store.unpinned(names=["vad"]).keys() == {"vad"}
+
+    ''' Test that pinning replaces a branch by its commit, fetches at that commit and records digests'''
+    def test_prefetch_pin(self, store, tmp_path):
+        (tmp_path / "punctuation").write_bytes(b"weights of main last month")
+        assert model_store.prefetch(pin=True) == {}
+        punctuation = store["manifest"]["artifacts"]["punctuation"]
+        assert punctuation["revision"] == COMMIT
+        assert ("punctuation", COMMIT) in store["fetched"]
+        assert punctuation["sha256"] == model_store.checksum(str(tmp_path / "punctuation"))
+        assert punctuation["size"] == len(COMMIT)
+        assert model_store.unpinned() == {}
+
+    ''' Test that a pinned digest is kept and a missing size is filled in next to it'''
+    def test_pin_size(self, store, tmp_path):
+        (tmp_path / "vad.bin").write_bytes(b"weights")
+        store["manifest"]["artifacts"]["vad"]["sha256"] = model_store.checksum(str(tmp_path / "vad.bin"))
+        model_store.prefetch(names=["vad"], pin=True)
+        assert store["manifest"]["artifacts"]["vad"]["size"] == len(b"weights")
+        assert store["fetched"] == []
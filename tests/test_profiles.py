@@ -0,0 +1,40 @@
+import pytest
+from decimal import Decimal
+from fastapi import HTTPException
+from diarization.profiles import charge, get_profile
+from transcibe import controller
+
+
+class TestCharge:
+
+    ''' Test that prices are exact to the cent and credits are rounded half up instead of truncated'''
+    def test_charge(self):
+        assert charge("balanced", 0.7) == (Decimal("0.53"), 1)
+        assert charge("accurate", 1.99) == (Decimal("1.99"), 2)
+        assert charge("fast", 4.9) == (Decimal("2.45"), 2)
+        assert charge("fast", 5.0) == (Decimal("2.50"), 3)
+        assert charge("accurate", 0.0) == (Decimal("0.00"), 0)
+
+    ''' Test that unknown profiles are rejected'''
+    def test_unknown_profile(self):
+        with pytest.raises(ValueError):
+            get_profile("turbo")
+
+
+class TestSaveConversion:
+
+    ''' Test that a conversion deducts the rounded credits and records them on the conversion'''
+    def test_deducts_credits(self, user, db, monkeypatch):
+        monkeypatch.setattr(controller, "send_email", lambda *args: None)
+        conversion = controller.save_conversion(db, user, "call.wav", "accurate", 2.5, "Speaker 0: Hello.", 30.0)
+        assert user.current_credit == 7 and conversion.credits_charged == 3
+        assert db.added == [conversion] and conversion.audio_duration == 150.0
+
+    ''' Test that a user without enough credit for the rounded charge is refused and keeps their credit'''
+    def test_insufficient_credit(self, user, db, monkeypatch):
+        monkeypatch.setattr(controller, "send_email", lambda *args: None)
+        user.current_credit = 2
+        with pytest.raises(HTTPException) as error:
+            controller.save_conversion(db, user, "call.wav", "accurate", 2.5, "Speaker 0: Hello.", 30.0)
+        assert error.value.status_code == 400 and "(2.50 credits, 3 charged)" in error.value.detail
+        assert user.current_credit == 2 and db.added == []
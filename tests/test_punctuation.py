@@ -0,0 +1,75 @@
+import threading
+from diarization.punctuation import PunctuationService, overlap_chunks
+
+
+def fake_pipe(texts, batch_size=None):
+    # one token per word, a full stop after words ending in "x"
+    calls.append(len(texts))
+    results = []
+    for text in texts:
+        tokens, end = [], 0
+        for word in text.split(" "):
+            end += len(word) + (1 if end else 0)
+            tokens.append({"end": end, "entity": "." if word.endswith("x") else "0", "score": 0.9})
+        results.append(tokens)
+    return results
+
+calls = []
+
+
+def reference_predict(words):
+    # PunctuationModel.predict of deepmultilingualpunctuation 1.0.1, with the fake pipeline
+    overlap, chunk_size = 5, 230
+    if len(words) <= chunk_size:
+        overlap = 0
+    batches = [words[i:i + chunk_size] for i in range(0, len(words), chunk_size - overlap)]
+    if len(batches[-1]) <= overlap:
+        batches.pop()
+    tagged_words = []
+    for batch in batches:
+        if batch == batches[-1]:
+            overlap = 0
+        result = fake_pipe([" ".join(batch)])[0]
+        char_index = 0
+        result_index = 0
+        for word in batch[:len(batch) - overlap]:
+            char_index += len(word) + 1
+            label, score = "0", 0.0
+            while result_index < len(result) and char_index > result[result_index]["end"]:
+                label = result[result_index]["entity"]
+                score = result[result_index]["score"]
+                result_index += 1
+            tagged_words.append([word, label, score])
+    return tagged_words
+
+
+def words(count, seed):
+    return [f"w{seed}{k}" + ("x" if k % 7 == 3 else "") for k in range(count)]
+
+
+class TestPunctuationService:
+
+    ''' Test that the windows match PunctuationModel.predict, also for a window that only repeats the overlap'''
+    def test_overlap_chunks(self):
+        chunks = overlap_chunks(list(range(455)))
+        assert [(start, len(chunk), kept) for start, chunk, kept in chunks] == [(0, 230, 225), (225, 230, 230)]
+        assert [(start, kept) for start, _, kept in overlap_chunks(list(range(100)))] == [(0, 100)]
+
+    ''' Test that concurrent jobs share forward passes and each get the labels predict would give them'''
+    def test_batched_predict(self):
+        service = PunctuationService(max_batch_size=8, max_wait=0.2, loader=lambda: fake_pipe)
+        inputs = [words(1000, 1), words(40, 2), words(231, 3), []]
+        expected = [reference_predict(job) if job else [] for job in inputs]
+        calls.clear()
+        results = [None] * len(inputs)
+
+        def run(k):
+            results[k] = service.predict(inputs[k])
+
+        threads = [threading.Thread(target=run, args=(k,)) for k in range(len(inputs))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert results == expected
+        assert max(calls) > 1 and max(calls) <= 8
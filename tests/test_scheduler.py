@@ -0,0 +1,100 @@
+import asyncio
+from app.core.config import Settings
+from transcibe.scheduler import FairScheduler, user_weight
+
+
+def run_order(scheduler, jobs, hold=None):
+    """The order in which jobs (user_id, weight, duration) get the only slot, all queued behind a held slot."""
+    order = []
+
+    async def run(user_id, weight, duration):
+        async with scheduler.slot(user_id, weight, duration):
+            order.append((user_id, duration))
+            await asyncio.sleep(0)
+
+    async def main():
+        async with scheduler.slot(*(hold or (0, 1.0, 0.0))):
+            tasks = [asyncio.create_task(run(*job)) for job in jobs]
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    return order
+
+
+class TestFairScheduler:
+
+    ''' Test that a short job of a light user is not stuck behind the backlog of a heavy user'''
+    def test_light_user_not_starved(self):
+        scheduler = FairScheduler(slots=1, aging_rate=0.0)
+        jobs = [(1, 1.0, 3600.0) for _ in range(5)] + [(2, 1.0, 60.0)]
+        order = run_order(scheduler, jobs)
+        assert order.index((2, 60.0)) <= 1
+        assert len(order) == 6
+
+    ''' Test that the jobs of one user run shortest first'''
+    def test_shortest_first_within_user(self):
+        scheduler = FairScheduler(slots=1, aging_rate=0.0)
+        order = run_order(scheduler, [(1, 1.0, 300.0), (1, 1.0, 10.0), (1, 1.0, 120.0)])
+        assert [duration for _, duration in order] == [10.0, 120.0, 300.0]
+
+    ''' Test that a user with twice the weight gets about twice the slots while both users wait'''
+    def test_weights(self):
+        scheduler = FairScheduler(slots=1, aging_rate=0.0)
+        jobs = [(1, 1.0, 100.0) for _ in range(4)] + [(2, 2.0, 100.0) for _ in range(8)]
+        order = run_order(scheduler, jobs)
+        assert [user_id for user_id, _ in order[:6]].count(2) == 4
+
+    ''' Test that waiting makes a long job go before short jobs that came much later'''
+    def test_aging(self):
+        scheduler = FairScheduler(slots=1, aging_rate=1000.0)
+        order = []
+
+        async def run(duration):
+            async with scheduler.slot(1, 1.0, duration):
+                order.append(duration)
+
+        async def main():
+            async with scheduler.slot(0):
+                long_job = asyncio.create_task(run(500.0))
+                await asyncio.sleep(0.6)
+                short_job = asyncio.create_task(run(10.0))
+                await asyncio.sleep(0)
+            await asyncio.gather(long_job, short_job)
+
+        asyncio.run(main())
+        assert order == [500.0, 10.0]
+
+    ''' Test that the stats count waiting and running jobs per user'''
+    def test_stats(self):
+        scheduler = FairScheduler(slots=1)
+        seen = {}
+
+        async def main():
+            async with scheduler.slot(1, duration=30.0):
+                waiting = [asyncio.create_task(scheduler.acquire(2, duration=10.0)) for _ in range(2)]
+                await asyncio.sleep(0)
+                seen["all"] = scheduler.stats()
+                seen["own"] = scheduler.stats(2)
+                assert scheduler.queue_depth() == 2
+            for task in waiting:
+                scheduler.release(await task)
+
+        asyncio.run(main())
+        assert [(row["user_id"], row["waiting"], row["running"]) for row in seen["all"]] == [(1, 0, 1), (2, 2, 0)]
+        assert seen["own"][0]["user_id"] == 2 and seen["own"][0]["average_wait"] is None
+        assert scheduler.stats(2)[0]["started"] == 2 and scheduler.queue_depth() == 0
+
+    ''' Test that a user's share comes from their tier and admins get the admin weight'''
+    def test_user_weight(self, user):
+        user.tier = "premium"
+        assert user_weight(user) == 4.0
+        user.is_admin, user.tier = True, "free"
+        assert user_weight(user) == 4.0
+        user.is_admin, user.tier = False, None
+        assert user_weight(user) == 1.0
+
+    ''' Test that the slots default to the files of one NeMo pass, so concurrent jobs can fill it'''
+    def test_default_slots(self):
+        assert Settings(DIARIZATION_BATCH_SIZE=4).SCHEDULER_SLOTS == 4
+        assert Settings(DIARIZATION_BATCH_SIZE=4, SCHEDULER_SLOTS=1).SCHEDULER_SLOTS == 1
@@ -0,0 +1,49 @@
+from sqlalchemy.dialects import postgresql
+from transcibe.search import parse_transcript, transcript_segments, search_statement, count_statement
+
+
+class FakeResult:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def scalar_one(self):
+        return self.rows
+
+    def mappings(self):
+        return self
+
+    def all(self):
+        return self.rows
+
+
+class TestTranscriptSegments:
+
+    ''' Test that a formatted transcript is split back into its speaker blocks'''
+    def test_parse_transcript(self):
+        sentences = parse_transcript("\n\nSpeaker 0: hello there. \n\nAlice: how are you? ")
+        assert [(sentence["speaker"], sentence["text"]) for sentence in sentences] == [
+            ("Speaker 0", "hello there. "), ("Alice", "how are you? ")]
+        segments = transcript_segments(sentences + [{"speaker": "Bob", "start_time": 5, "end_time": 9, "text": " "}], 3)
+        assert [(segment.position, segment.user_id, segment.text, segment.start_time) for segment in segments] == [
+            (0, 3, "hello there.", None), (1, 3, "how are you?", None)]
+
+    ''' Test that the search matches the GIN-indexed tsvector and only highlights the rows of the page'''
+    def test_search_statement(self):
+        sql = str(search_statement(1, "refund", 20, 40).compile(dialect=postgresql.dialect()))
+        assert "transcript_segments.search_vector @@ websearch_to_tsquery" in sql
+        assert sql.index("ts_headline") < sql.index("ts_rank_cd") and "LIMIT" in sql and "OFFSET" in sql
+        assert "count(*)" in str(count_statement(1, "refund").compile(dialect=postgresql.dialect()))
+
+
+class TestSearchEndpoint:
+
+    ''' Test that the hits of a page are returned with the total for pagination'''
+    def test_search(self, client, db):
+        hit = {"conversion_id": 7, "position": 2, "speaker": "Speaker 1", "start_time": 61000, "end_time": 64500,
+               "rank": 0.1, "snippet": "I would like a <mark>refund</mark>"}
+        db.results = iter([FakeResult(21), FakeResult([hit])])
+        response = client.get("/transcibe/search", params={"q": "refund", "page": 2, "page_size": 20})
+        invalid = client.get("/transcibe/search", params={"q": ""})
+        assert response.status_code == 200
+        assert response.json() == {"query": "refund", "total": 21, "page": 2, "page_size": 20, "hits": [hit]}
+        assert invalid.status_code == 422
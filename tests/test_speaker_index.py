@@ -0,0 +1,185 @@
+import threading
+import multiprocessing
+import numpy as np
+import pytest
+from app.main import app
+from users import user_is_admin
+from users.api import controller as users_controller
+from transcibe import controller
+from diarization.speaker_index import SpeakerIndex, SpeakerIndexStore
+from diarization.timeline import SpeakerTimeline
+from diarization.transcript import WordTranscript
+
+
+def voices(count, dim=16, seed=0):
+    return np.random.default_rng(seed).normal(size=(count, dim)).astype(np.float32)
+
+
+def sample(voice, seed, noise=0.1):
+    return (voice + np.random.default_rng(seed).normal(scale=noise, size=voice.shape)).tolist()
+
+
+def add_speakers(root, worker, count):
+    index = SpeakerIndex(root)
+    for k in range(count):
+        index.add({0: sample(voices(1)[0], k), 1: sample(voices(1)[0], 100 + k)}, conversion_id=worker * 1000 + k)
+
+
+class TestSpeakerIndex:
+
+    ''' Test that rows are appended incrementally and that a new index object loads them lazily from disk'''
+    def test_add_and_reload(self, tmp_path):
+        people = voices(3)
+        index = SpeakerIndex(str(tmp_path))
+        assert index.add({0: sample(people[0], 1), 1: sample(people[1], 2)}, conversion_id=7) == [0, 1]
+        assert index.add({0: sample(people[2], 3)}, conversion_id=8) == [2]
+        assert index.enroll(7, 1, "Alice") == 1 and index.enroll(9, 0, "Bob") == 0
+
+        reloaded = SpeakerIndex(str(tmp_path))
+        assert reloaded._matrix is None
+        assert [row for row, _ in reloaded.search(sample(people[2], 4))[0]][:1] == [2]
+        assert reloaded.names() == {"Alice": 1}
+
+    ''' Test that the speakers of a job are named in one query, with the threshold and each name used once'''
+    def test_identify(self, tmp_path):
+        people = voices(3)
+        index = SpeakerIndex(str(tmp_path))
+        index.add({0: sample(people[0], 1), 1: sample(people[1], 2), 2: sample(people[2], 3)}, conversion_id=1)
+        index.enroll(1, 0, "Alice")
+        index.enroll(1, 1, "Bob")
+        job = {3: sample(people[1], 10), 4: sample(people[0], 11), 5: sample(people[0], 12, noise=0.5), 6: sample(people[2], 13)}
+        assert index.identify(job, threshold=0.7) == {3: "Bob", 4: "Alice"}
+
+    ''' Test that identifying speakers while enrolled rows are removed and renumbered never looks up a stale row'''
+    def test_identify_during_removal(self, tmp_path):
+        people = voices(2)
+        index = SpeakerIndex(str(tmp_path))
+        errors, stop = [], threading.Event()
+
+        def identify():
+            while not stop.is_set():
+                try:
+                    index.identify({0: sample(people[1], 50)}, threshold=0.0)
+                except Exception as e:
+                    errors.append(e)
+
+        thread = threading.Thread(target=identify)
+        thread.start()
+        for k in range(50):
+            index.add({0: sample(people[0], k), 1: sample(people[1], 100 + k)}, conversion_id=k)
+            index.enroll(k, 1, f"Bob {k}")
+            index.remove(k)
+        stop.set()
+        thread.join()
+        assert errors == []
+
+    ''' Test that the IVF partition finds the same nearest rows as the exact search for clustered voices'''
+    def test_ivf_search(self, tmp_path):
+        people = voices(8, dim=32)
+        exact, partitioned = SpeakerIndex(str(tmp_path / "exact")), SpeakerIndex(str(tmp_path / "ivf"), ivf_lists=4, ivf_probe=2)
+        for k in range(400):
+            for index in (exact, partitioned):
+                index.add({0: sample(people[k % 8], k)}, conversion_id=k)
+        queries = [sample(people[k], 1000 + k) for k in range(8)]
+        found_exact = [[row for row, _ in rows] for rows in exact.search(queries, top_k=3)]
+        found_ivf = [[row for row, _ in rows] for rows in partitioned.search(queries, top_k=3)]
+        assert partitioned._centroids is not None
+        assert found_ivf == found_exact
+
+
+    ''' Test that an index sees the rows and names written by another index object on the same files'''
+    def test_reload_on_change(self, tmp_path):
+        people = voices(2)
+        api, worker = SpeakerIndex(str(tmp_path)), SpeakerIndex(str(tmp_path))
+        api.add({0: sample(people[0], 1)}, conversion_id=1)
+        assert len(worker) == 1
+        worker.add({0: sample(people[1], 2)}, conversion_id=2)
+        api.enroll(2, 0, "Bob")
+        assert worker.identify({5: sample(people[1], 3)}) == {5: "Bob"}
+        worker.remove(1)
+        assert api.identify({5: sample(people[1], 4)}) == {5: "Bob"} and len(api) == 1
+
+    ''' Test that processes appending to one index at the same time keep embeddings and entries aligned'''
+    def test_concurrent_processes(self, tmp_path):
+        context = multiprocessing.get_context("fork")
+        processes = [context.Process(target=add_speakers, args=(str(tmp_path), worker, 20)) for worker in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        index = SpeakerIndex(str(tmp_path))
+        assert len(index) == 160 and index._matrix.shape == (160, 16)
+        assert sorted({entry["conversion_id"] for entry in index._entries}) == sorted(w * 1000 + k for w in range(4) for k in range(20))
+
+
+class FakeRecord:
+    """Stands in for both the deleted conversion and the deleted user."""
+    id = 1
+    user_id = 1
+    email = None
+    username = "alice"
+    current_credit = 0
+    is_superuser = False
+    default_profile = tier = created_at = updated_at = None
+    text_blob = words_blob = checkpoint_keys = None
+    audio_conversions = []
+
+
+@pytest.fixture
+def store(client, db, tmp_path, monkeypatch):
+    store = SpeakerIndexStore(str(tmp_path))
+    monkeypatch.setattr(controller, "speaker_indexes", store)
+    monkeypatch.setattr(users_controller, "speaker_indexes", store)
+    # the client fixture clears the overrides again
+    app.dependency_overrides[user_is_admin] = lambda: True
+    db.rows = [FakeRecord()]
+    return store
+
+
+class TestSpeakerRemoval:
+
+    ''' Test that removing a conversion drops its rows and names, renumbers the rest and survives a reload'''
+    def test_remove_conversion(self, tmp_path):
+        people = voices(3)
+        index = SpeakerIndex(str(tmp_path))
+        index.add({0: sample(people[0], 1), 1: sample(people[1], 2)}, conversion_id=7)
+        index.add({0: sample(people[2], 3)}, conversion_id=8)
+        index.enroll(7, 0, "Alice")
+        index.enroll(8, 0, "Carol")
+        assert index.remove(7) == 2 and index.remove(7) == 0
+        assert len(index) == 1 and index.names() == {"Carol": 1}
+
+        reloaded = SpeakerIndex(str(tmp_path))
+        assert reloaded.names() == {"Carol": 1}
+        assert reloaded.identify({5: sample(people[2], 4), 6: sample(people[0], 5)}) == {5: "Carol"}
+
+    ''' Test that deleting a transcribe removes its speakers from the owner's index'''
+    def test_delete_transcribe(self, store, client):
+        people = voices(2)
+        store.get(1).add({0: sample(people[0], 1)}, conversion_id=7)
+        store.get(1).add({0: sample(people[1], 2)}, conversion_id=8)
+        store.get(1).enroll(7, 0, "Alice")
+        response = client.delete("/transcibe/transcribe/7")
+        assert response.status_code == 200
+        reloaded = SpeakerIndex(store.get(1).root)
+        assert reloaded.names() == {} and [entry["conversion_id"] for entry in reloaded._entries] == [8]
+
+    ''' Test that deleting a user deletes their whole index'''
+    def test_delete_user(self, store, client, tmp_path):
+        store.get(1).add({0: sample(voices(1)[0], 1)}, conversion_id=7)
+        assert (tmp_path / "1").exists()
+        response = client.delete("/users/alice")
+        assert response.status_code == 200
+        assert not (tmp_path / "1").exists() and len(store.get(1)) == 0
+
+
+class TestSpeakerNames:
+
+    ''' Test that recognized speakers are rendered with their names, also after a round trip through the stored bytes'''
+    def test_render_names(self):
+        speaker_ts = SpeakerTimeline.from_turns([[0, 1000, 0], [1000, 2000, 1]])
+        wsm = [{"word": "hi", "start_time": 100, "end_time": 400}, {"word": "hello", "start_time": 1100, "end_time": 1500}]
+        transcript = WordTranscript.from_mapping(wsm, speaker_ts, speaker_names={1: "Alice"})
+        stored = WordTranscript.from_bytes(transcript.to_bytes())
+        assert [sentence["speaker"] for sentence in stored.render()] == ["Speaker 0", "Alice"]
+        assert [sentence["speaker"] for sentence in stored.render(split="sentence")] == ["Speaker 0", "Alice"]
@@ -0,0 +1,47 @@
+import os
+import sys
+import json
+import subprocess
+import pytest
+
+# Wall-clock and memory budgets for importing the API and the admin CLI in a fresh interpreter.
+# They can be raised on slow CI machines through the environment.
+STARTUP_TIME_BUDGET = float(os.environ.get("STARTUP_TIME_BUDGET", "1.5"))
+STARTUP_MEMORY_BUDGET_MB = float(os.environ.get("STARTUP_MEMORY_BUDGET_MB", "250"))
+HEAVY_MODULES = ["torch", "whisperx", "nemo", "faster_whisper", "deepmultilingualpunctuation", "omegaconf", "wget"]
+
+PROBE = """
+import json, resource, sys, time
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+print(json.dumps({{
+    "seconds": elapsed,
+    "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "heavy": [name for name in {heavy!r} if name in sys.modules],
+}}))
+"""
+
+
+def import_probe(module):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE.format(module=module, heavy=HEAVY_MODULES)],
+        cwd=root, capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+@pytest.mark.parametrize("module", ["app.main", "manage"])
+class TestStartup:
+
+    ''' Test that importing the module does not load the ML stack'''
+    def test_no_heavy_imports(self, module):
+        assert import_probe(module)["heavy"] == []
+
+    ''' Test that importing the module stays within the time and memory budget'''
+    def test_startup_budget(self, module):
+        # best of three runs to keep filesystem cache noise out of the measurement
+        probes = [import_probe(module) for _ in range(3)]
+        assert min(probe["seconds"] for probe in probes) < STARTUP_TIME_BUDGET
+        assert min(probe["max_rss_mb"] for probe in probes) < STARTUP_MEMORY_BUDGET_MB
@@ -0,0 +1,88 @@
+import numpy as np
+from app import blobs
+from diarization.streaming import StreamingSession, SpeakerTracker, SAMPLE_RATE
+from transcibe import controller
+
+
+def pcm(seconds):
+    return (np.ones(int(seconds * SAMPLE_RATE)) * 1000).astype("<i2").tobytes()
+
+
+class ScriptedDecoder:
+    ''' Decoder that reports one two-second segment per two seconds of audio in the window'''
+    def __init__(self):
+        self.windows = []
+
+    def __call__(self, audio, language=None, prompt=None):
+        seconds = len(audio) / SAMPLE_RATE
+        self.windows.append(seconds)
+        segments = []
+        for start in np.arange(0, seconds - 0.5, 2.0):
+            end = min(start + 2.0, seconds)
+            segments.append({"start": start, "end": end, "text": f" words {start:.0f}",
+                             "words": [{"word": " words", "start": start + 0.1, "end": end}]})
+        return segments, "en"
+
+
+class TestStreamingSession:
+
+    ''' Test that only segments that ended well before the end of the window are finalized, at stream time'''
+    def test_finalizes_stable_segments(self):
+        session = StreamingSession(ScriptedDecoder(), step=1.0, stable_lag=1.0)
+        events = []
+        for _ in range(5):
+            session.feed(pcm(1.0))
+            assert session.ready()
+            events += session.process()
+        finals = [event for event in events if event["type"] == "final"]
+        assert [(event["start"], event["end"]) for event in finals] == [(0.0, 2.0), (2.0, 4.0)]
+        assert events[-1]["type"] == "partial" and events[-1]["start"] == 4.0
+        assert session.offset == 4.0 and session.language == "en"
+        assert session.finish()[0]["start"] == 4.0
+        assert len(session.segments) == 3
+
+    ''' Test that a window without speech is dropped without decoding'''
+    def test_vad_skips_silence(self):
+        decoder = ScriptedDecoder()
+        session = StreamingSession(decoder, vad=lambda audio: False, step=1.0)
+        for _ in range(3):
+            session.feed(pcm(1.0))
+            assert session.process() == []
+        assert decoder.windows == [] and len(session.window) == SAMPLE_RATE
+
+    ''' Test the provisional speakers and the sentences built from them'''
+    def test_provisional_speakers(self):
+        embeddings = iter([[1, 0], [0, 1], [0.9, 0.1]])
+        session = StreamingSession(ScriptedDecoder(), embedder=lambda audio: next(embeddings))
+        session.feed(pcm(6.0))
+        assert [event["speaker"] for event in session.finish()] == [0, 1, 0]
+        assert [sentence["speaker"] for sentence in session.sentences()] == ["Speaker 0", "Speaker 1", "Speaker 0"]
+
+    ''' Test that the tracker stops opening speakers at max_speakers'''
+    def test_speaker_tracker_max_speakers(self):
+        tracker = SpeakerTracker(max_speakers=1)
+        assert tracker.assign([1, 0]) == 0
+        assert tracker.assign([0, 1]) == 0
+
+
+class TestStreamingEndpoint:
+
+    ''' Test a session over the WebSocket, from PCM frames to the stored conversion'''
+    def test_stream(self, client, db, monkeypatch, tmp_path):
+        monkeypatch.setitem(blobs._stores, "local", blobs.LocalBlobStore(str(tmp_path)))
+        monkeypatch.setattr(blobs.settings, "BLOB_STORE", "local")
+        db.next_id = 42
+        monkeypatch.setattr(controller, "create_session", lambda profile, language, max_speakers: StreamingSession(ScriptedDecoder()))
+        monkeypatch.setattr(controller.settings, "STREAMING_FINAL_DIARIZATION", False)
+        with client.websocket_connect("/transcibe/stream?profile=fast") as websocket:
+            for _ in range(4):
+                websocket.send_bytes(pcm(1.0))
+            websocket.send_json({"type": "stop"})
+            messages = []
+            while not messages or messages[-1]["type"] != "done":
+                messages.append(websocket.receive_json())
+        assert {"partial", "final", "done"} <= {message["type"] for message in messages}
+        assert messages[-1]["id"] == 42
+        conversion = db.added[0]
+        assert conversion.profile == "fast" and conversion.audio_duration == 4.0
+        assert "Speaker 0: words" in conversion.text_content
@@ -0,0 +1,31 @@
+import numpy as np
+from diarization.timeline import SpeakerTimeline
+
+
+class TestSpeakerTimeline:
+
+    ''' Test point lookups, including pauses between turns and times past the end'''
+    def test_speaker_at(self):
+        timeline = SpeakerTimeline.from_turns([[1000, 2000, 1], [0, 900, 0], [2500, 4000, 0]])
+        assert timeline.to_list() == [[0, 900, 0], [1000, 2000, 1], [2500, 4000, 0]]
+        assert timeline.speaker_at(np.array([0, 900, 950, 1500, 2200, 9000])).tolist() == [0, 0, 1, 1, 0, 0]
+        assert timeline[1].speaker == 1
+
+    ''' Test range lookups and overlap detection with overlapping speakers'''
+    def test_between_and_overlaps(self):
+        timeline = SpeakerTimeline.from_turns([[0, 5000, 0], [1000, 2000, 1], [3000, 4000, 0], [6000, 7000, 1]])
+        assert timeline.between(2500, 3500).tolist() == [0, 2]
+        assert timeline.between(5000, 6000).tolist() == []
+        assert timeline.overlaps() == [(0, 1)]
+
+    ''' Test merging consecutive turns of one speaker'''
+    def test_merge_adjacent(self):
+        timeline = SpeakerTimeline.from_turns([[0, 1000, 0], [1000, 2000, 0], [2300, 3000, 0], [3000, 4000, 1]])
+        assert timeline.merge_adjacent().to_list() == [[0, 2000, 0], [2300, 3000, 0], [3000, 4000, 1]]
+        assert timeline.merge_adjacent(max_gap=500).to_list() == [[0, 3000, 0], [3000, 4000, 1]]
+
+    ''' Test the talk time per speaker'''
+    def test_talk_time(self):
+        timeline = SpeakerTimeline.from_turns([[0, 1000, 0], [1000, 1500, 2], [2000, 4000, 0]])
+        assert timeline.talk_time() == {0: 3000, 2: 500}
+        assert timeline.num_speakers == 2
@@ -0,0 +1,57 @@
+from diarization.helper import (get_words_speaker_mapping,
+                                get_realigned_ws_mapping_with_punctuation,
+                                get_sentences_speaker_mapping)
+from diarization.timeline import SpeakerTimeline
+from diarization.transcript import WordTranscript
+
+
+SPEAKER_TS = SpeakerTimeline.from_turns([[0, 2000, 0], [2000, 3050, 1], [3050, 5000, 0]])
+WORD_TS = [
+    {"word": "hello", "start": 0.1, "end": 0.5},
+    {"word": "there.", "start": 0.6, "end": 1.0},
+    {"word": "how", "start": 1.9, "end": 2.3},
+    {"word": "are", "start": 2.4, "end": 2.6},
+    {"word": "you?", "start": 2.7, "end": 3.0},
+    {"word": "yeah", "start": 3.0, "end": 3.2},
+    {"word": "fine.", "start": 3.3, "end": 3.8},
+]
+
+
+def transcript():
+    wsm = get_words_speaker_mapping(WORD_TS, SPEAKER_TS, "start")
+    return WordTranscript.from_mapping(wsm, SPEAKER_TS, language="en", punctuated=True)
+
+
+class TestWordTranscript:
+
+    ''' Test that the default rendering matches the pipeline, also after a round trip through the stored bytes'''
+    def test_render_matches_pipeline(self):
+        wsm = get_realigned_ws_mapping_with_punctuation(get_words_speaker_mapping(WORD_TS, SPEAKER_TS, "start"))
+        expected = get_sentences_speaker_mapping(wsm, SPEAKER_TS)
+        stored = WordTranscript.from_bytes(transcript().to_bytes())
+        assert stored.words == transcript().words and stored.speaker_ts.to_list() == SPEAKER_TS.to_list()
+        assert stored.render() == transcript().render() == expected
+
+    ''' Test that the anchor, the sentence split and merging short runs change the rendering'''
+    def test_render_options(self):
+        words = transcript()
+        assert [sentence["speaker"] for sentence in words.render(realign=False)] == ["Speaker 0", "Speaker 1", "Speaker 0"]
+        assert words.render(anchor="end", realign=False)[1]["text"] == "how are you? "
+        assert len(words.render(split="sentence", realign=False)) == 5
+        assert [sentence["speaker"] for sentence in words.render(min_words=4, realign=False)] == ["Speaker 0"]
+
+
+class TestRenderEndpoint:
+
+    ''' Test that a stored conversion is rendered again as SRT without transcribing'''
+    def test_render_srt(self, client, db):
+        class FakeConversion:
+            user_id = 1
+            words = transcript().to_bytes()
+
+        db.rows = [FakeConversion()]
+        response = client.get("/transcibe/transcribe/3/render", params={"format": "srt", "split": "sentence"})
+        invalid = client.get("/transcibe/transcribe/3/render", params={"anchor": "middle"})
+        assert response.status_code == 200
+        assert "00:00:00,100 --> 00:00:01,000\nSpeaker 0: hello there." in response.text
+        assert invalid.status_code == 400
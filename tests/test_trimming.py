@@ -0,0 +1,72 @@
+import wave
+import numpy as np
+import pytest
+from diarization.timeline import SpeakerTimeline
+from diarization.trimming import OffsetMap, grid_ms, snap, trim_silence
+
+
+# speech at 1.0-3.0 s and 10.0-12.5 s of a 20 s file; the compact audio is 4.5 s long
+OFFSETS = OffsetMap([[1000, 3000], [10000, 12500]], 20000)
+
+
+class TestOffsetMap:
+
+    ''' Test that word times map back to the original, with a boundary time taken from the right region'''
+    def test_map_words(self):
+        wsm = [{"word": "a", "start_time": 0, "end_time": 2000, "speaker": 0},
+               {"word": "b", "start_time": 2000, "end_time": 2500, "speaker": 0},
+               {"word": "c", "start_time": 4400, "end_time": 4500, "speaker": 1}]
+        mapped = OFFSETS.map_words(wsm)
+        assert [(word["start_time"], word["end_time"]) for word in mapped] == [(1000, 3000), (10000, 10500), (12400, 12500)]
+        assert OffsetMap.from_list(OFFSETS.to_list()).to_original(2000) == 10000
+
+    ''' Test that a speaker turn over a cut silence is split into one turn per speech region'''
+    def test_map_turns(self):
+        turns = SpeakerTimeline.from_turns([[0, 1500, 0], [1500, 4500, 1]])
+        assert OFFSETS.map_turns(turns) == [[1000, 2500, 0], [2500, 3000, 1], [10000, 12500, 1]]
+
+    ''' Test that regions are widened to the grid of the sample rate and merged when they touch'''
+    def test_snap(self):
+        assert snap([[3, 995], [1001, 2004], [5000, 6000]], 5500, 44100) == [[0, 2010], [5000, 5500]]
+        assert snap([[3, 995], [1001, 2004], [5000, 6000]], 5515, 11025) == [[0, 2040], [5000, 5480]]
+        assert snap([[3, 995]], 5500, 16000) == [[3, 995]]
+
+    ''' Test that the grid is the shortest step in milliseconds that is a whole number of frames'''
+    def test_grid(self):
+        assert [grid_ms(rate) for rate in (8000, 16000, 48000, 44100, 22050, 11025)] == [1, 1, 1, 10, 20, 40]
+
+
+def write_wav(path, rate, seconds=20):
+    samples = (np.arange(rate * seconds * 2) % 100).astype(np.int16)
+    with wave.open(str(path), "wb") as f:
+        f.setnchannels(2)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(samples.tobytes())
+    return samples
+
+
+class TestTrimSilence:
+
+    ''' Test that the cut audio keeps the format of the file and has exactly the length of the map'''
+    def test_trim_silence(self, tmp_path):
+        rate = 44100
+        source = tmp_path / "call.wav"
+        samples = write_wav(source, rate)
+
+        trimmed = trim_silence(str(source), str(tmp_path / "trimmed.wav"), OffsetMap([[1010, 3000], [10000, 12530]], 20000))
+        with wave.open(trimmed, "rb") as f:
+            assert f.getnchannels() == 2 and f.getframerate() == rate
+            assert f.getnframes() == (1990 + 2530) * rate // 1000
+            frames = np.frombuffer(f.readframes(f.getnframes()), dtype=np.int16)
+        assert np.array_equal(frames[:10], samples[1010 * 441 // 10 * 2:][:10])
+
+    ''' Test that snapped regions cut whole frames at rates where 10 ms is not a whole number of frames'''
+    @pytest.mark.parametrize("rate", [22050, 11025])
+    def test_trim_length(self, tmp_path, rate):
+        source = tmp_path / "call.wav"
+        write_wav(source, rate)
+        offsets = OffsetMap(snap([[1013, 2987], [10001, 12533], [19990, 20000]], 20000, rate), 20000)
+        trimmed = trim_silence(str(source), str(tmp_path / "trimmed.wav"), offsets)
+        with wave.open(trimmed, "rb") as f:
+            assert f.getnframes() * 1000 == offsets.compact_duration * rate
@@ -0,0 +1,162 @@
+import time
+import asyncio
+import base64
+import hashlib
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from starlette.requests import ClientDisconnect
+from diarization import workspace as workspace_module
+from transcibe import controller
+from transcibe.uploads import upload_manager, UploadManager, TUS_EXTENSIONS
+from app.core.config import settings
+from diarization.workspace import sweep_orphans
+
+
+class FakeConversion:
+    id = 7
+
+
+@pytest.fixture(autouse=True)
+def workspace_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(workspace_module.settings, "WORKSPACE_DIR", str(tmp_path))
+    monkeypatch.setattr(workspace_module.settings, "WORKSPACE_TMPFS_DIR", None)
+    return tmp_path
+
+
+def checksum(data):
+    return "sha256 " + base64.b64encode(hashlib.sha256(data).digest()).decode()
+
+
+def create(client, data):
+    metadata = "filename " + base64.b64encode(b"call.wav").decode() + ",filetype " + base64.b64encode(b"audio/wav").decode()
+    response = client.post("/transcibe/uploads", headers={"Upload-Length": str(len(data)), "Upload-Metadata": metadata})
+    assert response.status_code == 201
+    return response.headers["Location"]
+
+
+def patch(client, location, data, offset, digest=None):
+    headers = {"Upload-Offset": str(offset), "Content-Type": "application/offset+octet-stream"}
+    if digest:
+        headers["Upload-Checksum"] = digest
+    return client.patch(location, content=data, headers=headers)
+
+
+class TestResumableUploads:
+
+    ''' Test that chunks sent in parallel and out of order are assembled into the file'''
+    def test_parallel_chunks(self, client):
+        data = bytes(range(256)) * 64
+        location = create(client, data)
+        chunks = [(offset, data[offset:offset + 4096]) for offset in range(0, len(data), 4096)][::-1]
+        with ThreadPoolExecutor(4) as pool:
+            responses = list(pool.map(lambda chunk: patch(client, location, chunk[1], chunk[0], checksum(chunk[1])), chunks))
+        assert all(response.status_code == 204 for response in responses)
+
+        status = client.head(location)
+        assert status.headers["Upload-Offset"] == str(len(data))
+        assert status.headers["Upload-Ranges"] == f"0-{len(data)}"
+        upload = upload_manager.get(location.rsplit("/", 1)[1])
+        with open(upload.path, "rb") as f:
+            assert f.read() == data
+
+    ''' Test that a corrupted chunk is rejected with 460 and does not count as received'''
+    def test_checksum_mismatch(self, client):
+        data = b"0123456789" * 10
+        location = create(client, data)
+        assert patch(client, location, data[50:], 50).status_code == 204
+        response = patch(client, location, b"x" * 50, 0, checksum(data[:50]))
+        assert response.status_code == 460
+        status = client.head(location)
+        assert status.headers["Upload-Offset"] == "0" and status.headers["Upload-Ranges"] == "50-100"
+
+    ''' Test that a corrupted resend of a received chunk leaves the verified bytes in the file'''
+    def test_bad_resend_keeps_file(self, client):
+        data = b"0123456789" * 10
+        location = create(client, data)
+        assert patch(client, location, data[:50], 0, checksum(data[:50])).status_code == 204
+        assert patch(client, location, b"x" * 50, 0, checksum(data[:50])).status_code == 460
+        upload = upload_manager.get(location.rsplit("/", 1)[1])
+        with open(upload.path, "rb") as f:
+            assert f.read(50) == data[:50]
+        assert client.head(location).headers["Upload-Offset"] == "50"
+
+    ''' Test that the bytes of a chunk that arrived before the connection dropped count, unless it had a checksum'''
+    def test_dropped_connection(self):
+        async def body():
+            yield b"a" * 30
+            yield b"b" * 20
+            raise ClientDisconnect()
+
+        upload = upload_manager.create(1, 100)
+        with pytest.raises(ClientDisconnect):
+            asyncio.run(upload.write_chunk(0, body(), checksum=hashlib.sha256(b"a" * 30 + b"b" * 50).digest()))
+        assert upload.offset == 0
+        with pytest.raises(ClientDisconnect):
+            asyncio.run(upload.write_chunk(0, body()))
+        assert upload.offset == 50
+        with open(upload.path, "rb") as f:
+            assert f.read(50) == b"a" * 30 + b"b" * 20
+        upload_manager.terminate(upload.id)
+
+    ''' Test that the received ranges are stored with the upload, so another process can resume it'''
+    def test_state_on_disk(self, client):
+        data = b"0123456789" * 10
+        location = create(client, data)
+        response = patch(client, location, data[:40], 0)
+        assert response.status_code == 204 and "Upload-Expires" in response.headers
+        upload_id = location.rsplit("/", 1)[1]
+        # a restarted process or another replica has nothing of the upload in memory
+        resumed = UploadManager().get(upload_id)
+        assert resumed.ranges() == [(0, 40)] and resumed.filename == "call.wav"
+        assert patch(client, location, data[40:], 40).status_code == 204
+        assert UploadManager().get(upload_id).is_complete
+
+    ''' Test that an upload without chunks for UPLOAD_EXPIRY is gone and its workspace is swept, though its process lives'''
+    def test_expiry(self, client, monkeypatch):
+        location = create(client, b"0" * 100)
+        upload = upload_manager.get(location.rsplit("/", 1)[1])
+        monkeypatch.setattr(settings, "UPLOAD_EXPIRY", -1)
+        upload.save()
+        assert client.head(location).status_code == 404
+        assert sweep_orphans() == [upload.workspace.root]
+
+    ''' Test that OPTIONS announces the tus version, extensions and checksum algorithm'''
+    def test_options(self, client):
+        response = client.options("/transcibe/uploads")
+        assert response.status_code == 204
+        assert response.headers["Tus-Extension"] == TUS_EXTENSIONS
+        assert response.headers["Tus-Checksum-Algorithm"] == "sha256"
+        assert int(response.headers["Tus-Max-Size"]) > 0
+
+    ''' Test that a finalized upload is transcribed in its own workspace, without a copy'''
+    def test_finalize(self, client, user, db, monkeypatch):
+        received = {}
+
+        async def fake_transcribe_content(content, profile=None, workspace=None, audio_path=None, **options):
+            received.update(content=content, workspace=workspace, audio_path=audio_path)
+            return 1.0, "\n\nSpeaker 0: hello", 2.0, None
+
+        db.rows = [user]
+        monkeypatch.setattr(controller, "transcribe_content", fake_transcribe_content)
+        monkeypatch.setattr(controller, "SessionLocal", lambda: db)
+        monkeypatch.setattr(controller, "save_conversion", lambda *args: FakeConversion())
+
+        data = b"RIFF" + b"\0" * 96
+        location = create(client, data)
+        assert client.post(location + "/finalize", data={"profile": "fast"}).status_code == 409
+        patch(client, location, data, 0)
+        upload = upload_manager.get(location.rsplit("/", 1)[1])
+        response = client.post(location + "/finalize", data={"profile": "fast"}, headers={"Upload-Checksum": checksum(data)})
+        assert response.status_code == 202
+        assert received["content"] is None
+        assert received["workspace"].root == upload.workspace.root and received["audio_path"] == upload.path
+        assert client.head(location).status_code == 404
+        assert client.post(location + "/finalize", data={"profile": "fast"}).status_code == 404
+
+        job_id = response.json()["id"]
+        for _ in range(100):
+            job = client.get(f"/transcibe/jobs/{job_id}").json()
+            if job["status"] in ("done", "failed"):
+                break
+            time.sleep(0.02)
+        assert job["status"] == "done" and job["conversion_id"] == FakeConversion.id and job["error"] is None
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+from diarization import warmup, streaming, model_store
+from diarization import transcription
+from diarization.asr_scheduler import asr_scheduler
+
+
+@pytest.fixture(autouse=True)
+def status(monkeypatch):
+    status = {name: {"status": "pending", "seconds": None, "error": None} for name in warmup.warmup_models}
+    monkeypatch.setattr(warmup, "model_status", status)
+    monkeypatch.setattr(warmup, "configure_environment", lambda: None)
+    monkeypatch.setattr(warmup, "_device", lambda: "cpu")
+    return status
+
+
+def failing(clip_path, profiles):
+    raise RuntimeError("weights missing")
+
+
+class TestWarmUp:
+
+    ''' Test that every requested model is warmed on the built-in clip and reported ready, the others skipped'''
+    def test_warm_up(self, monkeypatch):
+        clips = []
+        monkeypatch.setattr(warmup, "warmers", {name: lambda clip_path, profiles: clips.append(clip_path)
+                                                for name in warmup.warmup_models})
+        warmup.warm_up(models=["whisper", "punctuation"])
+        ready, models = warmup.readiness()
+        assert ready and len(clips) == 2 and clips[0].endswith("warmup_clip.wav")
+        assert [name for name, values in models.items() if values["status"] == "ready"] == ["whisper", "punctuation"]
+        assert all(values["status"] == "skipped" for name, values in models.items() if name not in ("whisper", "punctuation"))
+
+    ''' Test that a failing model makes the process unready, with its error, and the others are still warmed'''
+    def test_readiness_failure(self, monkeypatch):
+        monkeypatch.setattr(warmup, "warmers", dict({name: lambda clip_path, profiles: None for name in warmup.warmup_models},
+                                                    vad=failing))
+        assert warmup.readiness()[0] is False
+        warmup.warm_up()
+        ready, models = warmup.readiness()
+        assert not ready and models["vad"]["status"] == "failed" and models["vad"]["error"] == "weights missing"
+        assert models["alignment"]["status"] == "ready" and models["alignment"]["seconds"] is not None
+        warmup.skip_warm_up()
+        assert warmup.readiness()[0]
+
+    ''' Test that the Whisper pipelines land in the ASR scheduler's cache under the keys the profile's jobs use'''
+    def test_whisper_cache(self, monkeypatch):
+        monkeypatch.setattr(asr_scheduler, "loader", lambda *key: key)
+        monkeypatch.setattr(asr_scheduler, "_models", type(asr_scheduler._models)())
+        monkeypatch.setattr(transcription, "transcribe_batched", lambda *args, **options: ([], "en"))
+        monkeypatch.setattr(model_store.settings, "MODELS_OFFLINE", False)
+        warmup._warm_whisper("clip.wav", ["fast"])
+        assert list(asr_scheduler._models) == [("small.en", "cpu", "int8", 1), ("small", "cpu", "int8", 1)]
+
+    ''' Test that the TitaNet model stays loaded for the speaker embeddings of jobs'''
+    def test_titanet_cache(self, monkeypatch, tmp_path):
+        class Tensor:
+            def squeeze(self):
+                return self
+            def cpu(self):
+                return self
+            def numpy(self):
+                return np.ones(4)
+
+        class Model:
+            def eval(self):
+                return self
+            def infer_segment(self, audio):
+                segments.append(audio)
+                return Tensor(), None
+
+        loads, segments = [], []
+        monkeypatch.setattr(streaming, "_models", {})
+        monkeypatch.setattr(model_store, "load_nemo_model", lambda name: loads.append(name) or Model())
+        clip_path = warmup.make_warmup_clip(str(tmp_path / "clip.wav"))
+        warmup._warm_titanet(clip_path, [None])
+        streaming.titanet_embedder()(np.zeros(16000, dtype=np.float32))
+        assert loads == ["titanet_large"] and ("titanet_large",) in streaming._models
+        assert segments[0].dtype == np.float32 and 0 < np.abs(segments[0]).max() <= 1
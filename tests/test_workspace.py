@@ -0,0 +1,87 @@
+import os
+import json
+import pytest
+from diarization import workspace as workspace_module
+from diarization.helper import cleanup
+from diarization.workspace import Workspace, WorkspaceQuotaExceeded, JobCancelled, sweep_orphans
+
+
+@pytest.fixture(autouse=True)
+def workspace_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(workspace_module.settings, "WORKSPACE_DIR", str(tmp_path))
+    monkeypatch.setattr(workspace_module.settings, "WORKSPACE_TMPFS_DIR", None)
+    return tmp_path
+
+
+class TestWorkspace:
+
+    ''' Test that the workspace is removed when the job fails'''
+    def test_removed_on_failure(self):
+        with pytest.raises(RuntimeError):
+            with Workspace() as workspace:
+                with open(workspace.path("htdemucs", "upload", "vocals.wav"), "wb") as f:
+                    f.write(b"0" * 10)
+                raise RuntimeError("pipeline failed")
+        assert not os.path.exists(workspace.root)
+
+    ''' Test that concurrent jobs get separate directories'''
+    def test_isolated(self):
+        with Workspace() as first, Workspace() as second:
+            assert first.root != second.root
+            assert os.path.isdir(first.root) and os.path.isdir(second.root)
+
+    ''' Test that a job writing more than its quota is stopped'''
+    def test_quota(self):
+        with Workspace(quota_mb=1) as workspace:
+            with pytest.raises(WorkspaceQuotaExceeded):
+                workspace.reserve(2 * 1024 * 1024)
+            with open(workspace.path("stem.wav"), "wb") as f:
+                f.write(b"0" * (2 * 1024 * 1024))
+            with pytest.raises(WorkspaceQuotaExceeded):
+                workspace.check()
+
+    ''' Test that a cancelled job stops at the next check'''
+    def test_cancel(self):
+        with Workspace() as workspace:
+            workspace.cancel()
+            with pytest.raises(JobCancelled):
+                workspace.check()
+
+    ''' Test that the janitor removes workspaces of dead processes and keeps live ones'''
+    def test_sweep_orphans(self):
+        with Workspace() as live, Workspace() as crashed:
+            owner_file = os.path.join(crashed.root, workspace_module.OWNER_FILE)
+            with open(owner_file) as f:
+                owner = json.load(f)
+            owner["pid"] = 2 ** 22 + 1  # above the kernel's pid limit, so never alive
+            with open(owner_file, "w") as f:
+                json.dump(owner, f)
+            assert sweep_orphans() == [crashed.root]
+            assert os.path.isdir(live.root)
+
+    ''' Test that a workspace of a live process on this host is kept however old it is'''
+    def test_live_workspace_outlives_max_age(self):
+        with Workspace() as live:
+            owner_file = os.path.join(live.root, workspace_module.OWNER_FILE)
+            with open(owner_file) as f:
+                owner = json.load(f)
+            owner["created"] -= 7 * 24 * 3600
+            with open(owner_file, "w") as f:
+                json.dump(owner, f)
+            assert sweep_orphans(max_age=3600) == []
+            assert os.path.isdir(live.root)
+
+    ''' Test that old workspaces of other hosts are removed after max_age'''
+    def test_other_host_max_age(self):
+        with Workspace() as remote:
+            owner_file = os.path.join(remote.root, workspace_module.OWNER_FILE)
+            with open(owner_file) as f:
+                owner = json.load(f)
+            owner["host"], owner["created"] = "another-host", owner["created"] - 7200
+            with open(owner_file, "w") as f:
+                json.dump(owner, f)
+            assert sweep_orphans(max_age=3600) == [remote.root]
+
+    ''' Test that cleanup ignores a path that does not exist'''
+    def test_cleanup_missing_path(self, tmp_path):
+        cleanup(str(tmp_path / "missing"), "tmp*")
@@ -1,20 +1,62 @@
+import time
+import asyncio
+import logging
+from starlette.concurrency import run_in_threadpool
+from app.core.config import settings
 from diarization.diarize import transcribe
-from tempfile import NamedTemporaryFile
-    
-async def transcribe_content(content):
-    with NamedTemporaryFile(delete=False, suffix=f".wav") as temp_audio_file:
-        temp_audio_file.write(content)
-        temp_audio_file_path = temp_audio_file.name
+from diarization.workspace import Workspace, WorkspaceError
 
-        # call transcribe function
-        transcription = transcribe(temp_audio_file_path)
-        video_length = transcription[-1]['end_time']/60000
-        video_length = round(video_length, 2)
 
+def transcribe_in_workspace(workspace, content=None, audio_path=None, profile=None, **diarization_options):
+    # the upload, the demucs stems and the NeMo input all live in the job's workspace,
+    # which is removed when the job finishes, fails or is cancelled
+    with workspace:
+        if content is not None:
+            workspace.reserve(len(content))
+            audio_path = workspace.path("upload.wav")
+            with open(audio_path, "wb") as audio_file:
+                audio_file.write(content)
+        # a failed attempt is retried on the same files; stages that finished before the
+        # failure are loaded from their checkpoints instead of being computed again
+        for attempt in range(settings.JOB_RETRIES + 1):
+            try:
+                return transcribe(audio_path, profile=profile, workspace=workspace, **diarization_options)
+            except (WorkspaceError, ValueError):
+                raise
+            except Exception:
+                if attempt == settings.JOB_RETRIES:
+                    raise
+                logging.exception(f"Transcription attempt {attempt + 1} failed, retrying")
+
+
+async def transcribe_content(content, profile=None, workspace=None, audio_path=None, **diarization_options):
+    # a finished resumable upload passes its workspace and file instead of the content
+    workspace = workspace or Workspace()
+
+    # call transcribe function and measure how long the pipeline takes
+    # it runs in a worker thread so concurrent uploads can share a diarization batch
+    started = time.perf_counter()
+    try:
+        transcription = await run_in_threadpool(
+            transcribe_in_workspace, workspace, content, audio_path, profile=profile, **diarization_options
+        )
+    except asyncio.CancelledError:
+        # the thread can not be interrupted; it stops at the next stage and removes the workspace
+        workspace.cancel()
+        raise
+    processing_time = round(time.perf_counter() - started, 2)
+    transcription, transcript = transcription
+    video_length = transcription[-1]['end_time']/60000
+    video_length = round(video_length, 2)
+    # the word-level transcript is stored with the conversion, so it can be rendered again
+    return video_length, format_transcript(transcription), processing_time, transcript
+
+
+def format_transcript(transcription):
     final_content = ""
     for sentence_dict in transcription:
         sp = sentence_dict["speaker"]
         text = sentence_dict["text"]
         content = f"\n\n{sp}: {text}"
         final_content += content
-    return video_length, final_content
\ No newline at end of file
+    return final_content
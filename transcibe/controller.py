@@ -1,19 +1,46 @@
-from fastapi import status, HTTPException, APIRouter, UploadFile, File, Depends
-from typing import List
+import io
+import json
+import time
+import wave
+import asyncio
+import logging
+from functools import partial
+from fastapi import status, HTTPException, APIRouter, UploadFile, File, Form, Depends, Header, Query, Request, Response, WebSocket, WebSocketDisconnect, WebSocketException
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from starlette.concurrency import run_in_threadpool
+from typing import List, Optional
+from sqlalchemy import func
 from sqlalchemy.orm import Session
-from app import get_db, AudioConversion
-from users import get_current_active_user
-from .schemas import AudioConversionResponse
+from app import get_db, AudioConversion, User, settings
+from app.db.database import SessionLocal
+from app.db.models import TranscriptionJob
+from app.blobs import put_blob_file, read_blob, release_blobs, lock_blob
+from users import get_current_active_user, get_websocket_user
+from diarization.profiles import profiles, charge, DEFAULT_PROFILE
+from diarization.backends import backends
+from diarization.service import validate_speaker_hints
+from diarization.streaming import SAMPLE_RATE, create_session, final_sentences
+from diarization.workspace import Workspace, WorkspaceQuotaExceeded
+from diarization.transcript import WordTranscript
+from diarization.speaker_index import speaker_indexes
+from diarization.helper import write_srt
+from diarization.checkpoints import purge_checkpoints
+from .schemas import AudioConversionResponse, AudioConversionSummary, TranscriptionProfileResponse, TranscriptionJobResponse, TranscriptSearchResponse, JobQueueResponse
+from .scheduler import job_scheduler, probe_duration, user_weight, user_tier
+from .search import parse_transcript, transcript_segments, search_statement, count_statement
+from .jobs import job_manager
+from . import job_queue
+from .uploads import upload_manager, parse_metadata, parse_checksum, UploadError, ChecksumMismatch, TUS_VERSION, TUS_EXTENSIONS, CHECKSUM_ALGORITHM
 from app.mail import send_email
-from .audio_helper import transcribe_content
+from .audio_helper import transcribe_content, format_transcript
 # Create a new APIRouter instance
 router = APIRouter()
 
 ''' Get all audio transcibes of the user '''
 @router.get("/", 
             tags=["Get All Audio transcribes"],
-            description="Get all audio transcribes of the user.",
-            response_model=List[AudioConversionResponse])
+            description="Get all audio transcribes of the user, without their text; GET /transcibe/transcribe/{id} returns it.",
+            response_model=List[AudioConversionSummary])
 def get_transcribes(
                           db: Session = Depends(get_db),
                           current_user: str = Depends(get_current_active_user)
@@ -21,6 +48,119 @@ def get_transcribes(
     audio_conversions = db.query(AudioConversion).filter(AudioConversion.user_id==current_user.id).all()
     return audio_conversions
 
+''' List the transcription profiles with their pricing and measured real-time factor '''
+@router.get("/profiles",
+            tags=["Get Transcription Profiles"],
+            description="List the speed/accuracy profiles, their credit rate and measured real-time factor.",
+            response_model=List[TranscriptionProfileResponse])
+def get_profiles(
+                          db: Session = Depends(get_db),
+                          current_user: str = Depends(get_current_active_user)
+):
+    # Aggregate the recorded runs of every profile in one query
+    measured = dict(
+        (name, (count, rtf)) for name, count, rtf in
+        db.query(AudioConversion.profile,
+                 func.count(AudioConversion.id),
+                 func.avg(AudioConversion.real_time_factor))
+          .filter(AudioConversion.profile.isnot(None))
+          .group_by(AudioConversion.profile)
+          .all()
+    )
+    response = []
+    for name, options in profiles.items():
+        count, rtf = measured.get(name, (0, None))
+        response.append(TranscriptionProfileResponse(
+            name=name, **options, conversions=count,
+            average_real_time_factor=round(rtf, 3) if rtf is not None else None,
+        ))
+    return response
+
+''' check_transcription_options: This function checks the profile, the diarization backend and the speaker-count hints of a transcription request.
+    It returns the profile to use and the normalized hints, or raises an HTTPException with a status code of 400.'''
+def check_transcription_options(current_user, profile, diarization_backend, num_speakers, min_speakers, max_speakers):
+    # This picks the requested profile, then the user's default, then the service default.
+    profile = profile or current_user.default_profile or DEFAULT_PROFILE
+    if profile not in profiles:
+        raise HTTPException(status_code=400, detail=f"Unknown profile '{profile}'. Choose from {', '.join(profiles)}.")
+
+    # This checks the diarization backend and the speaker-count hints.
+    if diarization_backend is not None and diarization_backend not in backends:
+        raise HTTPException(status_code=400, detail=f"Unknown diarization backend '{diarization_backend}'. Choose from {', '.join(backends)}.")
+    try:
+        num_speakers, min_speakers, max_speakers = validate_speaker_hints(num_speakers, min_speakers, max_speakers)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # The user's speaker index names the speakers it recognizes.
+    return profile, dict(
+        diarization_backend=diarization_backend,
+        num_speakers=num_speakers,
+        min_speakers=min_speakers,
+        max_speakers=max_speakers,
+        speaker_index=speaker_indexes.get(current_user.id),
+    )
+
+''' add_conversion: This function charges the user for a finished transcription and adds it as an AudioConversion to the session.
+    The row is flushed, so it has its id, but not committed; the caller commits it with the rest of its transaction.'''
+def add_conversion(db, current_user, profile, video_length, final_content, processing_time, transcript=None):
+    # This creates a new AudioConversion object with the transcribed content, the current user's id
+    # and the measured real-time factor of the profile that was used.
+    audio_duration = round(video_length * 60, 2)
+    price, credits = charge(profile, video_length)
+    response = AudioConversion(
+        text_content=final_content,
+        user_id=current_user.id,
+        profile=profile,
+        audio_duration=audio_duration,
+        processing_time=processing_time,
+        real_time_factor=round(processing_time / audio_duration, 3) if audio_duration else None,
+        credits_charged=credits,
+        words=transcript.to_bytes() if transcript is not None else None,
+        checkpoint_keys=transcript.checkpoint_keys if transcript is not None else None,
+    )
+    # The speaker blocks are stored as segments for full-text search, with their times when they are known.
+    sentences = transcript.render() if transcript is not None else parse_transcript(final_content)
+    response.segments = transcript_segments(sentences, current_user.id)
+
+    # This checks if the user has enough credit to transcribe the audio file.
+    # If they don't, it raises an HTTPException with a status code of 400 and a detail message.
+    if current_user.current_credit < credits:
+        warning_message = (
+            f"Warning: Your current credit ({current_user.current_credit} credits) "
+            f"is insufficient for the {video_length}-minute audio with the '{profile}' profile "
+            f"({price} credits, {credits} charged). Please purchase additional credit."
+        )
+        raise HTTPException(status_code=400, detail=warning_message)
+
+    # If the user has enough credit, it deducts the price of the audio file from their credit.
+    current_user.current_credit -= credits
+
+    # This adds the new AudioConversion object to the database session and flushes it, which assigns its id.
+    db.add(response)
+    db.flush()
+    return response
+
+''' notify_conversion: This function emails the user about a stored conversion and adds its speakers to the user's speaker index.
+    It runs after the commit, so no mail goes out for a conversion that was rolled back.'''
+def notify_conversion(current_user, filename, video_length, response, transcript=None):
+    # This sends an email to the user with the filename and the length of the audio file.
+    send_email(current_user.username, current_user.email, filename[:-4], video_length)
+
+    # This adds the speakers of the conversion to the user's speaker index, so they can be enrolled by name.
+    if transcript is not None and transcript.speaker_embeddings:
+        try:
+            speaker_indexes.get(current_user.id).add(transcript.speaker_embeddings, conversion_id=response.id)
+        except Exception:
+            logging.exception(f"Indexing the speakers of conversion {response.id} failed")
+
+''' save_conversion: This function charges the user for a finished transcription, stores it as an AudioConversion and emails the user.'''
+def save_conversion(db, current_user, filename, profile, video_length, final_content, processing_time, transcript=None):
+    response = add_conversion(db, current_user, profile, video_length, final_content, processing_time, transcript)
+    db.commit()
+    db.refresh(response)
+    notify_conversion(current_user, filename, video_length, response, transcript)
+    return response
+
 '''This is the route for uploading an audio file for transcription.'''
 @router.post("/upload", 
                 tags=["Upload Audio"],
@@ -30,6 +170,11 @@ def get_transcribes(
 # It takes three parameters: an uploaded file, the current user, and a database session.
 async def audio_conversion(
     audio_file: UploadFile = File(...),  # The uploaded file. It must be provided (hence the ...).
+    profile: Optional[str] = Form(None),  # The speed/accuracy profile. Defaults to the user's default profile.
+    num_speakers: Optional[int] = Form(None),  # The exact number of speakers, when known.
+    min_speakers: Optional[int] = Form(None),  # The lower bound of the speaker count.
+    max_speakers: Optional[int] = Form(None),  # The upper bound of the speaker count.
+    diarization_backend: Optional[str] = Form(None),  # The diarization backend. Defaults to the profile's backend.
     current_user: str = Depends(get_current_active_user),  # The current user. This is obtained by calling the function get_current_active_user.
     db: Session = Depends(get_db)  # The database session. This is obtained by calling the function get_db.
 ):
@@ -38,36 +183,483 @@ async def audio_conversion(
     # If it doesn't, it raises an HTTPException with a status code of 400 and a detail message.
     if not audio_file.content_type.startswith("audio/"):
         raise HTTPException(status_code=400, detail="Only audio files are allowed")
+    profile, diarization_options = check_transcription_options(
+        current_user, profile, diarization_backend, num_speakers, min_speakers, max_speakers
+    )
 
     # This reads the content of the audio file and transcribes it.
+    # A job that outgrows its scratch-space quota is rejected with a 413.
+    # It waits for a pipeline slot like a background job does.
     audio_content = await audio_file.read()
-    video_length, final_content = await transcribe_content(audio_content)
+    try:
+        duration = await run_in_threadpool(probe_duration, audio_content)
+        async with job_scheduler.slot(current_user.id, user_weight(current_user), duration, user_tier(current_user)):
+            video_length, final_content, processing_time, transcript = await transcribe_content(
+                audio_content, profile=profile, **diarization_options
+            )
+    except WorkspaceQuotaExceeded as e:
+        raise HTTPException(status_code=413, detail=str(e))
 
-    # This creates a new AudioConversion object with the transcribed content and the current user's id.
-    response = AudioConversion(text_content=final_content, user_id=current_user.id)
+    # This returns the new AudioConversion object as a response.
+    return save_conversion(db, current_user, audio_file.filename, profile, video_length, final_content, processing_time, transcript)
 
-    # This checks if the user has enough credit to transcribe the audio file.
-    # If they don't, it raises an HTTPException with a status code of 400 and a detail message.
-    if current_user.current_credit < video_length:
-        warning_message = (
-            f"Warning: Your current credit ({current_user.current_credit} minutes) "
-            f"is insufficient for the {video_length}-minute audio. Please purchase additional credit."
+''' run_job: This function transcribes the audio of a background job and publishes its progress and result.
+    It runs after the request that created the job has finished, so it opens its own database session.'''
+async def run_job(job, audio_content, user_id, profile, diarization_options, workspace=None, audio_path=None,
+                  weight=1.0, tier=None, duration=0.0):
+    db = SessionLocal()
+    try:
+        # This waits for a pipeline slot; the scheduler shares the slots fairly between users
+        # and starts the shortest files of each user first.
+        async with job_scheduler.slot(user_id, weight, duration, tier):
+            video_length, final_content, processing_time, transcript = await transcribe_content(
+                audio_content, profile=profile, workspace=workspace, audio_path=audio_path,
+                progress=job_manager.progress_callback(job.id), **diarization_options
+            )
+        current_user = db.query(User).filter(User.id == user_id).first()
+        response = save_conversion(db, current_user, job.filename, profile, video_length, final_content, processing_time,
+                                   transcript)
+        job_manager.publish(job.id, "done", conversion_id=response.id)
+    except HTTPException as e:
+        job_manager.publish(job.id, "failed", error=e.detail)
+    except Exception as e:
+        logging.exception(f"Transcription job {job.id} failed")
+        job_manager.publish(job.id, "failed", error=str(e))
+    finally:
+        db.close()
+
+''' queue_job: This function stores the audio of a job in the blob store and queues the job in the database for the workers.
+    It is used instead of run_job when JOB_QUEUE_ENABLED is set, and returns the snapshot of the queued job.'''
+def queue_job(user_id, filename, profile, diarization_options, duration, weight, audio_content=None, audio_path=None):
+    # The speaker index is not stored with the job; the worker opens the user's index itself.
+    options = {key: value for key, value in diarization_options.items() if key != "speaker_index"}
+    with SessionLocal() as db:
+        # The file is streamed into the store, so an upload is never held in memory; audio hardly
+        # compresses, so the fastest zstd level is used. The blob is locked from the check whether
+        # it exists until the job is committed, so a finishing job with the same file keeps it.
+        lock = partial(lock_blob, db)
+        if audio_content is None:
+            with open(audio_path, "rb") as f:
+                ref = put_blob_file(f, level=1, lock=lock)
+        else:
+            ref = put_blob_file(io.BytesIO(audio_content), level=1, lock=lock)
+        return job_queue.enqueue(db, user_id, profile, options, ref.pointer, filename=filename,
+                                 audio_duration=duration, weight=weight).snapshot()
+
+''' run_queued_job: This function transcribes a job of the durable queue on a worker (manage.py worker) and stores its result.
+    Failures that a retry does not fix are raised as JobFailed; the worker retries the job on every other error.'''
+async def run_queued_job(job, worker_id, progress):
+    audio_content = await run_in_threadpool(read_blob, job.audio_blob)
+    diarization_options = dict(job.options, speaker_index=speaker_indexes.get(job.user_id))
+    try:
+        video_length, final_content, processing_time, transcript = await transcribe_content(
+            audio_content, profile=job.profile, progress=progress, **diarization_options
         )
-        raise HTTPException(status_code=400, detail=warning_message)
+    except WorkspaceQuotaExceeded as e:
+        raise job_queue.JobFailed(str(e))
+    return await run_in_threadpool(store_queued_job, job, worker_id, video_length, final_content, processing_time, transcript)
 
-    # If the user has enough credit, it deducts the length of the audio file from their credit.
-    current_user.current_credit -= int(video_length)
+''' store_queued_job: This function stores the result of a queued job and marks the job done in the same transaction.
+    The job row is locked first, so a job whose lease ran out and went to another worker is never stored twice.'''
+def store_queued_job(job, worker_id, video_length, final_content, processing_time, transcript):
+    with SessionLocal() as db:
+        finished = job_queue.finish(db, job.id, worker_id)
+        current_user = db.query(User).filter(User.id == job.user_id).first()
+        try:
+            response = add_conversion(db, current_user, job.profile, video_length, final_content, processing_time,
+                                      transcript)
+        except HTTPException as e:
+            db.rollback()
+            raise job_queue.JobFailed(e.detail)
+        # the job becomes done together with its conversion id, so its done event always has one
+        finished.conversion_id = response.id
+        db.commit()
+        db.refresh(response)
+        # the mail goes out once the row lock on the job is released
+        notify_conversion(current_user, job.filename, video_length, response, transcript)
+        return response.id
 
-    # This sends an email to the user with the filename and the length of the audio file.
-    send_email(current_user.username, current_user.email, audio_file.filename[:-4], video_length)
+'''This is the route for starting a transcription job in the background.
+    It answers with 202 right away; the progress is streamed from /jobs/{job_id}/events.'''
+@router.post("/jobs",
+             tags=["Transcription Jobs"],
+             description="Start transcribing an audio file in the background",
+             status_code=status.HTTP_202_ACCEPTED,
+             response_model=TranscriptionJobResponse)
+async def create_job(
+    audio_file: UploadFile = File(...),  # The uploaded file. It must be provided (hence the ...).
+    profile: Optional[str] = Form(None),  # The speed/accuracy profile. Defaults to the user's default profile.
+    num_speakers: Optional[int] = Form(None),  # The exact number of speakers, when known.
+    min_speakers: Optional[int] = Form(None),  # The lower bound of the speaker count.
+    max_speakers: Optional[int] = Form(None),  # The upper bound of the speaker count.
+    diarization_backend: Optional[str] = Form(None),  # The diarization backend. Defaults to the profile's backend.
+    current_user: str = Depends(get_current_active_user),
+):
+    if not audio_file.content_type.startswith("audio/"):
+        raise HTTPException(status_code=400, detail="Only audio files are allowed")
+    profile, diarization_options = check_transcription_options(
+        current_user, profile, diarization_backend, num_speakers, min_speakers, max_speakers
+    )
+    audio_content = await audio_file.read()
+    duration = await run_in_threadpool(probe_duration, audio_content)
+
+    # With the durable queue, the job is stored in the database and a worker transcribes it.
+    if settings.JOB_QUEUE_ENABLED:
+        return await run_in_threadpool(queue_job, current_user.id, audio_file.filename, profile, diarization_options,
+                                       duration, user_weight(current_user), audio_content=audio_content)
+
+    # The job keeps a reference to its task, so it runs to the end even if nobody listens.
+    job = job_manager.create(current_user.id, profile=profile, filename=audio_file.filename)
+    job.task = asyncio.create_task(run_job(job, audio_content, current_user.id, profile, diarization_options,
+                                           weight=user_weight(current_user), tier=user_tier(current_user),
+                                           duration=duration))
+    return job.snapshot()
+
+'''This is the route for the job queue of this server.
+    Users see their own waiting and running jobs and how long they waited; admins see every user.'''
+@router.get("/queue",
+            tags=["Transcription Jobs"],
+            description="Get the waiting and running jobs and the queue wait times per user.",
+            response_model=List[JobQueueResponse])
+def read_queue(current_user: str = Depends(get_current_active_user)):
+    return job_scheduler.stats(None if current_user.is_admin else current_user.id)
+
+''' get_job: This function returns a job of the current user, or raises an HTTPException with a status code of 404.'''
+def get_job(job_id, current_user):
+    # Jobs of the durable queue are read from the database.
+    job = job_manager.get(job_id)
+    if job is None and settings.JOB_QUEUE_ENABLED:
+        with SessionLocal() as db:
+            job = job_queue.get(db, job_id)
+    if job is None or job.user_id != current_user.id:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+''' Get the status of a transcription job '''
+@router.get("/jobs/{job_id}",
+            tags=["Transcription Jobs"],
+            description="Get the status, stage and ASR progress of a transcription job.",
+            response_model=TranscriptionJobResponse)
+def read_job(job_id: str, current_user: str = Depends(get_current_active_user)):
+    return get_job(job_id, current_user).snapshot()
+
+''' Stream the progress of a transcription job as Server-Sent Events.
+    Events: "queued", "progress" (stage, status, and percent and eta in seconds while ASR runs),
+    then "done" with the conversion id or "failed" with the error.
+    A client that reconnects with the Last-Event-ID header gets the events it missed.
+    Jobs of the durable queue are polled from the database; a reconnecting client gets their current state.'''
+@router.get("/jobs/{job_id}/events",
+            tags=["Transcription Jobs"],
+            description="Server-Sent Events with the stage transitions and ASR progress of a transcription job.")
+async def job_events(
+    job_id: str,
+    last_event_id: Optional[int] = Header(None),
+    current_user: str = Depends(get_current_active_user),
+):
+    job = get_job(job_id, current_user)
+    if isinstance(job, TranscriptionJob):
+        messages = job_queue.watch(SessionLocal, job.id, last_event_id=last_event_id)
+    else:
+        messages = job_manager.subscribe(job.id, last_event_id=last_event_id)
+
+    async def event_stream():
+        async for message in messages:
+            yield f"id: {message['id']}\nevent: {message['event']}\ndata: {json.dumps(message['data'])}\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+''' get_upload: This function returns a resumable upload of the current user, or raises an HTTPException with a status code of 404.'''
+def get_upload(upload_id, current_user):
+    upload = upload_manager.get(upload_id)
+    if upload is None or upload.user_id != current_user.id:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return upload
+
+''' Describe the tus support of the server (tus OPTIONS): the protocol version, the extensions,
+    the checksum algorithm and the largest upload, which is the workspace quota.'''
+@router.options("/uploads",
+                tags=["Resumable Uploads"],
+                description="Get the tus version, extensions and limits of resumable uploads",
+                status_code=status.HTTP_204_NO_CONTENT)
+def upload_options():
+    return Response(status_code=204, headers={
+        "Tus-Resumable": TUS_VERSION,
+        "Tus-Version": TUS_VERSION,
+        "Tus-Extension": TUS_EXTENSIONS,
+        "Tus-Checksum-Algorithm": CHECKSUM_ALGORITHM,
+        "Tus-Max-Size": str(settings.WORKSPACE_QUOTA_MB * 1024 * 1024),
+    })
+
+''' Create a resumable upload (tus creation).
+    Upload-Length is the size of the file in bytes; Upload-Metadata can carry the base64 encoded filename and filetype.
+    The file is preallocated in a new job workspace, and Location points at the upload.'''
+@router.post("/uploads",
+             tags=["Resumable Uploads"],
+             description="Create a resumable upload of an audio file",
+             status_code=status.HTTP_201_CREATED)
+def create_upload(
+    response: Response,
+    upload_length: int = Header(...),  # The size of the whole file in bytes.
+    upload_metadata: Optional[str] = Header(None),  # Comma separated "key base64(value)" pairs, e.g. filename and filetype.
+    current_user: str = Depends(get_current_active_user),
+):
+    if upload_length <= 0:
+        raise HTTPException(status_code=400, detail="Upload-Length must be positive")
+    try:
+        metadata = parse_metadata(upload_metadata)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Upload-Metadata is not valid")
+    if not metadata.get("filetype", "audio/").startswith("audio/"):
+        raise HTTPException(status_code=400, detail="Only audio files are allowed")
+
+    # An upload that does not fit in the workspace quota is rejected with a 413.
+    try:
+        upload = upload_manager.create(current_user.id, upload_length, metadata)
+    except WorkspaceQuotaExceeded as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    response.headers["Location"] = f"/transcibe/uploads/{upload.id}"
+    response.headers["Upload-Expires"] = upload.expires_header
+    response.headers["Tus-Resumable"] = TUS_VERSION
+    return {"id": upload.id, "length": upload.length, "offset": upload.offset}
+
+''' Report how much of a resumable upload arrived (tus HEAD).
+    Upload-Offset is the length of the contiguous prefix; Upload-Ranges lists every received byte range,
+    so clients that send chunks in parallel know which ones are missing.'''
+@router.head("/uploads/{upload_id}",
+             tags=["Resumable Uploads"],
+             description="Get the offset and the received byte ranges of a resumable upload")
+def upload_status(upload_id: str, current_user: str = Depends(get_current_active_user)):
+    upload = get_upload(upload_id, current_user)
+    return Response(status_code=200, headers={
+        "Upload-Offset": str(upload.offset),
+        "Upload-Length": str(upload.length),
+        "Upload-Ranges": ",".join(f"{start}-{end}" for start, end in upload.ranges()),
+        "Upload-Expires": upload.expires_header,
+        "Cache-Control": "no-store",
+        "Tus-Resumable": TUS_VERSION,
+    })
 
-    # This adds the new AudioConversion object to the database session, commits the session, and refreshes the object.
+''' Write a chunk of a resumable upload (tus PATCH) at Upload-Offset.
+    Chunks may arrive in any order and in parallel. With Upload-Checksum ("sha256 <base64 digest>")
+    a chunk that does not match is answered with 460 and has to be sent again.'''
+@router.patch("/uploads/{upload_id}",
+              tags=["Resumable Uploads"],
+              description="Upload a chunk of a resumable upload at the given offset",
+              status_code=status.HTTP_204_NO_CONTENT)
+async def upload_chunk(
+    upload_id: str,
+    request: Request,
+    upload_offset: int = Header(...),  # Where the chunk starts in the file.
+    upload_checksum: Optional[str] = Header(None),  # The sha256 of the chunk.
+    content_type: Optional[str] = Header(None),
+    current_user: str = Depends(get_current_active_user),
+):
+    upload = get_upload(upload_id, current_user)
+    if content_type != "application/offset+octet-stream":
+        raise HTTPException(status_code=415, detail="Chunks must be sent as application/offset+octet-stream")
+    try:
+        checksum = parse_checksum(upload_checksum) if upload_checksum else None
+        offset = await upload.write_chunk(upload_offset, request.stream(), checksum)
+    except ChecksumMismatch as e:
+        raise HTTPException(status_code=460, detail=str(e))
+    except (UploadError, ValueError) as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return Response(status_code=204, headers={"Upload-Offset": str(offset), "Upload-Expires": upload.expires_header,
+                                              "Tus-Resumable": TUS_VERSION})
+
+''' Abort a resumable upload (tus termination) and remove its workspace.'''
+@router.delete("/uploads/{upload_id}",
+               tags=["Resumable Uploads"],
+               description="Abort a resumable upload",
+               status_code=status.HTTP_204_NO_CONTENT)
+def delete_upload(upload_id: str, current_user: str = Depends(get_current_active_user)):
+    get_upload(upload_id, current_user)
+    upload_manager.terminate(upload_id)
+    return Response(status_code=204, headers={"Tus-Resumable": TUS_VERSION})
+
+''' Finalize a complete resumable upload and start transcribing it as a background job.
+    Takes the same form fields as /jobs. With Upload-Checksum the sha256 of the whole file is verified first.
+    The job adopts the upload's workspace, so the file is transcribed where it was assembled.'''
+@router.post("/uploads/{upload_id}/finalize",
+             tags=["Resumable Uploads"],
+             description="Transcribe a complete resumable upload in the background",
+             status_code=status.HTTP_202_ACCEPTED,
+             response_model=TranscriptionJobResponse)
+async def finalize_upload(
+    upload_id: str,
+    profile: Optional[str] = Form(None),  # The speed/accuracy profile. Defaults to the user's default profile.
+    num_speakers: Optional[int] = Form(None),  # The exact number of speakers, when known.
+    min_speakers: Optional[int] = Form(None),  # The lower bound of the speaker count.
+    max_speakers: Optional[int] = Form(None),  # The upper bound of the speaker count.
+    diarization_backend: Optional[str] = Form(None),  # The diarization backend. Defaults to the profile's backend.
+    upload_checksum: Optional[str] = Header(None),  # The sha256 of the whole file.
+    current_user: str = Depends(get_current_active_user),
+):
+    upload = get_upload(upload_id, current_user)
+    profile, diarization_options = check_transcription_options(
+        current_user, profile, diarization_backend, num_speakers, min_speakers, max_speakers
+    )
+    if not upload.is_complete:
+        raise HTTPException(status_code=409, detail=f"The upload is incomplete, {upload.offset} of {upload.length} bytes arrived")
+    if upload_checksum:
+        try:
+            checksum = parse_checksum(upload_checksum)
+        except (UploadError, ValueError) as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if await run_in_threadpool(upload.file_checksum) != checksum:
+            raise HTTPException(status_code=460, detail="The file does not match its Upload-Checksum")
+
+    # From here on the workspace belongs to the job, which removes it when it ends.
+    try:
+        await run_in_threadpool(upload.finalize)
+    except UploadError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    duration = await run_in_threadpool(probe_duration, None, upload.path)
+    if settings.JOB_QUEUE_ENABLED:
+        try:
+            return await run_in_threadpool(queue_job, current_user.id, upload.filename, profile, diarization_options,
+                                           duration, user_weight(current_user), audio_path=upload.path)
+        finally:
+            upload.workspace.cleanup()
+    job = job_manager.create(current_user.id, profile=profile, filename=upload.filename)
+    job.task = asyncio.create_task(run_job(
+        job, None, current_user.id, profile, diarization_options, workspace=upload.workspace, audio_path=upload.path,
+        weight=user_weight(current_user), tier=user_tier(current_user), duration=duration
+    ))
+    return job.snapshot()
+
+''' stream: Live transcription over a WebSocket.
+    The client sends 16 kHz, 16-bit little-endian mono PCM as binary frames and {"type": "stop"} to end the session.
+    The server sends "partial" segments that may still change, "final" segments that will not,
+    and "done" with the id of the stored AudioConversion.'''
+@router.websocket("/stream")
+async def stream_transcription(
+    websocket: WebSocket,
+    profile: Optional[str] = Query(None),  # The profile whose Whisper model and beam size are used. Defaults to STREAMING_PROFILE.
+    language: Optional[str] = Query(None),  # The spoken language. It is detected from the first window when not given.
+    max_speakers: Optional[int] = Query(None),  # The upper bound of the speaker count.
+    current_user = Depends(get_websocket_user),  # The user of the access token in the "token" query parameter.
+    db: Session = Depends(get_db)
+):
+    # This checks the profile and that the user has some credit left before accepting the connection.
+    profile = profile or settings.STREAMING_PROFILE
+    if profile not in profiles:
+        raise WebSocketException(code=status.WS_1008_POLICY_VIOLATION, reason=f"Unknown profile '{profile}'")
+    if current_user.current_credit <= 0:
+        raise WebSocketException(code=status.WS_1008_POLICY_VIOLATION, reason="Insufficient credit")
+    await websocket.accept()
+
+    # The session ends when the user's credit is used up.
+    credit_rate = profiles[profile]["credit_rate"]
+    max_seconds = current_user.current_credit / credit_rate * 60
+    session = await run_in_threadpool(create_session, profile, language, max_speakers)
+    processing_time = 0.0
+    connected = True
+
+    # The stream is recorded in the job's workspace, so the whole recording can be diarized at the end.
+    with Workspace() as workspace:
+        recording_path = workspace.path("stream.wav")
+        with wave.open(recording_path, "wb") as recording:
+            recording.setnchannels(1)
+            recording.setsampwidth(2)
+            recording.setframerate(SAMPLE_RATE)
+            try:
+                while True:
+                    message = await websocket.receive()
+                    if message["type"] == "websocket.disconnect":
+                        connected = False
+                        break
+                    if message.get("text") is not None:
+                        # {"type": "stop"} ends the session, other text frames are ignored
+                        try:
+                            stop = json.loads(message["text"]).get("type") == "stop"
+                        except (ValueError, AttributeError):
+                            stop = False
+                        if stop:
+                            break
+                        continue
+
+                    session.feed(message["bytes"])
+                    recording.writeframes(message["bytes"])
+                    if session.duration >= max_seconds:
+                        await websocket.send_json({"type": "error", "detail": "Your credit is used up, ending the session."})
+                        break
+
+                    # This decodes the sliding window once enough new audio has arrived.
+                    if session.ready():
+                        workspace.check()
+                        started = time.perf_counter()
+                        events = await run_in_threadpool(session.process)
+                        processing_time += time.perf_counter() - started
+                        for event in events:
+                            await websocket.send_json(event)
+            except WebSocketDisconnect:
+                connected = False
+            except WorkspaceQuotaExceeded as e:
+                await websocket.send_json({"type": "error", "detail": str(e)})
+
+        # This finalizes the rest of the window and replaces the provisional speakers with a full diarization.
+        started = time.perf_counter()
+        events = await run_in_threadpool(session.finish)
+        sentences = await run_in_threadpool(
+            final_sentences,
+            session,
+            recording_path if settings.STREAMING_FINAL_DIARIZATION else None,
+            profiles[profile]["diarization"],
+            max_speakers,
+        )
+        processing_time = round(processing_time + time.perf_counter() - started, 2)
+    if connected:
+        for event in events:
+            await websocket.send_json(event)
+
+    if not sentences:
+        if connected:
+            await websocket.close()
+        return
+
+    # This stores the session like an upload and charges the user for the streamed minutes.
+    audio_duration = round(session.duration, 2)
+    video_length = round(audio_duration / 60, 2)
+    _, credits = charge(profile, video_length)
+    response = AudioConversion(
+        text_content=format_transcript(sentences),
+        user_id=current_user.id,
+        profile=profile,
+        audio_duration=audio_duration,
+        processing_time=processing_time,
+        real_time_factor=round(processing_time / audio_duration, 3) if audio_duration else None,
+        credits_charged=credits,
+    )
+    response.segments = transcript_segments(sentences, current_user.id)
+    current_user.current_credit -= credits
     db.add(response)
     db.commit()
     db.refresh(response)
 
-    # This returns the new AudioConversion object as a response.
-    return response 
+    if connected:
+        await websocket.send_json({"type": "done", "id": response.id})
+        await websocket.close()
+
+'''Search the transcripts of the current user.
+    Hits are speaker blocks ranked by how well they match, with the matching words highlighted
+    and the block's time in the recording when it is known.'''
+@router.get("/search",
+            tags=["Search Transcripts"],
+            description="Full-text search over the transcripts of the user.",
+            response_model=TranscriptSearchResponse)
+def search_transcripts(
+    q: str = Query(..., min_length=1),  # Words, "quoted phrases", or and -excluded words.
+    page: int = Query(1, ge=1),
+    page_size: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_db),
+    current_user: str = Depends(get_current_active_user)
+):
+    # This counts all hits and loads the ranked hits of the requested page.
+    total = db.execute(count_statement(current_user.id, q)).scalar_one()
+    hits = db.execute(search_statement(current_user.id, q, page_size, (page - 1) * page_size)).mappings().all() if total else []
+    return {"query": q, "total": total, "page": page, "page_size": page_size, "hits": [dict(hit) for hit in hits]}
 
 ''' read audio transcribe detail by id '''
 @router.get("/transcribe/{transcribe_id}", 
@@ -95,6 +687,118 @@ def read_audio_transcribe(audio_transcribe_id: int,
     # If the current user is an admin or they are the owner of the audio transcribe, it returns the audio transcribe.
     return db_audio_transcribe
 
+'''Re-render a stored transcript with other segmentation settings, from its word-level results.
+    Nothing is transcribed again, so it is free and takes milliseconds.'''
+@router.get("/transcribe/{transcribe_id}/render",
+            tags=["Get Audio Transcribe"],
+            description="Render a transcript again with another word anchor, realignment window or speaker grouping.")
+def render_audio_transcribe(
+    transcribe_id: int,
+    anchor: str = Query("start"),  # Which time of a word decides its speaker: start, mid or end.
+    max_words: int = Query(50),  # How many words around a speaker change are realigned to the sentence boundary.
+    realign: Optional[bool] = Query(None),  # Realign speakers to sentences. Defaults to whether the transcript was punctuated.
+    split: str = Query("speaker"),  # "speaker" for one block per speaker turn, "sentence" for one block per sentence.
+    min_words: int = Query(0),  # Speaker runs shorter than this are merged into the previous speaker.
+    format: str = Query("json"),  # json, txt or srt.
+    db: Session = Depends(get_db),
+    current_user: str = Depends(get_current_active_user)
+):
+    # This loads the conversion and checks that the current user may read it.
+    db_audio_transcribe = db.query(AudioConversion).filter(AudioConversion.id == transcribe_id).first()
+    if db_audio_transcribe is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Audiotranscribe: {transcribe_id} not found")
+    if (not current_user.is_admin) and (current_user.id != db_audio_transcribe.user_id):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to perform request action.")
+    if db_audio_transcribe.words is None:
+        raise HTTPException(status_code=409, detail="This transcript has no stored word-level results")
+    if format not in ("json", "txt", "srt"):
+        raise HTTPException(status_code=400, detail="format must be json, txt or srt")
+
+    # This rebuilds the sentences from the stored words and speaker turns.
+    try:
+        sentences = WordTranscript.from_bytes(db_audio_transcribe.words).render(
+            anchor=anchor, max_words=max_words, realign=realign, split=split, min_words=min_words
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if format == "txt":
+        return PlainTextResponse(format_transcript(sentences))
+    if format == "srt":
+        srt = io.StringIO()
+        write_srt(sentences, srt)
+        return PlainTextResponse(srt.getvalue(), media_type="application/x-subrip")
+    return {"id": transcribe_id, "sentences": sentences}
+
+'''Download the text of a transcript.
+    The body is streamed from the blob store and decompressed on the fly, so even long
+    transcripts are never held in memory as a whole.'''
+@router.get("/transcribe/{transcribe_id}/text",
+            tags=["Get Audio Transcribe"],
+            description="Stream the text of a transcript.")
+def stream_audio_transcribe_text(
+    transcribe_id: int,
+    db: Session = Depends(get_db),
+    current_user: str = Depends(get_current_active_user)
+):
+    # This loads the conversion and checks that the current user may read it.
+    db_audio_transcribe = db.query(AudioConversion).filter(AudioConversion.id == transcribe_id).first()
+    if db_audio_transcribe is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Audiotranscribe: {transcribe_id} not found")
+    if (not current_user.is_admin) and (current_user.id != db_audio_transcribe.user_id):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to perform request action.")
+    headers = {"Content-Length": str(db_audio_transcribe.text_size)} if db_audio_transcribe.text_size is not None else None
+    return StreamingResponse(db_audio_transcribe.stream_text(), media_type="text/plain; charset=utf-8", headers=headers)
+
+'''Enroll a speaker of a stored transcript under a name.
+    Later jobs of the same user label speakers that sound like this one with the name,
+    and the transcript itself is relabelled. An empty name forgets the enrollment.'''
+@router.put("/transcribe/{transcribe_id}/speakers/{speaker}",
+            tags=["Speakers"],
+            description="Name a speaker of a transcript so later transcripts recognize them.")
+def enroll_speaker(
+    transcribe_id: int,
+    speaker: int,
+    name: str = Form(""),  # The name of the speaker; empty to forget it.
+    db: Session = Depends(get_db),
+    current_user: str = Depends(get_current_active_user)
+):
+    # This loads the conversion; only its owner can enroll its speakers, in their own index.
+    db_audio_transcribe = db.query(AudioConversion).filter(AudioConversion.id == transcribe_id).first()
+    if db_audio_transcribe is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Audiotranscribe: {transcribe_id} not found")
+    if current_user.id != db_audio_transcribe.user_id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to perform request action.")
+    name = name.strip()
+    enrolled = speaker_indexes.get(current_user.id).enroll(transcribe_id, speaker, name or None)
+    if not enrolled:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Speaker {speaker} of transcript {transcribe_id} is not indexed")
+
+    # This relabels the stored transcript with the name.
+    if db_audio_transcribe.words is not None:
+        transcript = WordTranscript.from_bytes(db_audio_transcribe.words)
+        if name:
+            transcript.speaker_names[speaker] = name
+        else:
+            transcript.speaker_names.pop(speaker, None)
+        sentences = transcript.render()
+        replaced = [db_audio_transcribe.text_blob, db_audio_transcribe.words_blob]
+        db_audio_transcribe.words = transcript.to_bytes()
+        db_audio_transcribe.text_content = format_transcript(sentences)
+        db_audio_transcribe.segments = transcript_segments(sentences, current_user.id)
+        db.commit()
+        # the blobs of the previous rendering are deleted unless another conversion has the same content
+        release_blobs(db, replaced)
+    return {"id": transcribe_id, "speaker": speaker, "name": name or None}
+
+'''List the speaker names the current user has enrolled.'''
+@router.get("/speakers",
+            tags=["Speakers"],
+            description="List the enrolled speaker names and how many voice samples each one has.")
+def read_speakers(current_user: str = Depends(get_current_active_user)):
+    names = speaker_indexes.get(current_user.id).names()
+    return [{"name": name, "samples": samples} for name, samples in sorted(names.items())]
+
 '''This is a decorator that defines a DELETE route at "/transcribe/{transcribe_id}". 
 It also sets some metadata for the route like tags, description, and the response model. '''
 @router.delete("/transcribe/{transcribe_id}", 
@@ -102,17 +806,17 @@ It also sets some metadata for the route like tags, description, and the respons
                 description="Delete an audio transcribe.",
                response_model=dict)
 def delete_audio_transcribe(
-    audio_transcribe_id: int,
+    transcribe_id: int,
     db: Session = Depends(get_db),
     current_user: str = Depends(get_current_active_user)
 ):
 
     # This queries the database for an AudioConversion object with the given id.
-    db_audio_transcribe = db.query(AudioConversion).filter(AudioConversion.id == audio_transcribe_id).first()
+    db_audio_transcribe = db.query(AudioConversion).filter(AudioConversion.id == transcribe_id).first()
 
     # If no such object is found, it raises an HTTPException with a status code of 404 and a detail message.
     if db_audio_transcribe is None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Audiotranscribe with ID {audio_transcribe_id} not found")
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Audiotranscribe with ID {transcribe_id} not found")
 
     # If the current user is not an admin and they are not the owner of the audio transcribe, 
     # it raises an HTTPException with a status code of 403 and a detail message.
@@ -120,8 +824,19 @@ def delete_audio_transcribe(
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to delete this Audiotranscribe")
 
     # If the current user is an admin or they are the owner of the audio transcribe, it deletes the audio transcribe from the database.
+    blobs = [db_audio_transcribe.text_blob, db_audio_transcribe.words_blob]
+    checkpoint_keys = db_audio_transcribe.checkpoint_keys
     db.delete(db_audio_transcribe)
     db.commit()
 
+    # This deletes its text and words from the blob store, unless another conversion has the same content.
+    release_blobs(db, blobs)
+
+    # This deletes the stems, segments and embeddings of its audio that the pipeline checkpointed.
+    purge_checkpoints(checkpoint_keys)
+
+    # This forgets the voices of its speakers, and the names enrolled on them, in the owner's speaker index.
+    speaker_indexes.get(db_audio_transcribe.user_id).remove(transcribe_id)
+
     # It then returns a success message.
-    return {"detail": f"Audiotranscribe: {audio_transcribe_id} deleted successfully"}
\ No newline at end of file
+    return {"detail": f"Audiotranscribe: {transcribe_id} deleted successfully"}
\ No newline at end of file
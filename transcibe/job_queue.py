@@ -0,0 +1,412 @@
+# Durable job queue in PostgreSQL
+# The API inserts a transcription_jobs row and stores the audio in the blob store; any number of
+# `manage.py worker` processes claim rows with SELECT ... FOR UPDATE SKIP LOCKED, so workers never
+# wait on each other and no broker is needed. A claimed job carries a lease that the worker
+# extends with heartbeats. When a worker dies its lease runs out and the next worker that reaps
+# puts the job back in the queue, until max_attempts is used up and the job is dead-lettered.
+import os
+import uuid
+import random
+import socket
+import asyncio
+import logging
+from datetime import timedelta
+
+from sqlalchemy import select, update, func, case, exists
+from sqlalchemy.orm import aliased
+from starlette.concurrency import run_in_threadpool
+
+from app.blobs import delete_blob, lock_blob
+from app.core.config import settings
+from app.db.models import TranscriptionJob
+from app.metrics import job_queue_events
+
+ACTIVE_STATUSES = ("queued", "running")
+TERMINAL_STATUSES = ("done", "failed", "dead")
+
+
+class LeaseLost(Exception):
+    """The job was given to another worker, so this worker must not finish it."""
+
+
+class JobFailed(Exception):
+    """A failure that retrying does not fix, such as missing credit; the job fails without a retry."""
+
+
+def seconds(value):
+    return timedelta(seconds=value)
+
+
+def enqueue(db, user_id, profile, options, audio_blob, filename=None, audio_duration=None, weight=1.0, max_attempts=None):
+    """Insert a queued job and commit it; workers can claim it from then on."""
+    job = TranscriptionJob(
+        id=uuid.uuid4().hex,
+        user_id=user_id,
+        status="queued",
+        profile=profile,
+        filename=filename,
+        options=options,
+        audio_blob=audio_blob,
+        audio_duration=audio_duration,
+        weight=weight,
+        max_attempts=max_attempts or settings.JOB_MAX_ATTEMPTS,
+    )
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    return job
+
+
+def claim_order(aging_rate):
+    """The order in which queued jobs are claimed, the same policy as scheduler.FairScheduler.
+
+    Users with the fewest running jobs for their weight go first, so one user's backlog does not
+    take every worker. Among their jobs the shortest probed file goes first, and every second
+    of waiting counts as aging_rate seconds less, so long files still start.
+    """
+    running = aliased(TranscriptionJob)
+    running_jobs = (
+        select(func.count())
+        .where(running.user_id == TranscriptionJob.user_id, running.status == "running")
+        .scalar_subquery()
+    )
+    waited = func.extract("epoch", func.now() - TranscriptionJob.created_at)
+    return (
+        running_jobs / TranscriptionJob.weight,
+        func.coalesce(TranscriptionJob.audio_duration, 0) - aging_rate * waited,
+        TranscriptionJob.available_at,
+    )
+
+
+def claim_statement(worker_id, visibility_timeout, aging_rate=None):
+    # one statement: the subquery locks the first available row in claim order that no other
+    # worker has locked, and the update leases it; concurrent workers skip each other's rows
+    # instead of blocking
+    aging_rate = settings.SCHEDULER_AGING_RATE if aging_rate is None else aging_rate
+    candidate = (
+        select(TranscriptionJob.id)
+        .where(TranscriptionJob.status == "queued", TranscriptionJob.available_at <= func.now())
+        .order_by(*claim_order(aging_rate))
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    return (
+        update(TranscriptionJob)
+        .where(TranscriptionJob.id == candidate)
+        .values(
+            status="running",
+            attempts=TranscriptionJob.attempts + 1,
+            worker_id=worker_id,
+            lease_expires_at=func.now() + seconds(visibility_timeout),
+            heartbeat_at=func.now(),
+            started_at=func.now(),
+            stage=None,
+            percent=None,
+            eta=None,
+            version=TranscriptionJob.version + 1,
+        )
+        .returning(TranscriptionJob)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def backoff(retry_backoff):
+    """Seconds before a job is retried: retry_backoff after the first attempt, doubled for every further one."""
+    return seconds(retry_backoff) * func.power(2, func.greatest(TranscriptionJob.attempts - 1, 0))
+
+
+def reap_statement(limit=100, retry_backoff=None):
+    # jobs whose worker stopped sending heartbeats go back to the queue with the same backoff as
+    # failed jobs, so a job that keeps killing its worker is not picked up again right away, or
+    # to the dead letters
+    retry_backoff = settings.JOB_RETRY_BACKOFF if retry_backoff is None else retry_backoff
+    expired = (
+        select(TranscriptionJob.id)
+        .where(TranscriptionJob.status == "running", TranscriptionJob.lease_expires_at < func.now())
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    exhausted = TranscriptionJob.attempts >= TranscriptionJob.max_attempts
+    return (
+        update(TranscriptionJob)
+        .where(TranscriptionJob.id.in_(expired))
+        .values(
+            status=case((exhausted, "dead"), else_="queued"),
+            worker_id=None,
+            lease_expires_at=None,
+            available_at=func.now() + backoff(retry_backoff),
+            finished_at=case((exhausted, func.now()), else_=None),
+            error="The worker stopped sending heartbeats",
+            version=TranscriptionJob.version + 1,
+        )
+        .returning(TranscriptionJob.id, TranscriptionJob.status)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def leased(job_id, worker_id):
+    return (TranscriptionJob.id == job_id, TranscriptionJob.worker_id == worker_id, TranscriptionJob.status == "running")
+
+
+def claim(db, worker_id, visibility_timeout):
+    """Lease the next available job to a worker, in claim order; None when the queue is empty."""
+    job = db.execute(claim_statement(worker_id, visibility_timeout)).scalars().first()
+    db.commit()
+    if job is not None:
+        db.refresh(job)
+        job_queue_events.labels("claimed").inc()
+    return job
+
+
+def heartbeat(db, job_id, worker_id, visibility_timeout, **progress):
+    """Extend the lease of a running job and record its progress; False when the lease was lost."""
+    values = dict(lease_expires_at=func.now() + seconds(visibility_timeout), heartbeat_at=func.now())
+    if progress:
+        values.update(progress, version=TranscriptionJob.version + 1)
+    result = db.execute(
+        update(TranscriptionJob).where(*leased(job_id, worker_id)).values(**values)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return result.rowcount == 1
+
+
+def finish(db, job_id, worker_id):
+    """Lock a leased job and mark it done, in the caller's transaction.
+
+    The caller stores the result in the same transaction, so a job is either done with its
+    result or still leased; raises LeaseLost when another worker took it over.
+    """
+    job = db.query(TranscriptionJob).filter(*leased(job_id, worker_id)).with_for_update().first()
+    if job is None:
+        raise LeaseLost(f"Job {job_id} is no longer leased to {worker_id}")
+    job.status = "done"
+    job.stage = job.eta = None
+    job.percent = 100.0
+    job.error = None
+    job.worker_id = job.lease_expires_at = None
+    job.finished_at = func.now()
+    job.version = TranscriptionJob.version + 1
+    return job
+
+
+def fail(db, job_id, worker_id, error, retry=True, retry_backoff=0.0):
+    """Give up the lease of a failed job: it is queued again after the backoff while it has
+    attempts left, else dead-lettered. Without retry it fails right away. Returns the new status."""
+    exhausted = TranscriptionJob.attempts >= TranscriptionJob.max_attempts
+    status = case((exhausted, "dead"), else_="queued") if retry else "failed"
+    result = db.execute(
+        update(TranscriptionJob).where(*leased(job_id, worker_id))
+        .values(
+            status=status,
+            worker_id=None,
+            lease_expires_at=None,
+            available_at=func.now() + backoff(retry_backoff),
+            finished_at=case((exhausted, func.now()), else_=None) if retry else func.now(),
+            error=error,
+            version=TranscriptionJob.version + 1,
+        )
+        .returning(TranscriptionJob.status)
+        .execution_options(synchronize_session=False)
+    )
+    status = result.scalar()
+    db.commit()
+    if status is not None:
+        job_queue_events.labels("retried" if status == "queued" else status).inc()
+    return status
+
+
+def reap(db, limit=100, retry_backoff=None):
+    """Put the jobs of dead workers back in the queue; returns {job_id: new status}."""
+    reaped = dict(db.execute(reap_statement(limit, retry_backoff)).all())
+    db.commit()
+    for status in reaped.values():
+        job_queue_events.labels("reaped" if status == "queued" else "dead").inc()
+    return reaped
+
+
+def requeue(db, job_ids=None):
+    """Give dead-lettered jobs, or only the given ones, a new set of attempts; returns how many."""
+    statement = update(TranscriptionJob).where(TranscriptionJob.status == "dead")
+    if job_ids:
+        statement = statement.where(TranscriptionJob.id.in_(job_ids))
+    result = db.execute(
+        statement.values(status="queued", attempts=0, available_at=func.now(), finished_at=None, error=None,
+                         version=TranscriptionJob.version + 1)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return result.rowcount
+
+
+def release_audio(db, job):
+    """Delete the audio of a finished job unless another queued, running or dead job has the same file.
+
+    The check runs under the lock_blob that queue_job holds until a new job with the file is
+    committed, so a job queued meanwhile is either seen here or finds the blob gone and writes it.
+    """
+    lock_blob(db, job.audio_blob)
+    shared = db.query(exists().where(
+        TranscriptionJob.audio_blob == job.audio_blob,
+        TranscriptionJob.id != job.id,
+        TranscriptionJob.status.in_(ACTIVE_STATUSES + ("dead",)),
+    )).scalar()
+    if not shared:
+        delete_blob(job.audio_blob)
+    db.commit()
+
+
+def get(db, job_id):
+    return db.query(TranscriptionJob).filter(TranscriptionJob.id == job_id).first()
+
+
+def event(job):
+    """The Server-Sent Event of the current state of a job, like the events of jobs.JobManager."""
+    if job.status == "queued":
+        name, data = "queued", {}
+    elif job.status == "running":
+        name, data = "progress", dict(stage=job.stage, status="running", percent=job.percent, eta=job.eta)
+    elif job.status == "done":
+        name, data = "done", dict(conversion_id=job.conversion_id)
+    else:
+        name, data = "failed", dict(error=job.error)
+    return {"id": job.version, "event": name, "data": dict(data, job_id=job.id)}
+
+
+async def watch(session_factory, job_id, last_event_id=None, interval=1.0):
+    """Yield the state of a queued job each time it changes, until it is finished.
+
+    The event id is the version of the row, so a client that reconnects with Last-Event-ID gets
+    the current state if it changed since, but not every progress event in between.
+    """
+    seen = last_event_id
+    while True:
+        def load():
+            with session_factory() as db:
+                job = get(db, job_id)
+                return job.status, event(job)
+        status, message = await run_in_threadpool(load)
+        if seen is None or message["id"] > seen:
+            seen = message["id"]
+            yield message
+        if status in TERMINAL_STATUSES:
+            return
+        await asyncio.sleep(interval)
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+class Worker:
+    """Claims jobs from the queue and runs up to `concurrency` of them at a time.
+
+    `execute(job, worker_id, progress)` is a coroutine that transcribes a claimed job and stores
+    its result together with `finish`. While it runs the worker sends heartbeats with the latest
+    progress; when a heartbeat finds the lease lost, the job is abandoned.
+    """
+
+    def __init__(self, session_factory, execute, worker_id=None, concurrency=1, poll_interval=None,
+                 visibility_timeout=None, heartbeat_interval=None, retry_backoff=None):
+        self.session_factory = session_factory
+        self.execute = execute
+        self.worker_id = worker_id or default_worker_id()
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval if poll_interval is not None else settings.JOB_POLL_INTERVAL
+        self.visibility_timeout = visibility_timeout if visibility_timeout is not None else settings.JOB_VISIBILITY_TIMEOUT
+        self.heartbeat_interval = heartbeat_interval if heartbeat_interval is not None else settings.JOB_HEARTBEAT_INTERVAL
+        self.retry_backoff = retry_backoff if retry_backoff is not None else settings.JOB_RETRY_BACKOFF
+        self.stopping = asyncio.Event()
+
+    def _claim(self):
+        with self.session_factory() as db:
+            reap(db, retry_backoff=self.retry_backoff)
+            job = claim(db, self.worker_id, self.visibility_timeout)
+            if job is not None:
+                db.expunge(job)
+            return job
+
+    def _heartbeat(self, job_id, progress):
+        with self.session_factory() as db:
+            return heartbeat(db, job_id, self.worker_id, self.visibility_timeout, **progress)
+
+    def _fail(self, job, error, retry):
+        with self.session_factory() as db:
+            status = fail(db, job.id, self.worker_id, error, retry=retry, retry_backoff=self.retry_backoff)
+            if status == "failed":
+                release_audio(db, job)
+        return status
+
+    def _release(self, job):
+        with self.session_factory() as db:
+            release_audio(db, job)
+
+    async def run(self):
+        """Work off the queue until stop() is called, then let the running jobs finish."""
+        running = set()
+        while not self.stopping.is_set():
+            while len(running) < self.concurrency and not self.stopping.is_set():
+                job = await run_in_threadpool(self._claim)
+                if job is None:
+                    break
+                running.add(asyncio.create_task(self.process(job)))
+            # idle workers poll with jitter, so they do not all hit the table at once
+            timeout = self.poll_interval * random.uniform(0.5, 1.5)
+            if running:
+                done, running = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            else:
+                try:
+                    await asyncio.wait_for(self.stopping.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+        if running:
+            await asyncio.wait(running)
+
+    def stop(self):
+        self.stopping.set()
+
+    async def process(self, job):
+        progress = {}
+
+        def on_progress(stage, status, **details):
+            progress["stage"] = stage
+            if stage == "asr":
+                progress["percent"] = 100.0 if status == "done" else details.get("percent", progress.get("percent"))
+                progress["eta"] = 0 if status == "done" else details.get("eta", progress.get("eta"))
+
+        logging.info(f"Worker {self.worker_id} started job {job.id}, attempt {job.attempts} of {job.max_attempts}")
+        task = asyncio.create_task(self.execute(job, self.worker_id, on_progress))
+        reported, lost = {}, False
+        while not lost:
+            done, _ = await asyncio.wait({task}, timeout=self.heartbeat_interval)
+            if done:
+                break
+            # progress is only written when it changed, so an idle stage does not wake up event streams
+            changed = dict(progress) if progress != reported else {}
+            try:
+                lost = not await run_in_threadpool(self._heartbeat, job.id, changed)
+                reported = dict(progress)
+            except Exception:
+                # a database hiccup; the lease outlasts several heartbeats
+                logging.exception(f"Heartbeat of job {job.id} failed")
+        if lost:
+            task.cancel()
+        try:
+            await task
+        except (LeaseLost, asyncio.CancelledError) as e:
+            if isinstance(e, asyncio.CancelledError) and not lost:
+                raise
+            logging.warning(f"Worker {self.worker_id} lost the lease of job {job.id}")
+            job_queue_events.labels("lease_lost").inc()
+            return
+        except JobFailed as e:
+            await run_in_threadpool(self._fail, job, str(e), False)
+            return
+        except Exception as e:
+            logging.exception(f"Job {job.id} failed on attempt {job.attempts}")
+            status = await run_in_threadpool(self._fail, job, str(e), True)
+            logging.info(f"Job {job.id} is {status}")
+            return
+        job_queue_events.labels("done").inc()
+        await run_in_threadpool(self._release, job)
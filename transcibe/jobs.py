@@ -0,0 +1,138 @@
+# Transcription jobs that run in the background and report their progress
+# Every job keeps the list of its progress events. Subscribers get the events published so far
+# and then every new one, so a client that reconnects with Last-Event-ID misses nothing.
+import time
+import uuid
+import asyncio
+import threading
+
+TERMINAL_STATUSES = ("done", "failed")
+
+
+class Job:
+    def __init__(self, user_id, profile=None, filename=None):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.profile = profile
+        self.filename = filename
+        self.status = "queued"
+        self.stage = None
+        self.percent = None
+        self.eta = None
+        self.conversion_id = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self.events = []
+        self.task = None  # the asyncio task running the job, kept so it is not garbage collected
+
+    @property
+    def is_finished(self):
+        return self.status in TERMINAL_STATUSES
+
+    def snapshot(self):
+        return {
+            "id": self.id,
+            "status": self.status,
+            "profile": self.profile,
+            "filename": self.filename,
+            "stage": self.stage,
+            "percent": self.percent,
+            "eta": self.eta,
+            "conversion_id": self.conversion_id,
+            "error": self.error,
+        }
+
+
+class JobManager:
+    """In-memory registry of the jobs of this process.
+
+    `publish` may be called from the worker thread that runs the pipeline; subscribers are
+    woken up on their event loop. Finished jobs are forgotten after `retention` seconds.
+    """
+
+    def __init__(self, retention=3600):
+        self.retention = retention
+        self._jobs = {}
+        self._subscribers = {}  # job id -> [(loop, asyncio.Queue)]
+        self._lock = threading.Lock()
+
+    def create(self, user_id, profile=None, filename=None):
+        job = Job(user_id, profile=profile, filename=filename)
+        with self._lock:
+            self._expire()
+            self._jobs[job.id] = job
+        self.publish(job.id, "queued")
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def publish(self, job_id, event, **data):
+        """Record an event of a job and push it to its subscribers.
+
+        "progress" events carry the stage and its status, "done" and "failed" end the job.
+        """
+        with self._lock:
+            job = self._jobs[job_id]
+            if event == "progress":
+                job.status = "running"
+                job.stage = data.get("stage")
+                if data.get("stage") == "asr":
+                    job.percent = 100.0 if data.get("status") == "done" else data.get("percent", job.percent)
+                    job.eta = 0 if data.get("status") == "done" else data.get("eta", job.eta)
+            elif event in TERMINAL_STATUSES:
+                job.status = event
+                job.finished = time.time()
+                job.conversion_id = data.get("conversion_id")
+                job.error = data.get("error")
+            message = {"id": len(job.events), "event": event, "data": dict(data, job_id=job_id)}
+            job.events.append(message)
+            subscribers = list(self._subscribers.get(job_id, []))
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(queue.put_nowait, message)
+
+    def progress_callback(self, job_id):
+        """Callback for the `progress` argument of diarization.diarize.transcribe."""
+        def progress(stage, status, **details):
+            self.publish(job_id, "progress", stage=stage, status=status, **details)
+        return progress
+
+    async def subscribe(self, job_id, last_event_id=None):
+        """Yield the events of a job after last_event_id, until the job is finished."""
+        queue = asyncio.Queue()
+        with self._lock:
+            job = self._jobs[job_id]
+            backlog = [message for message in job.events if last_event_id is None or message["id"] > last_event_id]
+            self._subscribers.setdefault(job_id, []).append((asyncio.get_running_loop(), queue))
+        try:
+            seen = last_event_id
+            for message in backlog:
+                seen = message["id"]
+                yield message
+                if message["event"] in TERMINAL_STATUSES:
+                    return
+            while True:
+                message = await queue.get()
+                if seen is not None and message["id"] <= seen:
+                    continue
+                seen = message["id"]
+                yield message
+                if message["event"] in TERMINAL_STATUSES:
+                    return
+        finally:
+            with self._lock:
+                subscribers = self._subscribers.get(job_id, [])
+                subscribers[:] = [entry for entry in subscribers if entry[1] is not queue]
+                if not subscribers:
+                    self._subscribers.pop(job_id, None)
+
+    def _expire(self):
+        now = time.time()
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job.is_finished and now - job.finished > self.retention]:
+            del self._jobs[job_id]
+
+
+job_manager = JobManager()
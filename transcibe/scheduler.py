@@ -0,0 +1,183 @@
+# Fair-share scheduling of transcription jobs
+# A process runs at most `slots` pipelines at a time. When more jobs are waiting, the slot that
+# frees up goes to the user with the smallest virtual finish tag (start-time fair queuing): every
+# job advances its user's tag by its expected duration divided by the user's weight, so a user
+# with fifty hour-long files gets their share of the slots and not all of them. Within a user's
+# own queue the shortest probed file goes first, and waiting time is subtracted from the
+# duration so that long files are not postponed forever.
+import io
+import os
+import time
+import wave
+import asyncio
+from contextlib import asynccontextmanager
+
+from app.core.config import settings
+from app.metrics import queue_depth, job_wait_seconds
+
+# rough bytes per second of compressed uploads, for files whose duration can not be probed
+FALLBACK_BYTES_PER_SECOND = 16000
+
+
+def probe_duration(content=None, path=None):
+    """Seconds of audio in an upload, from its WAV header or ffprobe, else estimated from its size."""
+    try:
+        with wave.open(io.BytesIO(content) if content is not None else path, "rb") as f:
+            return f.getnframes() / f.getframerate()
+    except (wave.Error, EOFError, OSError):
+        pass
+    if path is not None:
+        try:
+            from pydub.utils import mediainfo
+            return float(mediainfo(path)["duration"])
+        except Exception:
+            pass
+    size = len(content) if content is not None else _file_size(path)
+    return size / FALLBACK_BYTES_PER_SECOND
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def user_tier(user):
+    return getattr(user, "tier", None) or settings.DEFAULT_TIER
+
+
+def user_weight(user):
+    """The share of a user: admins get ADMIN_WEIGHT, everyone else the weight of their tier."""
+    if getattr(user, "is_admin", False):
+        return settings.SCHEDULER_ADMIN_WEIGHT
+    return settings.SCHEDULER_TIER_WEIGHTS.get(user_tier(user), 1.0)
+
+
+class Ticket:
+    def __init__(self, user_id, weight, duration, tier=None):
+        self.user_id = user_id
+        self.weight = max(weight, 1e-6)
+        self.duration = duration
+        self.tier = tier
+        self.enqueued = time.monotonic()
+        self.started = None
+        self.future = None
+
+
+class FairScheduler:
+    """Grants the pipeline slots of this process to waiting jobs, fairly between users.
+
+    All methods run on the event loop. `aging_rate` is how many seconds of expected duration a
+    job is forgiven per second it waited, when its user's queue is sorted shortest first.
+    """
+
+    def __init__(self, slots=2, aging_rate=1.0, min_cost=1.0):
+        self.slots = slots
+        self.aging_rate = aging_rate
+        self.min_cost = min_cost
+        self._waiting = {}  # user_id -> [Ticket]
+        self._finish = {}  # user_id -> virtual finish tag of the user's last started job
+        self._virtual = 0.0
+        self._running = {}  # user_id -> number of running jobs
+        self._waits = {}  # user_id -> [jobs started, seconds waited in total]
+
+    @asynccontextmanager
+    async def slot(self, user_id, weight=1.0, duration=0.0, tier=None):
+        """Wait for a pipeline slot and hold it for the block."""
+        ticket = await self.acquire(user_id, weight, duration, tier)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    async def acquire(self, user_id, weight=1.0, duration=0.0, tier=None):
+        ticket = Ticket(user_id, weight, duration, tier)
+        ticket.future = asyncio.get_running_loop().create_future()
+        self._waiting.setdefault(user_id, []).append(ticket)
+        self._dispatch()
+        try:
+            await ticket.future
+        except asyncio.CancelledError:
+            if ticket.started is not None:
+                self.release(ticket)
+            else:
+                self._remove(ticket)
+            raise
+        return ticket
+
+    def release(self, ticket):
+        self._running[ticket.user_id] -= 1
+        if not self._running[ticket.user_id]:
+            del self._running[ticket.user_id]
+        self._dispatch()
+
+    def _remove(self, ticket):
+        tickets = self._waiting.get(ticket.user_id, [])
+        if ticket in tickets:
+            tickets.remove(ticket)
+        if not tickets:
+            self._waiting.pop(ticket.user_id, None)
+
+    def _priority(self, ticket, now):
+        return ticket.duration - self.aging_rate * (now - ticket.enqueued)
+
+    def _next(self):
+        now = time.monotonic()
+        best = None
+        for user_id, tickets in self._waiting.items():
+            ticket = min(tickets, key=lambda ticket: self._priority(ticket, now))
+            start = max(self._virtual, self._finish.get(user_id, 0.0))
+            finish = start + max(ticket.duration, self.min_cost) / ticket.weight
+            if best is None or finish < best[0]:
+                best = (finish, start, ticket)
+        return best
+
+    def _dispatch(self):
+        while self._waiting and sum(self._running.values()) < self.slots:
+            finish, start, ticket = self._next()
+            self._remove(ticket)
+            self._virtual = max(self._virtual, start)
+            self._finish[ticket.user_id] = finish
+            self._running[ticket.user_id] = self._running.get(ticket.user_id, 0) + 1
+            ticket.started = time.monotonic()
+            waited = ticket.started - ticket.enqueued
+            totals = self._waits.setdefault(ticket.user_id, [0, 0.0])
+            totals[0] += 1
+            totals[1] += waited
+            job_wait_seconds.labels(ticket.tier or settings.DEFAULT_TIER).observe(waited)
+            if not ticket.future.done():
+                ticket.future.set_result(ticket)
+        if not self._waiting:
+            # nobody is behind anyone, so old tags carry no information any more
+            self._finish = {user_id: tag for user_id, tag in self._finish.items() if user_id in self._running}
+
+    def queue_depth(self):
+        return sum(len(tickets) for tickets in self._waiting.values())
+
+    def stats(self, user_id=None):
+        """Per-user queue state: waiting and running jobs, the longest current wait and the average wait."""
+        now = time.monotonic()
+        users = set(self._waiting) | set(self._running) | set(self._waits)
+        if user_id is not None:
+            users = {user_id}
+        result = []
+        for user in sorted(users):
+            tickets = self._waiting.get(user, [])
+            started, waited = self._waits.get(user, [0, 0.0])
+            result.append({
+                "user_id": user,
+                "waiting": len(tickets),
+                "running": self._running.get(user, 0),
+                "longest_wait": round(max((now - ticket.enqueued for ticket in tickets), default=0.0), 2),
+                "average_wait": round(waited / started, 2) if started else None,
+                "started": started,
+            })
+        return result
+
+
+job_scheduler = FairScheduler(
+    slots=settings.SCHEDULER_SLOTS,
+    aging_rate=settings.SCHEDULER_AGING_RATE,
+)
+queue_depth.labels("jobs").set_function(job_scheduler.queue_depth)
@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import List, Optional
 from pydantic import BaseModel,field_validator
 from datetime import datetime
 from app import settings
@@ -8,15 +8,80 @@ from users.schemas import UserInDB
 # class AudioConversionCreate(BaseModel):
 #     audio_file: UploadFile = File(None)
 
-class AudioConversionResponse(BaseModel):
+class AudioConversionSummary(BaseModel):
+    # a conversion without its transcript, which would cost a blob read per listed row
     id: int
-    text_content: str
     user: UserInDB
     created_at: Optional[datetime]
+    profile: Optional[str] = None
+    audio_duration: Optional[float] = None
+    processing_time: Optional[float] = None
+    real_time_factor: Optional[float] = None
+    credits_charged: Optional[int] = None
+    text_size: Optional[int] = None  # bytes of the stored transcript, when it is a blob
     
     @field_validator("created_at", mode="before")
     def default_datetime(cls, value: datetime) -> datetime:
         return value or datetime.now()
 
     class Config:
-        orm_mode = True
\ No newline at end of file
+        orm_mode = True
+
+class AudioConversionResponse(AudioConversionSummary):
+    text_content: str
+
+'''Transcription Profile Schemas'''
+class TranscriptionProfileResponse(BaseModel):
+    name: str
+    whisper_model: str
+    beam_size: int
+    stemming: bool
+    align: bool
+    punctuate: bool
+    diarization: str
+    credit_rate: float
+    # measured over the stored conversions of this profile
+    conversions: int = 0
+    average_real_time_factor: Optional[float] = None
+
+'''Transcription Job Schemas'''
+class TranscriptionJobResponse(BaseModel):
+    id: str
+    status: str
+    profile: Optional[str] = None
+    filename: Optional[str] = None
+    stage: Optional[str] = None
+    # ASR progress and the estimated seconds left in ASR
+    percent: Optional[float] = None
+    eta: Optional[float] = None
+    conversion_id: Optional[int] = None
+    error: Optional[str] = None
+
+'''Job Queue Schemas'''
+class JobQueueResponse(BaseModel):
+    user_id: int
+    waiting: int
+    running: int
+    # seconds; the wait of the oldest waiting job and the mean wait of the jobs that started
+    longest_wait: float
+    average_wait: Optional[float] = None
+    started: int
+
+'''Transcript Search Schemas'''
+class TranscriptSearchHit(BaseModel):
+    conversion_id: int
+    position: int
+    speaker: Optional[str] = None
+    # ms; missing for transcripts stored before segments were kept
+    start_time: Optional[int] = None
+    end_time: Optional[int] = None
+    rank: float
+    # the matching text with the hits wrapped in <mark></mark>
+    snippet: str
+
+class TranscriptSearchResponse(BaseModel):
+    query: str
+    total: int
+    page: int
+    page_size: int
+    hits: List[TranscriptSearchHit]
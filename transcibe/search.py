@@ -0,0 +1,81 @@
+# Full-text search over the transcripts of a user
+# Every conversion is stored as one row per speaker block in transcript_segments. PostgreSQL keeps
+# a tsvector of each block in a generated column with a GIN index, so a search is an index scan
+# instead of downloading every transcript. The 'simple' configuration does not stem or drop stop
+# words, which keeps it correct for every transcription language.
+from sqlalchemy import select, func, desc
+
+from app.db.models import TranscriptSegment
+
+SEARCH_CONFIG = "simple"
+HEADLINE_OPTIONS = "StartSel=<mark>, StopSel=</mark>, MaxWords=35, MinWords=15, MaxFragments=2"
+
+
+def parse_transcript(text_content):
+    """The "Speaker: text" blocks of a formatted transcript, as sentences without times."""
+    sentences = []
+    for block in text_content.strip("\n").split("\n\n"):
+        if not block:
+            continue
+        speaker, separator, text = block.partition(": ")
+        if not separator:
+            speaker, text = None, block
+        sentences.append({"speaker": speaker, "start_time": None, "end_time": None, "text": text})
+    return sentences
+
+
+def transcript_segments(sentences, user_id):
+    """TranscriptSegment rows of rendered sentences, in order."""
+    return [
+        TranscriptSegment(
+            user_id=user_id,
+            position=position,
+            speaker=sentence["speaker"],
+            start_time=sentence["start_time"],
+            end_time=sentence["end_time"],
+            text=sentence["text"].strip(),
+        )
+        for position, sentence in enumerate(sentences)
+        if sentence["text"].strip()
+    ]
+
+
+def search_query(q):
+    # web-search syntax: "quoted phrases", or, and -excluded words; never a syntax error
+    return func.websearch_to_tsquery(SEARCH_CONFIG, q)
+
+
+def count_statement(user_id, q):
+    query = search_query(q)
+    return (
+        select(func.count())
+        .select_from(TranscriptSegment)
+        .where(TranscriptSegment.user_id == user_id, TranscriptSegment.search_vector.op("@@")(query))
+    )
+
+
+def search_statement(user_id, q, limit, offset):
+    """Ranked hits of one page; snippets are only highlighted for the rows of the page."""
+    query = search_query(q)
+    rank = func.ts_rank_cd(TranscriptSegment.search_vector, query)
+    page = (
+        select(TranscriptSegment.id, rank.label("rank"))
+        .where(TranscriptSegment.user_id == user_id, TranscriptSegment.search_vector.op("@@")(query))
+        .order_by(desc("rank"), TranscriptSegment.conversion_id.desc(), TranscriptSegment.position)
+        .limit(limit)
+        .offset(offset)
+        .subquery()
+    )
+    return (
+        select(
+            TranscriptSegment.conversion_id,
+            TranscriptSegment.position,
+            TranscriptSegment.speaker,
+            TranscriptSegment.start_time,
+            TranscriptSegment.end_time,
+            page.c.rank,
+            func.ts_headline(SEARCH_CONFIG, TranscriptSegment.text, query, HEADLINE_OPTIONS).label("snippet"),
+        )
+        .join(page, page.c.id == TranscriptSegment.id)
+        .order_by(page.c.rank.desc(), TranscriptSegment.conversion_id.desc(), TranscriptSegment.position)
+    )
@@ -0,0 +1,270 @@
+# Resumable uploads in the style of tus (https://tus.io)
+# An upload is created with its total length, which preallocates the file in a new job
+# workspace. Chunks are written at their offset as they arrive, so they can be sent in
+# parallel, and after a dropped connection only the bytes that did not arrive are resent.
+# The state of an upload is a file next to it, so any process that sees the workspace
+# directory can take the next chunk, also after a restart. Once every byte arrived the upload
+# is finalized and the transcription job adopts the workspace, so the file is never copied.
+import os
+import json
+import time
+import fcntl
+import base64
+import hashlib
+import tempfile
+import threading
+from contextlib import contextmanager
+from email.utils import formatdate
+
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from diarization.workspace import Workspace
+
+TUS_VERSION = "1.0.0"
+TUS_EXTENSIONS = "creation,checksum,termination,expiration"
+STATE_FILE = ".upload"
+# received ranges are written to the state file at most this often while a chunk streams in
+STATE_SAVE_INTERVAL = 1.0
+CHECKSUM_ALGORITHM = "sha256"
+# the verified bytes a checksummed resend overwrites are kept in memory up to this size, beyond it in the workspace
+BACKUP_SPOOL_BYTES = 8 * 1024 * 1024
+
+
+class UploadError(Exception):
+    pass
+
+
+class ChecksumMismatch(UploadError):
+    pass
+
+
+def parse_metadata(header):
+    """Decode a tus Upload-Metadata header: comma separated "key base64(value)" pairs."""
+    metadata = {}
+    for pair in filter(None, (pair.strip() for pair in (header or "").split(","))):
+        key, _, value = pair.partition(" ")
+        metadata[key] = base64.b64decode(value).decode("utf-8") if value else ""
+    return metadata
+
+
+def parse_checksum(header):
+    """Decode a tus Upload-Checksum header, "sha256 base64(digest)", into the raw digest."""
+    algorithm, _, digest = (header or "").partition(" ")
+    if algorithm != CHECKSUM_ALGORITHM or not digest:
+        raise UploadError(f"Only {CHECKSUM_ALGORITHM} checksums are supported")
+    return base64.b64decode(digest)
+
+
+def merge_ranges(ranges):
+    """Sorted, non-overlapping [start, end) ranges covering the given ones."""
+    merged = []
+    for range_start, range_end in sorted(ranges):
+        if merged and range_start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], range_end)
+        else:
+            merged.append([range_start, range_end])
+    return merged
+
+
+class Upload:
+    def __init__(self, user_id, length, filename=None, content_type=None, workspace=None):
+        self.user_id = user_id
+        self.length = length
+        self.filename = filename or "upload.wav"
+        self.content_type = content_type
+        self.workspace = workspace or Workspace()
+        self.id = self.workspace.job_id
+        self.received = []  # sorted, non-overlapping [start, end) byte ranges that were verified
+        self.finalized = False
+        self.expires = None
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load(cls, workspace):
+        """The upload whose state is in a workspace, or None when it has none."""
+        try:
+            with open(os.path.join(workspace.root, STATE_FILE), "r") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        upload = cls(state["user_id"], state["length"], state["filename"], state["content_type"], workspace=workspace)
+        upload.received, upload.finalized, upload.expires = state["received"], state["finalized"], state["expires"]
+        return upload
+
+    @property
+    def expires_header(self):
+        """The tus Upload-Expires header, an HTTP date."""
+        return formatdate(self.expires, usegmt=True)
+
+    @contextmanager
+    def _state_lock(self):
+        # other processes serving the same upload write its state too
+        with open(os.path.join(self.workspace.root, STATE_FILE + ".lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def _read_state(self):
+        upload = Upload.load(self.workspace)
+        return upload if upload is not None else self
+
+    def save(self):
+        """Merge the received ranges into the state file and move the expiry to UPLOAD_EXPIRY from now."""
+        with self._state_lock():
+            self._write_state()
+
+    def _write_state(self):
+        stored = self._read_state()
+        with self.lock:
+            self.received = merge_ranges(self.received + stored.received)
+            self.finalized = self.finalized or stored.finalized
+            self.expires = None if self.finalized else time.time() + settings.UPLOAD_EXPIRY
+            state = {"user_id": self.user_id, "length": self.length, "filename": self.filename,
+                     "content_type": self.content_type, "received": self.received,
+                     "finalized": self.finalized, "expires": self.expires}
+        path = os.path.join(self.workspace.root, STATE_FILE)
+        with open(path + ".tmp", "w") as f:
+            json.dump(state, f)
+        os.replace(path + ".tmp", path)
+        # the janitor removes the workspace once the upload expired; a finalized one belongs to its job
+        self.workspace.claim(expires=self.expires)
+
+    def finalize(self):
+        """Hand the workspace to a job in this process; raises UploadError when another request finalized it first."""
+        with self._state_lock():
+            if self._read_state().finalized:
+                raise UploadError("The upload is already finalized")
+            self.finalized = True
+            self._write_state()
+
+    @property
+    def path(self):
+        return os.path.join(self.workspace.root, "upload" + os.path.splitext(self.filename)[1])
+
+    @property
+    def offset(self):
+        """Length of the contiguous prefix that arrived, the tus Upload-Offset."""
+        with self.lock:
+            return self.received[0][1] if self.received and self.received[0][0] == 0 else 0
+
+    @property
+    def is_complete(self):
+        return self.offset == self.length
+
+    def ranges(self):
+        with self.lock:
+            return [tuple(byte_range) for byte_range in self.received]
+
+    def create(self):
+        """Create the workspace and preallocate the file, failing when it would not fit the quota."""
+        self.workspace.create(expires=time.time() + settings.UPLOAD_EXPIRY)
+        try:
+            self.workspace.reserve(self.length)
+            with open(self.path, "wb") as f:
+                f.truncate(self.length)
+            self.save()
+        except Exception:
+            self.workspace.cleanup()
+            raise
+
+    def _overlap(self, start, end):
+        """The received byte ranges within [start, end)."""
+        with self.lock:
+            return [(max(start, range_start), min(end, range_end)) for range_start, range_end in self.received
+                    if range_start < end and range_end > start]
+
+    def _mark_received(self, start, end):
+        with self.lock:
+            self.received = merge_ranges(self.received + [[start, end]])
+
+    async def write_chunk(self, offset, chunks, checksum=None):
+        """Write an async iterable of bytes at offset and return the new Upload-Offset.
+
+        The bytes go straight into the file as they arrive. Without a checksum each piece counts
+        as received once it is written, so a dropped connection keeps what arrived. With a
+        checksum nothing counts until the sha256 of the whole chunk matches; otherwise the
+        received bytes it overwrote are restored, ChecksumMismatch is raised and the client has
+        to send it again.
+        """
+        if self.finalized:
+            raise UploadError("The upload is already finalized")
+        if offset < 0 or offset > self.length:
+            raise UploadError("Upload-Offset is outside of the upload")
+        digest = hashlib.sha256()
+        position = offset
+        saved = time.monotonic()
+        fd = os.open(self.path, os.O_RDWR)
+        try:
+            with tempfile.SpooledTemporaryFile(max_size=BACKUP_SPOOL_BYTES, dir=self.workspace.root) as backup:
+                overwritten = []
+                async for chunk in chunks:
+                    if position + len(chunk) > self.length:
+                        raise UploadError("The chunk goes past Upload-Length")
+                    if checksum is not None:
+                        overwritten += await run_in_threadpool(self._back_up, fd, backup, position, position + len(chunk))
+                    await run_in_threadpool(os.pwrite, fd, chunk, position)
+                    digest.update(chunk)
+                    if checksum is None and chunk:
+                        self._mark_received(position, position + len(chunk))
+                        if time.monotonic() - saved >= STATE_SAVE_INTERVAL:
+                            await run_in_threadpool(self.save)
+                            saved = time.monotonic()
+                    position += len(chunk)
+                if checksum is not None and digest.digest() != checksum:
+                    await run_in_threadpool(self._restore, fd, backup, overwritten)
+                    raise ChecksumMismatch("The chunk does not match its Upload-Checksum")
+        finally:
+            os.close(fd)
+            if checksum is not None and position > offset and digest.digest() == checksum:
+                self._mark_received(offset, position)
+            # what arrived before a dropped connection is saved too
+            await run_in_threadpool(self.save)
+        return self.offset
+
+    def _back_up(self, fd, backup, start, end):
+        """Copy the received bytes within [start, end) to backup before they are overwritten."""
+        ranges = self._overlap(start, end)
+        for range_start, range_end in ranges:
+            backup.write(os.pread(fd, range_end - range_start, range_start))
+        return ranges
+
+    def _restore(self, fd, backup, ranges):
+        backup.seek(0)
+        for range_start, range_end in ranges:
+            os.pwrite(fd, backup.read(range_end - range_start), range_start)
+
+    def file_checksum(self):
+        digest = hashlib.sha256()
+        with open(self.path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        return digest.digest()
+
+
+class UploadManager:
+    """The resumable uploads in the workspace directories, as any process sharing them sees them.
+
+    An upload that received nothing for UPLOAD_EXPIRY seconds is gone; the workspace janitor
+    removes its directory.
+    """
+
+    def create(self, user_id, length, metadata=None):
+        metadata = metadata or {}
+        upload = Upload(user_id, length, filename=metadata.get("filename"), content_type=metadata.get("filetype"))
+        upload.create()
+        return upload
+
+    def get(self, upload_id):
+        workspace = Workspace.find(upload_id)
+        upload = Upload.load(workspace) if workspace is not None else None
+        if upload is None or upload.finalized or upload.expires < time.time():
+            return None
+        return upload
+
+    def terminate(self, upload_id):
+        upload = self.get(upload_id)
+        if upload is not None:
+            upload.workspace.cleanup()
+
+
+upload_manager = UploadManager()
@@ -9,6 +9,9 @@ from ..accounts import generate_username, generate_password
 from ..schemas import UserCreate, UserInDB, UserUpdate, AccessToken
 from users import auth_service, get_current_active_user, user_is_admin
 from app.mail import send_welcome_email
+from app.blobs import release_blobs
+from diarization.speaker_index import speaker_indexes
+from diarization.checkpoints import purge_checkpoints
 
 # Create a new APIRouter instance
 router = APIRouter()
@@ -111,8 +114,14 @@ async def delete_user(username: str, db: Session = Depends(get_db),
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"User: {username} does not exist.")
 
     if admin:
+        blobs = [pointer for conversion in user.audio_conversions for pointer in (conversion.text_blob, conversion.words_blob)]
+        checkpoint_keys = [key for conversion in user.audio_conversions for key in conversion.checkpoint_keys or ()]
         db.delete(user)
         db.commit()
+        # the transcripts, pipeline checkpoints, voices and enrolled names of the user go with them
+        release_blobs(db, blobs)
+        purge_checkpoints(checkpoint_keys)
+        speaker_indexes.drop(user.id)
         return user
     else:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="You are not authorized to delete this user.")
@@ -1,6 +1,6 @@
 from passlib.context import CryptContext
 from datetime import datetime, timedelta
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Query, WebSocket, WebSocketException, status
 from fastapi.security import OAuth2PasswordBearer
 from pydantic import ValidationError
 from app.core.config import settings
@@ -70,6 +70,21 @@ class Authenticate:
             raise credentials_exception
         return user
 
+''' get_websocket_user: This function will take the access token of a WebSocket connection, from the "token" query parameter or the Authorization header, and return the user from the database. Browsers can not set headers on WebSockets, so the OAuth2 bearer dependency can not be used there.'''
+async def get_websocket_user(websocket: WebSocket, token: Optional[str] = Query(None), db: Session = Depends(get_db)) -> UserInDB:
+    credentials_exception = WebSocketException(code=status.WS_1008_POLICY_VIOLATION, reason="Could not validate credentials")
+    if token is None:
+        scheme, _, token = websocket.headers.get("authorization", "").partition(" ")
+        if scheme.lower() != "bearer":
+            token = None
+    if not token:
+        raise credentials_exception
+    token_data = Authenticate().verify_access_token(token=token, credentials_exception=credentials_exception)
+    user = db.query(User).filter(User.username == token_data.username).first()
+    if user is None:
+        raise credentials_exception
+    return user
+
 ''' get_current_active_user: This function will take a UserInDB object and verify that the user is active. If the user is not active, it will raise an HTTPException.'''
 async def get_current_active_user(current_user:UserInDB = Depends(Authenticate().get_current_user)) -> UserInDB:
     if not current_user:
@@ -2,6 +2,7 @@ from pydantic import BaseModel, EmailStr, constr, validator, field_validator
 from datetime import datetime, timedelta
 from app import settings
 from typing import Optional
+from diarization.profiles import profiles
 
 class DateTimeModelMixin(BaseModel):
     created_at: Optional[datetime]
@@ -16,6 +17,8 @@ class UserBase(BaseModel):
     username: Optional[str]
     current_credit: int
     is_superuser: bool = False
+    default_profile: Optional[str] = None
+    tier: Optional[str] = None
 
 class UserCreate(BaseModel):
     email: EmailStr
@@ -32,6 +35,20 @@ class UserInDB(DateTimeModelMixin, UserBase):
 class UserUpdate(BaseModel):
     email: Optional[str] = None
     current_credit: Optional[int] = None
+    default_profile: Optional[str] = None
+    tier: Optional[str] = None
+
+    @field_validator("default_profile")
+    def known_profile(cls, value: Optional[str]) -> Optional[str]:
+        if value is not None and value not in profiles:
+            raise ValueError(f"Unknown transcription profile '{value}'")
+        return value
+
+    @field_validator("tier")
+    def known_tier(cls, value: Optional[str]) -> Optional[str]:
+        if value is not None and value not in settings.SCHEDULER_TIER_WEIGHTS:
+            raise ValueError(f"Unknown account tier '{value}'")
+        return value
 
 class JWTMeta(BaseModel):
     iss: str = settings.JWT_ISSUER # issuer of the token